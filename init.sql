@@ -59,7 +59,8 @@ CREATE TABLE frequencies (
     freq_56      FLOAT  NOT NULL,
     freq_57      FLOAT  NOT NULL,
     freq_58      FLOAT  NOT NULL,
-    freq_59      FLOAT  NOT NULL
+    freq_59      FLOAT  NOT NULL,
+    created_at  TIMESTAMPTZ DEFAULT clock_timestamp()
 );
 
 CREATE TABLE predictions
@@ -68,9 +69,23 @@ CREATE TABLE predictions
     frequencies_id   INT NOT NULL,
     prediction       TEXT  NOT NULL,
     m_probability    FLOAT NOT NULL,
+    created_at       TIMESTAMPTZ DEFAULT clock_timestamp(),
     FOREIGN KEY (frequencies_id) REFERENCES frequencies (id)
 );
 
+CREATE INDEX predictions_frequencies_id_idx ON predictions (frequencies_id);
+
+CREATE FUNCTION notify_new_frequencies() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('new_frequencies', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER frequencies_notify_insert
+AFTER INSERT ON frequencies
+FOR EACH STATEMENT EXECUTE FUNCTION notify_new_frequencies();
+
 INSERT INTO frequencies (freq_0, freq_1, freq_2, freq_3, freq_4, freq_5, freq_6, freq_7, freq_8, freq_9, freq_10, freq_11, freq_12, freq_13, freq_14, freq_15, freq_16, freq_17, freq_18, freq_19, freq_20, freq_21, freq_22, freq_23, freq_24, freq_25, freq_26, freq_27, freq_28, freq_29, freq_30, freq_31, freq_32, freq_33, freq_34, freq_35, freq_36, freq_37, freq_38, freq_39, freq_40, freq_41, freq_42, freq_43, freq_44, freq_45, freq_46, freq_47, freq_48, freq_49, freq_50, freq_51, freq_52, freq_53, freq_54, freq_55, freq_56, freq_57, freq_58, freq_59) VALUES
     (0.0200, 0.0371, 0.0428, 0.0207, 0.0954, 0.0986, 0.1539, 0.1601, 0.3109, 0.2111, 0.1609, 0.1582, 0.2238, 0.0645, 0.0660, 0.2273, 0.3100, 0.2999, 0.5078, 0.4797, 0.5783, 0.5071, 0.4328, 0.5550, 0.6711, 0.6415, 0.7104, 0.8080, 0.6791, 0.3857, 0.1307, 0.2604, 0.5121, 0.7547, 0.8537, 0.8507, 0.6692, 0.6097, 0.4943, 0.2744, 0.0510, 0.2834, 0.2825, 0.4256, 0.2641, 0.1386, 0.1051, 0.1343, 0.0383, 0.0324, 0.0232, 0.0027, 0.0065, 0.0159, 0.0072, 0.0167, 0.0180, 0.0084, 0.0090, 0.0032),
     (0.0453, 0.0523, 0.0843, 0.0689, 0.1183, 0.2583, 0.2156, 0.3481, 0.3337, 0.2872, 0.4918, 0.6552, 0.6919, 0.7797, 0.7464, 0.9444, 1.0000, 0.8874, 0.8024, 0.7818, 0.5212, 0.4052, 0.3957, 0.3914, 0.3250, 0.3200, 0.3271, 0.2767, 0.4423, 0.2028, 0.3788, 0.2947, 0.1984, 0.2341, 0.1306, 0.4182, 0.3835, 0.1057, 0.1840, 0.1970, 0.1674, 0.0583, 0.1401, 0.1628, 0.0621, 0.0203, 0.0530, 0.0742, 0.0409, 0.0061, 0.0125, 0.0084, 0.0089, 0.0048, 0.0094, 0.0191, 0.0140, 0.0049, 0.0052, 0.0044),
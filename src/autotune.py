@@ -0,0 +1,327 @@
+"""
+Throughput autotuner for batch sizes and torch thread counts.
+
+Sweeps batch size, intra-op and inter-op threads for `Trainer.train`
+and for model inference on the current host, and saves the fastest
+settings to the AUTOTUNE section of config.ini:
+
+    [AUTOTUNE]
+    train_batch_size = 64
+    train_intra_op_threads = 4
+    train_inter_op_threads = 1
+    inference_batch_size = 4096
+    ...
+
+`train.py` and the torch inference engine read this section, so later
+runs use the tuned settings. Inter-op threads can only be set once per
+process, so every thread setting is measured in a fresh process.
+
+If a setting with fewer threads is within `--tolerance` of the fastest
+one, it is preferred: extra threads that barely help oversubscribe the
+cores when several jobs run on the host.
+
+The train batch size also changes optimization (steps per epoch, the
+effective learning rate), so it's chosen only among batch sizes whose
+validation loss after `--train-epochs` is at most `--val-loss-tolerance`
+(relative) above the one of the current batch size (tuned before or the
+full train set). If none is, the train batch size is left as it is and
+only the threads are tuned.
+
+torch is imported by the functions that need it, so that the
+torch-free numpy inference engine can read the tuned settings.
+
+Usage:
+    python src/autotune.py --stages train inference --output autotune.json
+"""
+
+import argparse
+import configparser
+import json
+import os
+import platform
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+CONFIG_NAME = 'config.ini'
+MODEL_NAME = 'mlp'
+AUTOTUNE_SECTION = 'AUTOTUNE'
+STAGES = ['train', 'inference']
+
+
+def get_tuned_value(config: configparser.ConfigParser,
+                    stage: str, key: str) -> Optional[int]:
+    """Returns `{stage}_{key}` from the AUTOTUNE section or None."""
+    if AUTOTUNE_SECTION not in config:
+        return None
+    return config[AUTOTUNE_SECTION].getint(f"{stage}_{key}", fallback=None)
+
+
+def set_torch_threads(config: configparser.ConfigParser,
+                      stage: str, logger) -> None:
+    """
+    Sets torch intra-op and inter-op threads tuned for `stage`.
+    Does nothing for settings that are not tuned.
+    """
+    import torch
+
+    if AUTOTUNE_SECTION not in config:
+        return
+    tuned_host = config[AUTOTUNE_SECTION].get('host')
+    if tuned_host is not None and tuned_host != platform.node():
+        logger.warning(f"Settings in [{AUTOTUNE_SECTION}] were tuned on " \
+                       f"{tuned_host}, rerun autotune.py on this host")
+
+    intra_op_threads = get_tuned_value(config, stage, 'intra_op_threads')
+    if intra_op_threads is not None:
+        torch.set_num_threads(intra_op_threads)
+
+    inter_op_threads = get_tuned_value(config, stage, 'inter_op_threads')
+    if (inter_op_threads is not None
+            and inter_op_threads != torch.get_num_interop_threads()):
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError:
+            # Can only be set before any inter-op parallel work.
+            logger.warning("Can't set inter-op threads to " \
+                           f"{inter_op_threads}, torch already started them")
+
+
+def init_worker(intra_op_threads: int, inter_op_threads: int) -> None:
+    # Trainer's progress bars would only clutter the output. Set before
+    # importing torch, which imports tqdm and tqdm reads it on import.
+    os.environ['TQDM_DISABLE'] = '1'
+    import torch
+
+    torch.set_num_threads(intra_op_threads)
+    torch.set_num_interop_threads(inter_op_threads)
+
+
+def measure_training(batch_size: Optional[int],
+                     n_epochs: int) -> Dict[str, float]:
+    """
+    Trains a fresh model for `n_epochs` with `batch_size` (None - the
+    batch size train.py uses now). Runs in a worker process.
+    """
+    import torch
+    from model import MlpSonarModel
+    from train import Trainer, get_dataloaders
+
+    config = configparser.ConfigParser()
+    config.read(CONFIG_NAME)
+
+    torch.manual_seed(0)
+    dataloaders = get_dataloaders(batch_size, batch_size)
+    model = MlpSonarModel()
+    optimizer = torch.optim.Adam(model.parameters(),
+                                 lr=config.getfloat(MODEL_NAME, 'lr',
+                                                    fallback=0.01))
+    trainer = Trainer(model, optimizer, torch.nn.CrossEntropyLoss(),
+                      dataloaders, device=torch.device('cpu'))
+
+    start = time.perf_counter()
+    trainer.train(n_epochs)
+    elapsed = time.perf_counter() - start
+
+    n_samples = n_epochs * sum(len(loader.dataset)
+                               for loader in dataloaders.values())
+    # On the whole validation set at once, so that it doesn't depend on
+    # the validation batch size.
+    val_dataset = dataloaders['val'].dataset
+    model.eval()
+    with torch.no_grad():
+        val_loss = torch.nn.CrossEntropyLoss()(model(val_dataset.X),
+                                               val_dataset.y).item()
+    return {
+        'batch_size': dataloaders['train'].batch_size,
+        'samples_per_second': n_samples / elapsed,
+        # Batch size changes optimization, not only speed.
+        'val_loss': val_loss,
+    }
+
+
+def measure_inference(batch_size: int, n_rows: int,
+                      n_runs: int) -> Dict[str, float]:
+    """
+    Measures `MlpSonarModel.predict_proba` on `n_rows` rows
+    predicted `batch_size` rows at a time. Runs in a worker process.
+    """
+    from model import MlpSonarModel
+
+    model = MlpSonarModel()
+    model.eval()
+    X = np.random.default_rng(0).random((n_rows, 60), dtype=np.float32)
+    model.predict_proba(X, batch_size)  # warm-up
+    times = []
+    for _ in range(n_runs):
+        start = time.perf_counter()
+        model.predict_proba(X, batch_size)
+        times.append(time.perf_counter() - start)
+    return {'samples_per_second': n_rows / statistics.median(times)}
+
+
+def sweep(stage: str, batch_sizes: List[int],
+          intra_op_threads: List[int], inter_op_threads: List[int],
+          args: argparse.Namespace, logger) -> List[Dict]:
+    """Returns a result per (batch size, intra-op, inter-op threads)."""
+    import torch.multiprocessing
+
+    results = []
+    for n_intra in intra_op_threads:
+        for n_inter in inter_op_threads:
+            with ProcessPoolExecutor(
+                    max_workers=1,
+                    mp_context=torch.multiprocessing.get_context('spawn'),
+                    initializer=init_worker,
+                    initargs=(n_intra, n_inter)) as executor:
+                for batch_size in batch_sizes:
+                    if stage == 'train':
+                        future = executor.submit(
+                            measure_training, batch_size, args.train_epochs)
+                    else:
+                        future = executor.submit(
+                            measure_inference, batch_size,
+                            args.inference_rows, args.inference_runs)
+                    result = {
+                        'stage': stage,
+                        'batch_size': batch_size,
+                        'intra_op_threads': n_intra,
+                        'inter_op_threads': n_inter,
+                        **future.result(),
+                    }
+                    logger.info(
+                        f"{stage:>9} batch {batch_size:>6}, " \
+                        f"threads {n_intra}/{n_inter}: " \
+                        f"{result['samples_per_second']:.0f} samples/s")
+                    results.append(result)
+    return results
+
+
+def measure_reference(args: argparse.Namespace) -> Dict[str, float]:
+    """Measures training with the current train batch size."""
+    import torch.multiprocessing
+
+    with ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=torch.multiprocessing.get_context('spawn'),
+            initializer=init_worker,
+            initargs=(args.intra_op_threads[0],
+                      args.inter_op_threads[0])) as executor:
+        return executor.submit(measure_training, None,
+                               args.train_epochs).result()
+
+
+def filter_converging(results: List[Dict], reference_val_loss: float,
+                      val_loss_tolerance: float) -> List[Dict]:
+    """
+    Returns training results whose validation loss is at most
+    `val_loss_tolerance` (relative) above `reference_val_loss`.
+    """
+    max_val_loss = reference_val_loss * (1 + val_loss_tolerance)
+    return [result for result in results if result['val_loss'] <= max_val_loss]
+
+
+def select_best(results: List[Dict], tolerance: float) -> Dict:
+    """
+    Returns the fastest result, preferring fewer threads
+    if they are at most `tolerance` (relative) slower.
+    """
+    fastest = max(result['samples_per_second'] for result in results)
+    good_enough = [result for result in results
+                   if result['samples_per_second'] >= fastest * (1 - tolerance)]
+    return min(good_enough, key=lambda result: (
+        result['intra_op_threads'] * result['inter_op_threads'],
+        -result['samples_per_second']))
+
+
+def get_default_threads() -> List[int]:
+    n_cpus = os.cpu_count() or 1
+    threads = [n for n in [1, 2, 4, 8, 16, 32, 64] if n < n_cpus]
+    return threads + [n_cpus]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stages", type=str, nargs='+',
+                        default=STAGES, choices=STAGES)
+    parser.add_argument("--train-batch-sizes", type=int, nargs='+',
+                        default=[16, 32, 64, 128, 256])
+    parser.add_argument("--inference-batch-sizes", type=int, nargs='+',
+                        default=[256, 1024, 4096, 16384, 65536])
+    parser.add_argument("--intra-op-threads", type=int, nargs='+',
+                        default=get_default_threads())
+    parser.add_argument("--inter-op-threads", type=int, nargs='+',
+                        default=[1, 2])
+    parser.add_argument("--train-epochs", type=int, default=20)
+    parser.add_argument("--inference-rows", type=int, default=65536)
+    parser.add_argument("--inference-runs", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=0.05,
+                        help="Relative slowdown accepted for fewer threads.")
+    parser.add_argument("--val-loss-tolerance", type=float, default=0.05,
+                        help="Relative increase of the validation loss " \
+                            "accepted for a new train batch size.")
+    parser.add_argument("--dry-run", action='store_true',
+                        help="Don't save the best settings to config.ini.")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Path to save all results as json.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    from logger import Logger
+    from prepare_data import write_config
+
+    logger = Logger(show=True).get_logger(__name__)
+    args = parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(CONFIG_NAME)
+
+    batch_sizes = {'train': args.train_batch_sizes,
+                   'inference': args.inference_batch_sizes}
+    all_results = []
+    if AUTOTUNE_SECTION not in config:
+        config[AUTOTUNE_SECTION] = {}
+    tuned = config[AUTOTUNE_SECTION]
+    tuned['host'] = platform.node()
+    for stage in args.stages:
+        results = sweep(stage, batch_sizes[stage], args.intra_op_threads,
+                        args.inter_op_threads, args, logger)
+        all_results.extend(results)
+        keys = ['batch_size', 'intra_op_threads', 'inter_op_threads']
+        if stage == 'train':
+            reference = measure_reference(args)
+            all_results.append({'stage': stage, 'reference': True,
+                                **reference})
+            logger.info(f"Current train batch {reference['batch_size']}: " \
+                        f"val loss {reference['val_loss']:.4f}")
+            converging = filter_converging(results, reference['val_loss'],
+                                           args.val_loss_tolerance)
+            if converging:
+                results = converging
+            else:
+                logger.warning(
+                    "No train batch size reaches the validation loss of " \
+                    f"the current one within {args.val_loss_tolerance:.0%}, " \
+                    "only threads are tuned")
+                keys = ['intra_op_threads', 'inter_op_threads']
+        best = select_best(results, args.tolerance)
+        logger.info(f"Best {stage} settings: batch {best['batch_size']}, " \
+                    f"threads {best['intra_op_threads']}/" \
+                    f"{best['inter_op_threads']}, " \
+                    f"{best['samples_per_second']:.0f} samples/s")
+        for key in keys:
+            tuned[f"{stage}_{key}"] = str(best[key])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(all_results, f, indent=4)
+
+    if not args.dry_run:
+        write_config(config, CONFIG_NAME)
+        logger.info(f"Saved tuned settings to [{AUTOTUNE_SECTION}] " \
+                    f"of {CONFIG_NAME}")
@@ -0,0 +1,93 @@
+"""
+Compares an epoch of Trainer.train with DataLoader (rows are fetched
+and collated one by one) and TensorBatchLoader (batches are slices of
+the split tensors), and the time of only iterating over the batches.
+Data is synthetic: random features and labels.
+
+Usage:
+    python src/benchmarks/bench_batch_loader.py --sizes 100000 1000000 --batch-size 256
+"""
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import argparse
+import json
+import time
+
+import torch
+from torch.utils.data import DataLoader
+
+from dataset import TensorBatchLoader
+from logger import Logger
+from model import MlpSonarModel
+from train import Trainer
+
+
+class SyntheticDataset(torch.utils.data.Dataset):
+    """Same interface as SonarDataset."""
+    def __init__(self, n_rows: int) -> None:
+        generator = torch.Generator().manual_seed(0)
+        self.X = torch.rand(n_rows, 60, generator=generator)
+        self.y = torch.randint(0, 2, (n_rows,), generator=generator)
+
+    def __len__(self):
+        return len(self.y)
+
+    def __getitem__(self, idx):
+        return self.X[idx], self.y[idx]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs='+',
+                        default=[100_000, 1_000_000])
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--output", type=str, default=None,
+                        help="Path to save results as json.")
+    return parser.parse_args()
+
+
+def measure(loader_class, dataset, batch_size: int,
+            batch_progress: bool) -> dict:
+    loaders = {
+        'train': loader_class(dataset, batch_size=batch_size, shuffle=True),
+        'val': loader_class(dataset, batch_size=batch_size),
+    }
+    start = time.perf_counter()
+    for _ in loaders['train']:
+        pass
+    iteration = time.perf_counter() - start
+
+    torch.manual_seed(0)
+    model = MlpSonarModel()
+    trainer = Trainer(model, torch.optim.Adam(model.parameters(), lr=0.01),
+                      torch.nn.CrossEntropyLoss(), loaders,
+                      device=torch.device('cpu'),
+                      batch_progress=batch_progress)
+    start = time.perf_counter()
+    trainer.train(1)
+    epoch = time.perf_counter() - start
+    return {'iteration_s': iteration, 'epoch_s': epoch}
+
+
+if __name__ == "__main__":
+    logger = Logger(True).get_logger(__name__)
+    args = parse_args()
+    torch.set_num_threads(1)
+
+    results = []
+    for n_rows in args.sizes:
+        dataset = SyntheticDataset(n_rows)
+        for name, loader_class, batch_progress in [
+                ('DataLoader + batch bar', DataLoader, True),
+                ('TensorBatchLoader', TensorBatchLoader, False)]:
+            result = {'rows': n_rows, 'loader': name,
+                      **measure(loader_class, dataset, args.batch_size,
+                                batch_progress)}
+            logger.info(f"{n_rows} rows, {name}: " \
+                        f"iteration {result['iteration_s']:.2f} s, " \
+                        f"epoch (train + val) {result['epoch_s']:.2f} s")
+            results.append(result)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,106 @@
+"""
+Compares torch and numpy inference engines:
+- startup: fresh interpreter that imports the engine and loads the model
+- per-batch latency of predict_proba for several batch sizes
+
+Usage:
+    python src/benchmarks/bench_engines.py --batch-sizes 1 64 4096 65536
+"""
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import argparse
+import configparser
+import json
+import statistics
+import subprocess
+import time
+
+import numpy as np
+
+from engines import ENGINES, load_predictor
+from logger import Logger
+
+
+CONFIG_NAME = 'config.ini'
+MODEL_NAME = 'mlp'
+STARTUP_SCRIPT = """
+import sys, os, time, logging, configparser
+start = time.perf_counter()
+sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+from engines import load_predictor
+config = configparser.ConfigParser()
+config.read({config_name!r})
+load_predictor(config, {model_name!r}, logging.getLogger(), {engine!r})
+print(time.perf_counter() - start)
+"""
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engines", type=str, nargs='+',
+                        default=ENGINES, choices=ENGINES)
+    parser.add_argument("--batch-sizes", type=int, nargs='+',
+                        default=[1, 64, 4096, 65536])
+    parser.add_argument("--startup-runs", type=int, default=5)
+    parser.add_argument("--min-seconds", type=float, default=0.5,
+                        help="Minimal time spent measuring each batch size.")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Path to save results as json.")
+    return parser.parse_args()
+
+
+def measure_startup(engine: str, n_runs: int) -> float:
+    """
+    Returns median wall time of a fresh interpreter that imports
+    the engine and loads the model. Interpreter startup itself is included.
+    """
+    script = STARTUP_SCRIPT.format(
+        config_name=CONFIG_NAME, model_name=MODEL_NAME, engine=engine)
+    times = []
+    for _ in range(n_runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", script], check=True,
+                       capture_output=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def measure_batch_latency(model, batch_size: int, min_seconds: float) -> float:
+    """Returns median latency of predict_proba on a batch, in seconds."""
+    X = np.random.default_rng(0).random((batch_size, 60), dtype=np.float32)
+    model.predict_proba(X)  # warm-up
+    times = []
+    deadline = time.perf_counter() + min_seconds
+    while time.perf_counter() < deadline or len(times) < 3:
+        start = time.perf_counter()
+        model.predict_proba(X)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+if __name__ == "__main__":
+    logger = Logger(show=True).get_logger(__name__)
+    args = parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(CONFIG_NAME)
+
+    results = []
+    for engine in args.engines:
+        startup = measure_startup(engine, args.startup_runs)
+        logger.info(f"{engine:>6} startup: {startup * 1e3:8.1f} ms")
+        results.append({'engine': engine, 'measure': 'startup_seconds',
+                         'value': startup})
+
+        model = load_predictor(config, MODEL_NAME, logger, engine)
+        for batch_size in args.batch_sizes:
+            latency = measure_batch_latency(model, batch_size, args.min_seconds)
+            logger.info(f"{engine:>6} batch {batch_size:>7}: " \
+                        f"{latency * 1e6:10.1f} us, " \
+                        f"{batch_size / latency:12.0f} rows/s")
+            results.append({'engine': engine, 'measure': 'batch_latency_seconds',
+                            'batch_size': batch_size, 'value': latency})
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
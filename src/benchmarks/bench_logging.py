@@ -0,0 +1,131 @@
+"""
+Cost of logging on the inference path.
+
+Times get_pred_table_new_vals_df on small chunks (every call logs three
+DEBUG lines), with no other line or followed by the "preparing to
+write" DEBUG line of inference.py with the DataFrame.head() payload,
+formatted eagerly (an f-string) and, if the logger module supports
+it, lazily. Loggers are
+created by logger.Logger at DEBUG and INFO level, with the console
+handler writing to /dev/null or without it. The cost of logging is the
+time over the run with logging disabled and without the payload line
+(best of --repeats runs). `drain` is the time to write records still
+queued after the loop (0 for synchronous handlers).
+
+Usage:
+    python src/benchmarks/bench_logging.py --calls 2000 --rows 100
+"""
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import argparse
+import json
+import logging
+import tempfile
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+import logger as logger_module
+from inference import get_pred_table_new_vals_df
+from logger import Logger
+from numpy_model import NumpyMlpSonarModel
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--rows", type=int, default=100,
+                        help="Rows per call.")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", type=str, default=None,
+                        help="Path to save results as json.")
+    return parser.parse_args()
+
+
+def get_model() -> NumpyMlpSonarModel:
+    rng = np.random.default_rng(0)
+    return NumpyMlpSonarModel({'w1': rng.standard_normal((40, 60)),
+                               'b1': rng.standard_normal(40),
+                               'w2': rng.standard_normal((2, 40)),
+                               'b2': rng.standard_normal(2)})
+
+
+@contextmanager
+def stdout_to_devnull():
+    """Redirects file descriptor 1, so also console handlers created before."""
+    sys.stdout.flush()
+    saved_fd = os.dup(1)
+    devnull_fd = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull_fd, 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved_fd, 1)
+        os.close(saved_fd)
+        os.close(devnull_fd)
+
+
+def measure(logger: logging.Logger, model, X: np.ndarray, ids: np.ndarray,
+            n_calls: int, payload: str) -> dict:
+    start = time.perf_counter()
+    for _ in range(n_calls):
+        pred_df = get_pred_table_new_vals_df(X, ids, model, logger)
+        if payload == 'eager':
+            logger.debug(f"preparing to wite data:\n{pred_df.head()}\netc.")
+        elif payload == 'lazy':
+            logger.debug("preparing to wite data:\n%s\netc.",
+                         logger_module.Lazy(pred_df.head))
+    loop = time.perf_counter() - start
+    start = time.perf_counter()
+    if hasattr(logger_module, 'flush_logs'):
+        logger_module.flush_logs()
+    return {'loop_s': loop, 'drain_s': time.perf_counter() - start}
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report_logger = Logger(show=True).get_logger(__name__)
+    model = get_model()
+    rng = np.random.default_rng(0)
+    X = rng.random((args.rows, 60), dtype=np.float32)
+    ids = np.arange(args.rows).reshape(-1, 1)
+    payloads = ['none', 'eager'] + (['lazy'] if hasattr(logger_module, 'Lazy')
+                                    else [])
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        configs = [('disabled', False, logging.CRITICAL + 1, 'none')] + [
+            (level_name, show, level, payload)
+            for level_name, level in [('DEBUG', logging.DEBUG),
+                                      ('INFO', logging.INFO)]
+            for show in [False, True]
+            for payload in payloads]
+        for i, (level_name, show, level, payload) in enumerate(configs):
+            with stdout_to_devnull():
+                logger = Logger(
+                    show, filename=os.path.join(tmp_dir, f'{i}.log'),
+                    level=level).get_logger(f'bench_{i}')
+                measure(logger, model, X, ids, 50, payload)
+                result = min((measure(logger, model, X, ids, args.calls,
+                                      payload)
+                              for _ in range(args.repeats)),
+                             key=lambda r: r['loop_s'])
+            result.update({'level': level_name, 'console': show,
+                           'payload': payload})
+            results.append(result)
+
+    baseline = results[0]['loop_s']
+    for result in results:
+        result['logging_us_per_call'] = \
+            (result['loop_s'] - baseline) / args.calls * 1e6
+        report_logger.info(
+            f"{result['level']:>8}, console {str(result['console']):>5}, " \
+            f"{result['payload']:>5} payload: " \
+            f"loop {result['loop_s']:.3f} s, drain {result['drain_s']:.3f} s, " \
+            f"logging {result['logging_us_per_call']:7.1f} us per call")
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
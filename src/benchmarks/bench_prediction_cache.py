@@ -0,0 +1,93 @@
+"""
+Compares prediction of chunks with and without PredictionCache
+for several fractions of duplicate rows.
+
+Usage:
+    python src/benchmarks/bench_prediction_cache.py --duplicate-fractions 0 0.5 0.9 0.99
+"""
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import argparse
+import configparser
+import json
+import time
+
+import numpy as np
+
+from engines import ENGINES, get_model_version, load_predictor
+from labels import get_preds_and_m_probs
+from logger import Logger
+from prediction_cache import PredictionCache
+
+
+CONFIG_NAME = 'config.ini'
+MODEL_NAME = 'mlp'
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engine", type=str, default='torch', choices=ENGINES)
+    parser.add_argument("--duplicate-fractions", type=float, nargs='+',
+                        default=[0.0, 0.5, 0.9, 0.99])
+    parser.add_argument("--chunk-size", type=int, default=10_000)
+    parser.add_argument("--n-chunks", type=int, default=20)
+    parser.add_argument("--output", type=str, default=None,
+                        help="Path to save results as json.")
+    return parser.parse_args()
+
+
+def make_chunks(duplicate_fraction: float, chunk_size: int,
+                n_chunks: int) -> list:
+    """
+    Chunks where `duplicate_fraction` of rows repeat earlier vectors
+    (from the same or previous chunks).
+    """
+    rng = np.random.default_rng(0)
+    n_rows = chunk_size * n_chunks
+    n_unique = max(1, int(n_rows * (1 - duplicate_fraction)))
+    unique = rng.random((n_unique, 60))
+    index = np.concatenate([np.arange(n_unique),
+                            rng.integers(0, n_unique, n_rows - n_unique)])
+    rows = unique[np.sort(index)]
+    return np.split(rows, n_chunks)
+
+
+if __name__ == "__main__":
+    logger = Logger(show=True).get_logger(__name__)
+    args = parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(CONFIG_NAME)
+
+    model = load_predictor(config, MODEL_NAME, logger, args.engine)
+    model_version = get_model_version(config, MODEL_NAME, args.engine)
+
+    results = []
+    for duplicate_fraction in args.duplicate_fractions:
+        chunks = make_chunks(duplicate_fraction, args.chunk_size, args.n_chunks)
+
+        start = time.perf_counter()
+        for chunk in chunks:
+            get_preds_and_m_probs(model.predict_proba(chunk))
+        no_cache_seconds = time.perf_counter() - start
+
+        cache = PredictionCache(model_version)
+        start = time.perf_counter()
+        for chunk in chunks:
+            cache.predict(model, chunk)
+        cache_seconds = time.perf_counter() - start
+
+        n_rows = args.chunk_size * args.n_chunks
+        stats = cache.get_stats()
+        logger.info(f"duplicates {duplicate_fraction:.2f}: " \
+                    f"no cache {n_rows / no_cache_seconds:10.0f} rows/s, " \
+                    f"cache {n_rows / cache_seconds:10.0f} rows/s, " \
+                    f"forward rate {stats['forward_rate']:.3f}")
+        results.append({'duplicate_fraction': duplicate_fraction,
+                        'no_cache_rows_per_second': n_rows / no_cache_seconds,
+                        'cache_rows_per_second': n_rows / cache_seconds,
+                        **stats})
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,123 @@
+"""
+Compares csv and npy split files: time to write them (prepare_data.py),
+time and memory to open them as SonarDataset, and time of one pass
+over the features. Data is synthetic: random features and labels.
+
+Every load is measured in a fresh subprocess, so RSS is not affected
+by previous runs. Memory is reported with RSS after import of torch
+subtracted. RSS includes pages of memory-mapped files, which are shared
+with the page cache and can be dropped by the OS; anonymous RSS is the
+memory that belongs to the process only.
+
+Usage:
+    python src/benchmarks/bench_split_format.py --sizes 100000 1000000 --formats npy csv
+"""
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import argparse
+import json
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+from logger import Logger
+from prepare_data import SPLIT_FORMATS, save_split_part
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs='+',
+                        default=[100_000, 1_000_000])
+    parser.add_argument("--formats", type=str, nargs='+',
+                        default=SPLIT_FORMATS, choices=SPLIT_FORMATS)
+    parser.add_argument("--output", type=str, default=None,
+                        help="Path to save results as json.")
+    # Internal: load the split in this process and print measurements.
+    parser.add_argument("--measure-load", type=str, nargs=2, default=None,
+                        metavar=("X_PATH", "Y_PATH"), help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def get_rss_mb() -> np.ndarray:
+    """Returns [RSS, anonymous RSS] in MB."""
+    status = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            key, value = line.split(':', 1)
+            status[key] = value
+    return np.array([int(status[key].split()[0]) / 1024
+                     for key in ('VmRSS', 'RssAnon')])
+
+
+def measure_load(X_path: str, y_path: str) -> dict:
+    import torch  # Imported before the baseline RSS is taken.
+    from dataset import SonarDataset
+
+    rss_before = get_rss_mb()
+    start = time.perf_counter()
+    dataset = SonarDataset(X_path, y_path)
+    load_time = time.perf_counter() - start
+    rss_loaded, anon_loaded = get_rss_mb() - rss_before
+
+    start = time.perf_counter()
+    dataset.X.sum(dim=0)
+    pass_time = time.perf_counter() - start
+    rss_passed, anon_passed = get_rss_mb() - rss_before
+    return {
+        'load_s': load_time,
+        'rss_after_load_mb': rss_loaded,
+        'anon_rss_after_load_mb': anon_loaded,
+        'pass_s': pass_time,
+        'rss_after_pass_mb': rss_passed,
+        'anon_rss_after_pass_mb': anon_passed,
+    }
+
+
+def write_split(n_rows: int, split_format: str, save_path: str):
+    rng = np.random.default_rng(0)
+    X = rng.random((n_rows, 60))
+    y = np.array(['R', 'M'], dtype=object)[rng.integers(0, 2, (n_rows, 1))]
+    start = time.perf_counter()
+    X_path = save_split_part(X, 'X_train', save_path, split_format)
+    y_path = save_split_part(y, 'y_train', save_path, split_format)
+    return X_path, y_path, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.measure_load is not None:
+        print(json.dumps(measure_load(*args.measure_load)))
+        sys.exit(0)
+
+    logger = Logger(show=True).get_logger(__name__)
+    results = []
+    for n_rows in args.sizes:
+        for split_format in args.formats:
+            with tempfile.TemporaryDirectory() as save_path:
+                X_path, y_path, write_time = write_split(
+                    n_rows, split_format, save_path)
+                size_mb = (os.path.getsize(X_path)
+                           + os.path.getsize(y_path)) / 2 ** 20
+                output = subprocess.run(
+                    [sys.executable, __file__, '--measure-load', X_path, y_path],
+                    check=True, capture_output=True, text=True).stdout
+                result = {'rows': n_rows, 'format': split_format,
+                          'write_s': write_time, 'file_mb': size_mb,
+                          **json.loads(output.splitlines()[-1])}
+            results.append(result)
+            logger.info(
+                f"{n_rows:>9} rows {split_format}: "
+                f"write {result['write_s']:8.3f} s, "
+                f"file {result['file_mb']:7.1f} MB, "
+                f"load {result['load_s']:8.3f} s, "
+                f"RSS {result['rss_after_load_mb']:7.1f} MB "
+                f"(anon {result['anon_rss_after_load_mb']:7.1f} MB), "
+                f"pass {result['pass_s']:6.3f} s, "
+                f"RSS after pass {result['rss_after_pass_mb']:7.1f} MB "
+                f"(anon {result['anon_rss_after_pass_mb']:7.1f} MB)")
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
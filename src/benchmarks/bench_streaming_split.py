@@ -0,0 +1,106 @@
+"""
+Compares peak memory and time of DataPreparer.split_data (whole dataset
+in memory) and DataPreparer.split_data_streaming on synthetic sonar
+dumps of several sizes.
+
+Every split runs in a fresh subprocess in a temporary working directory,
+so peak RSS is not affected by previous runs and config.ini is not
+touched.
+
+Usage:
+    python src/benchmarks/bench_streaming_split.py --sizes 100000 1000000 --modes memory streaming
+"""
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import argparse
+import json
+import resource
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+from logger import Logger
+
+
+MODES = ['memory', 'streaming']
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs='+',
+                        default=[100_000, 1_000_000])
+    parser.add_argument("--modes", type=str, nargs='+', default=MODES,
+                        choices=MODES)
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--output", type=str, default=None,
+                        help="Path to save results as json.")
+    # Internal: split the file in this process and print measurements.
+    parser.add_argument("--measure", type=str, nargs=2, default=None,
+                        metavar=("MODE", "DATA_PATH"), help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def write_dump(path: str, n_rows: int, block_rows: int = 10_000) -> None:
+    """Writes n_rows sonar-like rows, repeating a block of random rows."""
+    rng = np.random.default_rng(0)
+    X = rng.random((block_rows, 60))
+    y = np.where(rng.random(block_rows) < 0.5, 'M', 'R')
+    block = ''.join(','.join(f'{value:.4f}' for value in row) + f',{label}\n'
+                    for row, label in zip(X, y))
+    lines = block.splitlines(keepends=True)
+    with open(path, 'w') as f:
+        for _ in range(n_rows // block_rows):
+            f.write(block)
+        f.write(''.join(lines[:n_rows % block_rows]))
+
+
+def measure(mode: str, data_path: str, chunk_size: int) -> dict:
+    from prepare_data import DataPreparer
+
+    # Splits and config.ini are written next to the dump.
+    os.chdir(os.path.dirname(data_path))
+    logger = Logger(show=False, filename='logfile.log').get_logger(__name__)
+    data_preparer = DataPreparer(data_path, '.', logger)
+    start = time.perf_counter()
+    if mode == 'memory':
+        data_preparer.split_data()
+    else:
+        data_preparer.split_data_streaming(chunk_size=chunk_size)
+    return {
+        'time_s': time.perf_counter() - start,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.measure is not None:
+        print(json.dumps(measure(*args.measure, args.chunk_size)))
+        sys.exit(0)
+
+    logger = Logger(show=True).get_logger(__name__)
+    results = []
+    for n_rows in args.sizes:
+        with tempfile.TemporaryDirectory() as work_dir:
+            data_path = os.path.join(work_dir, 'sonar.all-data')
+            write_dump(data_path, n_rows)
+            size_mb = os.path.getsize(data_path) / 2 ** 20
+            for mode in args.modes:
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__),
+                     '--measure', mode, data_path,
+                     '--chunk-size', str(args.chunk_size)],
+                    check=True, capture_output=True,
+                    text=True).stdout
+                result = {'rows': n_rows, 'mode': mode, 'file_mb': size_mb,
+                          **json.loads(output.splitlines()[-1])}
+                results.append(result)
+                logger.info(f"{n_rows:>9} rows ({size_mb:7.1f} MB) {mode:>9}: " \
+                            f"{result['time_s']:7.2f} s, " \
+                            f"peak RSS {result['peak_rss_mb']:7.1f} MB")
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
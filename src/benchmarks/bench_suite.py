@@ -0,0 +1,342 @@
+"""
+End-to-end benchmark of the pipeline stages on synthetic sonar-shaped
+data, from 208 rows (the size of the real dataset) to millions of rows.
+
+Stages:
+    split_data                 DataPreparer.split_data (whole dump in memory)
+    split_data_streaming       DataPreparer.split_data_streaming
+    dataset_load               SonarDataset of the train split and a pass over it
+    train_epoch                an epoch of Trainer.train (train + val)
+    get_pred_table_new_vals_df predictions of a fresh MlpSonarModel
+    fill_frequencies           filling the benchmark `frequencies` table
+                               with CopyWriter in chunks
+    get_feats_without_preds    fetching the whole backlog
+    iter_feats_without_preds   fetching the backlog in chunks
+    write_to_table             INSERT of predictions of all rows
+
+Every stage of every size runs in a fresh subprocess, so peak RSS
+(`ru_maxrss`) belongs to the stage only; `baseline_rss_mb` is RSS after
+imports, before the stage. Latency is the median time of one call over
+`--repeats` calls (of one epoch for train_epoch), throughput is rows per
+second at that latency.
+
+Database stages run only if --db-* arguments are given. They use the
+`bench_suite` schema (dropped at the end) with the tables of init.sql,
+so the database itself is not touched. Stages that hold all rows as
+Python objects or in one array (split_data, get_pred_table_new_vals_df,
+get_feats_without_preds, write_to_table) are skipped above
+--max-rows-in-memory: at 1M rows get_feats_without_preds already
+takes ~4.5 GB.
+
+Usage:
+    python src/benchmarks/bench_suite.py --sizes 208 100000 1000000 10000000 \
+        --db-host ... --db-port ... --db-user ... --db-password ... --db-name ...
+"""
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import argparse
+import json
+import platform
+import resource
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.bench_streaming_split import write_dump
+from logger import Logger
+
+
+SPLIT_STAGES = ['split_data', 'split_data_streaming']
+LOCAL_STAGES = SPLIT_STAGES + ['dataset_load', 'train_epoch',
+                               'get_pred_table_new_vals_df']
+DB_STAGES = ['fill_frequencies', 'get_feats_without_preds',
+             'iter_feats_without_preds', 'write_to_table']
+STAGES = LOCAL_STAGES + DB_STAGES
+# Hold all rows as Python objects, in one array or in one SQL string.
+IN_MEMORY_STAGES = ['split_data', 'get_pred_table_new_vals_df',
+                    'get_feats_without_preds', 'write_to_table']
+BENCH_SCHEMA = 'bench_suite'
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs='+',
+                        default=[208, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--stages", type=str, nargs='+', default=STAGES,
+                        choices=STAGES)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=4096,
+                        help="Batch size of training and prediction.")
+    parser.add_argument("--chunk-size", type=int, default=100_000,
+                        help="Rows per chunk of streaming stages.")
+    parser.add_argument("--max-rows-in-memory", type=int, default=1_000_000)
+    parser.add_argument("--db-host", type=str, default=None)
+    parser.add_argument("--db-port", type=int, default=None)
+    parser.add_argument("--db-user", type=str, default=None)
+    parser.add_argument("--db-password", type=str, default=None)
+    parser.add_argument("--db-name", type=str, default=None)
+    parser.add_argument("--output", type=str,
+                        default=os.path.join('.', 'experiments', 'bench_suite.json'),
+                        help="Path to save results as json.")
+    # Internal: run the stage in this process and print measurements.
+    parser.add_argument("--measure", type=str, nargs=3, default=None,
+                        metavar=("STAGE", "N_ROWS", "WORK_DIR"),
+                        help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def get_rss_mb() -> float:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+def connect(args: argparse.Namespace, logger):
+    """Returns gp.Database whose unqualified tables are in BENCH_SCHEMA."""
+    from inference import create_db_object
+
+    db = create_db_object(args, logger)
+    with db._conn.cursor() as curs:
+        curs.execute(f"SET search_path TO {BENCH_SCHEMA};")
+    return db
+
+
+def create_tables(db) -> None:
+    """Tables of init.sql in BENCH_SCHEMA, recreated empty."""
+    from inference import FREQ_COLUMNS
+
+    freq_columns_str = ", ".join(f"{col} FLOAT NOT NULL" for col in FREQ_COLUMNS)
+    with db._conn.cursor() as curs:
+        curs.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE;")
+        curs.execute(f"CREATE SCHEMA {BENCH_SCHEMA};")
+        curs.execute(f"SET search_path TO {BENCH_SCHEMA};")
+        curs.execute("CREATE TABLE frequencies (" \
+                     f"id SERIAL NOT NULL PRIMARY KEY, {freq_columns_str});")
+        curs.execute(
+            "CREATE TABLE predictions (" \
+            "prediction_id SERIAL NOT NULL PRIMARY KEY, " \
+            "frequencies_id INT NOT NULL REFERENCES frequencies (id), " \
+            "prediction TEXT NOT NULL, m_probability FLOAT NOT NULL);")
+        curs.execute("CREATE INDEX predictions_frequencies_id_idx " \
+                     "ON predictions (frequencies_id);")
+
+
+def get_stage(stage: str, n_rows: int, work_dir: str,
+              args: argparse.Namespace):
+    """
+    Prepares the stage and returns (run, rows): `run()` is timed, `rows`
+    is the number of rows it processes.
+    """
+    logger = Logger(show=False, filename=os.path.join(work_dir, 'logfile.log')
+                    ).get_logger(__name__)
+    dump_path = os.path.join(work_dir, 'sonar.all-data')
+    splits_dir = os.path.join(work_dir, 'split_data_streaming')
+
+    if stage in SPLIT_STAGES:
+        from prepare_data import DataPreparer
+
+        # Splits and config.ini are written to the stage's directory.
+        os.makedirs(os.path.join(work_dir, stage), exist_ok=True)
+        os.chdir(os.path.join(work_dir, stage))
+        data_preparer = DataPreparer(dump_path, '.', logger)
+        if stage == 'split_data':
+            return data_preparer.split_data, n_rows
+        return (lambda: data_preparer.split_data_streaming(
+            chunk_size=args.chunk_size)), n_rows
+
+    if stage in ['dataset_load', 'train_epoch']:
+        from dataset import SonarDataset, TensorBatchLoader
+
+    if stage == 'dataset_load':
+        def run():
+            dataset = SonarDataset(os.path.join(splits_dir, 'X_train.npy'),
+                                   os.path.join(splits_dir, 'y_train.npy'))
+            # npy splits are memory-mapped: read every page.
+            float(dataset.X.sum())
+            return dataset
+        return run, len(np.load(os.path.join(splits_dir, 'y_train.npy'),
+                                mmap_mode='r'))
+
+    if stage == 'train_epoch':
+        import torch
+        from model import MlpSonarModel
+        from train import Trainer
+
+        datasets = {phase: SonarDataset(os.path.join(splits_dir, f'X_{part}.npy'),
+                                        os.path.join(splits_dir, f'y_{part}.npy'))
+                    for phase, part in [('train', 'train'), ('val', 'test')]}
+        loaders = {phase: TensorBatchLoader(dataset, batch_size=args.batch_size,
+                                            shuffle=phase == 'train')
+                   for phase, dataset in datasets.items()}
+        torch.manual_seed(0)
+        model = MlpSonarModel()
+        trainer = Trainer(model, torch.optim.Adam(model.parameters(), lr=0.01),
+                          torch.nn.CrossEntropyLoss(), loaders,
+                          device=torch.device('cpu'))
+        return (lambda: trainer.train(1)), sum(map(len, datasets.values()))
+
+    if stage == 'get_pred_table_new_vals_df':
+        from inference import get_pred_table_new_vals_df
+        from model import MlpSonarModel
+
+        X = np.random.default_rng(0).random((n_rows, 60), dtype=np.float32)
+        freq_ids = np.arange(1, n_rows + 1).reshape(-1, 1)
+        model = MlpSonarModel()
+        return (lambda: get_pred_table_new_vals_df(
+            X, freq_ids, model, logger, args.batch_size)), n_rows
+
+    import pandas as pd
+    from db_utils import CopyWriter, write_to_table
+    from inference import (FREQ_COLUMNS, get_feats_without_preds,
+                           iter_feats_without_preds)
+
+    db = connect(args, logger)
+
+    if stage == 'fill_frequencies':
+        def run():
+            create_tables(db)
+            rng = np.random.default_rng(0)
+            with CopyWriter(db, 'frequencies', FREQ_COLUMNS,
+                            max_buffer_rows=args.chunk_size,
+                            max_buffer_seconds=float('inf')) as writer:
+                for start in range(0, n_rows, args.chunk_size):
+                    chunk_rows = min(args.chunk_size, n_rows - start)
+                    writer.write(rng.random((chunk_rows, 60), dtype=np.float32))
+        return run, n_rows
+
+    if stage == 'get_feats_without_preds':
+        return (lambda: get_feats_without_preds(db, logger)), n_rows
+
+    if stage == 'iter_feats_without_preds':
+        def run():
+            for _ in iter_feats_without_preds(db, args.chunk_size, logger):
+                pass
+        return run, n_rows
+
+    if stage == 'write_to_table':
+        m_probs = np.random.default_rng(0).random(n_rows)
+        data_df = pd.DataFrame({
+            'frequencies_id': np.arange(1, n_rows + 1),
+            'prediction': np.where(m_probs > 0.5, 'M', 'R'),
+            'm_probability': m_probs,
+        })
+
+        def run():
+            with db._conn.cursor() as curs:
+                curs.execute("TRUNCATE predictions;")
+            write_to_table(db, data_df, 'predictions')
+        return run, n_rows
+
+    raise ValueError(f"Unknown stage {stage}")
+
+
+def measure(stage: str, n_rows: int, work_dir: str,
+            args: argparse.Namespace) -> Dict:
+    run, rows = get_stage(stage, n_rows, work_dir, args)
+    baseline_rss_mb = get_rss_mb()
+    latencies = []
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - start)
+    latency = statistics.median(latencies)
+    return {
+        'rows': rows,
+        'latency_s': latency,
+        'latencies_s': latencies,
+        'rows_per_s': rows / latency if latency > 0 else None,
+        'baseline_rss_mb': baseline_rss_mb,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def run_stage(stage: str, n_rows: int, work_dir: str,
+              args: argparse.Namespace) -> Dict:
+    db_args = []
+    for name in ['db_host', 'db_port', 'db_user', 'db_password', 'db_name']:
+        if getattr(args, name) is not None:
+            db_args += ['--' + name.replace('_', '-'), str(getattr(args, name))]
+    process = subprocess.run(
+        [sys.executable, os.path.abspath(__file__),
+         '--measure', stage, str(n_rows), work_dir,
+         '--repeats', str(args.repeats), '--batch-size', str(args.batch_size),
+         '--chunk-size', str(args.chunk_size)] + db_args,
+        capture_output=True, text=True)
+    if process.returncode != 0:
+        return {'error': process.stderr.strip().splitlines()[-1:]}
+    return json.loads(process.stdout.splitlines()[-1])
+
+
+def get_stage_order(stages: List[str]) -> List[str]:
+    """
+    Stages in the order of STAGES: dataset_load and train_epoch read the
+    splits of split_data_streaming, the database stages need the table
+    filled by fill_frequencies.
+    """
+    required = set(stages)
+    if required & {'dataset_load', 'train_epoch'}:
+        required.add('split_data_streaming')
+    if required & set(DB_STAGES):
+        required.add('fill_frequencies')
+    return [stage for stage in STAGES if stage in required]
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.measure is not None:
+        stage, n_rows, work_dir = args.measure
+        print(json.dumps(measure(stage, int(n_rows), work_dir, args)))
+        sys.exit(0)
+
+    logger = Logger(show=True).get_logger(__name__)
+    with_db = args.db_host is not None
+    if not with_db:
+        logger.info("No --db-host: database stages are skipped")
+
+    results = []
+    for n_rows in args.sizes:
+        with tempfile.TemporaryDirectory() as work_dir:
+            write_dump(os.path.join(work_dir, 'sonar.all-data'), n_rows,
+                       block_rows=min(n_rows, 10_000))
+            for stage in get_stage_order(args.stages):
+                result = {'stage': stage, 'size': n_rows}
+                if stage in DB_STAGES and not with_db:
+                    continue
+                if (stage in IN_MEMORY_STAGES
+                        and n_rows > args.max_rows_in_memory):
+                    result['skipped'] = "size > --max-rows-in-memory"
+                else:
+                    result.update(run_stage(stage, n_rows, work_dir, args))
+                results.append(result)
+                if 'latency_s' in result:
+                    logger.info(
+                        f"{n_rows:>9} {stage:>27}: " \
+                        f"{result['latency_s']:9.4f} s, " \
+                        f"{result['rows_per_s']:12.0f} rows/s, " \
+                        f"peak RSS {result['peak_rss_mb']:7.1f} MB")
+                else:
+                    logger.info(f"{n_rows:>9} {stage:>27}: " \
+                                f"{result.get('skipped') or result.get('error')}")
+
+    if with_db:
+        db = connect(args, logger)
+        with db._conn.cursor() as curs:
+            curs.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE;")
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'machine': {'platform': platform.platform(),
+                        'python': platform.python_version(),
+                        'cpu_count': os.cpu_count()},
+            'results': results,
+        }, f, indent=4)
+    logger.info(f"Results are saved to {args.output}")
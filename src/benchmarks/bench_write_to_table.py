@@ -0,0 +1,97 @@
+"""
+Compares db_utils writers on synthetic `predictions` rows:
+string-built INSERT (write_to_table) vs COPY FROM STDIN (csv and binary).
+
+Rows are written to a temporary copy of `predictions`, so the database
+is left untouched.
+
+Usage:
+    python src/benchmarks/bench_write_to_table.py --db-host ... \
+        --sizes 1000 100000 1000000
+"""
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from db_utils import write_to_table, copy_to_table
+from inference import create_db_object, PREDICTIONS_TABLE, PREDICTIONS_COLUMNS
+from logger import Logger
+
+
+BENCH_TABLE = 'predictions_bench'
+WRITERS = {
+    'insert': lambda db, df: write_to_table(db, df, BENCH_TABLE),
+    'copy_csv': lambda db, df: copy_to_table(db, df, BENCH_TABLE, 'csv'),
+    'copy_binary': lambda db, df: copy_to_table(db, df, BENCH_TABLE, 'binary'),
+}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-host", type=str, required=True)
+    parser.add_argument("--db-port", type=int, required=True)
+    parser.add_argument("--db-user", type=str, required=True)
+    parser.add_argument("--db-password", type=str, required=True)
+    parser.add_argument("--db-name", type=str, required=True)
+    parser.add_argument("--sizes", type=int, nargs='+',
+                        default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--writers", type=str, nargs='+',
+                        default=list(WRITERS), choices=list(WRITERS))
+    parser.add_argument("--output", type=str, default=None,
+                        help="Path to save results as json.")
+    return parser.parse_args()
+
+
+def get_synthetic_predictions(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    m_probs = rng.random(n_rows, dtype=np.float32)
+    return pd.DataFrame({
+        'frequencies_id': np.arange(1, n_rows + 1),
+        'prediction': np.where(m_probs > 0.5, 'M', 'R'),
+        'm_probability': m_probs,
+    })[PREDICTIONS_COLUMNS]
+
+
+def create_bench_table(db) -> None:
+    # LIKE doesn't copy the foreign key, so synthetic ids are fine.
+    with db._conn.cursor() as curs:
+        curs.execute(f"CREATE TEMPORARY TABLE {BENCH_TABLE} " \
+                     f"(LIKE {PREDICTIONS_TABLE} INCLUDING DEFAULTS);")
+
+
+def time_writer(db, writer_name: str, data_df: pd.DataFrame) -> float:
+    with db._conn.cursor() as curs:
+        curs.execute(f"TRUNCATE {BENCH_TABLE};")
+    start = time.perf_counter()
+    WRITERS[writer_name](db, data_df)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    logger = Logger(show=True).get_logger(__name__)
+    args = parse_args()
+    db = create_db_object(args, logger)
+    create_bench_table(db)
+
+    results = []
+    for n_rows in args.sizes:
+        data_df = get_synthetic_predictions(n_rows)
+        for writer_name in args.writers:
+            seconds = time_writer(db, writer_name, data_df)
+            results.append({
+                'writer': writer_name,
+                'n_rows': n_rows,
+                'seconds': seconds,
+                'rows_per_second': n_rows / seconds,
+            })
+            logger.info(f"{writer_name:>12} {n_rows:>9} rows: " \
+                        f"{seconds:8.3f} s, {n_rows / seconds:12.0f} rows/s")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,383 @@
+"""
+Synthetic sonar feed. Inserts sonar-like rows into `frequencies` at a
+configurable rate while inference runs and measures how far behind the
+predictions are.
+
+Rows are rows of ./data/sonar.all-data with gaussian noise. Every
+`--tick` seconds the rows due by `--pattern` are inserted with one COPY
+(one NOTIFY for inference_service.py):
+    constant  `--rate` rows/s
+    poisson   Poisson arrivals, `--rate` rows/s on average
+    ramp      rate growing linearly from 0 to `--rate` over `--duration`
+    bursts    `--rate` rows/s plus `--burst-rows` rows every
+              `--burst-period` seconds
+
+The lag of a row is `predictions.created_at - frequencies.created_at`.
+Both columns default to clock_timestamp() (see create_init_sql.py) and
+are added to older tables if missing: existing rows keep NULL, so the
+tables are not rewritten. The backlog (rows of this run without
+predictions) is sampled every `--sample-interval` seconds from a second
+connection. After `--duration` seconds the simulator waits up to
+`--drain-timeout` seconds for the backlog to be predicted.
+
+Inference is run separately or by `--inference-cmd`. The command is
+started once and stopped with SIGINT at the end (inference_service.py),
+or, if `--inference-interval` is positive, run every that many seconds
+(one-shot inference.py, like cron).
+
+A positive `backlog_slope_rows_per_s` means inference doesn't keep up
+with the rate, and then `predicted_rows_per_s` is the throughput of one
+inference process. If `insert_rows_per_s` is below the rate, the
+database doesn't keep up with the inserts themselves.
+
+Usage:
+    python src/benchmarks/feed_simulator.py --rate 500 --duration 60 \
+        --pattern bursts --burst-rows 5000 --burst-period 15 \
+        --inference-cmd "python src/inference_service.py --poll-interval 5 --db-host ..." \
+        --db-host ... --db-port ... --db-user ... --db-password ... --db-name ...
+"""
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import argparse
+import json
+import shlex
+import signal
+import subprocess
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import psycopg2
+
+from db_utils import COPY_FORMATS, copy_to_table
+from inference import (create_db_object, DATA_TABLE, PREDICTIONS_TABLE,
+                       FREQ_COLUMNS, N_FREQS)
+from logger import Logger
+
+
+PATTERNS = ['constant', 'poisson', 'ramp', 'bursts']
+DATA_PATH = os.path.join('.', 'data', 'sonar.all-data')
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-host", type=str, required=True)
+    parser.add_argument("--db-port", type=int, required=True)
+    parser.add_argument("--db-user", type=str, required=True)
+    parser.add_argument("--db-password", type=str, required=True)
+    parser.add_argument("--db-name", type=str, required=True)
+    parser.add_argument("--rate", type=float, default=100.0,
+                        help="Rows per second.")
+    parser.add_argument("--duration", type=float, default=60.0,
+                        help="Seconds of inserting.")
+    parser.add_argument("--pattern", type=str, default='constant',
+                        choices=PATTERNS)
+    parser.add_argument("--burst-rows", type=int, default=1000)
+    parser.add_argument("--burst-period", type=float, default=10.0)
+    parser.add_argument("--tick", type=float, default=0.1,
+                        help="Seconds between inserts.")
+    parser.add_argument("--noise", type=float, default=0.01,
+                        help="Standard deviation of noise added to rows.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--copy-format", type=str, default='csv',
+                        choices=COPY_FORMATS)
+    parser.add_argument("--sample-interval", type=float, default=1.0,
+                        help="Seconds between backlog samples.")
+    parser.add_argument("--drain-timeout", type=float, default=60.0)
+    parser.add_argument("--inference-cmd", type=str, default=None,
+                        help="Inference command run by the simulator.")
+    parser.add_argument(
+        "--inference-interval", type=float, default=0.0,
+        help="If positive, --inference-cmd is run every this many " \
+            "seconds. Otherwise it is started once and kept running.")
+    parser.add_argument("--inference-warmup", type=float, default=5.0,
+                        help="Seconds between starting --inference-cmd " \
+                            "and the first insert.")
+    parser.add_argument("--cleanup", action='store_true',
+                        help="Delete rows of this run and their predictions.")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Path to save the report as json.")
+    return parser.parse_args()
+
+
+def add_created_at_columns(db) -> None:
+    """Adds created_at columns to tables created by an older init.sql."""
+    with db._conn.cursor() as curs:
+        for table_name in [DATA_TABLE, PREDICTIONS_TABLE]:
+            curs.execute(f"ALTER TABLE {table_name} " \
+                         "ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ;")
+            curs.execute(f"ALTER TABLE {table_name} " \
+                         "ALTER COLUMN created_at SET DEFAULT clock_timestamp();")
+
+
+def load_base_rows(path: str = DATA_PATH) -> np.ndarray:
+    if os.path.exists(path):
+        return np.loadtxt(path, delimiter=',', usecols=range(N_FREQS))
+    return np.random.default_rng(0).random((208, N_FREQS))
+
+
+def make_rows(rng: np.random.Generator, base_rows: np.ndarray,
+              n_rows: int, noise: float) -> np.ndarray:
+    rows = base_rows[rng.integers(len(base_rows), size=n_rows)]
+    return np.clip(rows + rng.normal(0, noise, rows.shape), 0, 1)
+
+
+def get_expected_rows(args: argparse.Namespace, i_tick: int) -> float:
+    """Expected number of rows inserted on tick `i_tick`."""
+    if args.pattern == 'ramp':
+        return args.rate * (i_tick * args.tick / args.duration) * args.tick
+    expected = args.rate * args.tick
+    if args.pattern == 'bursts':
+        ticks_per_burst = max(round(args.burst_period / args.tick), 1)
+        if i_tick % ticks_per_burst == 0:
+            expected += args.burst_rows
+    return expected
+
+
+def get_max_id(db) -> int:
+    with db._conn.cursor(cursor_factory=psycopg2.extensions.cursor) as curs:
+        curs.execute(f"SELECT coalesce(max(id), 0) FROM {DATA_TABLE};")
+        return curs.fetchone()[0]
+
+
+def count_backlog(db, min_id: int) -> (int, int):
+    """Returns numbers of inserted and not predicted rows with ids above min_id."""
+    with db._conn.cursor(cursor_factory=psycopg2.extensions.cursor) as curs:
+        curs.execute(
+            "SELECT count(*), count(*) FILTER (WHERE NOT EXISTS (" \
+            f"SELECT 1 FROM {PREDICTIONS_TABLE} AS p " \
+            "WHERE p.frequencies_id = f.id)) " \
+            f"FROM {DATA_TABLE} AS f WHERE f.id > %(min_id)s;",
+            {'min_id': min_id})
+        return curs.fetchone()
+
+
+class BacklogSampler(threading.Thread):
+    """Samples the backlog every `interval` seconds until `stop`."""
+    def __init__(self, db, min_id: int, interval: float) -> None:
+        super().__init__(daemon=True, name='backlog-sampler')
+        self.db = db
+        self.min_id = min_id
+        self.interval = interval
+        self.samples: List[Dict[str, float]] = []
+        self.start_time = time.perf_counter()
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while True:
+            inserted, backlog = count_backlog(self.db, self.min_id)
+            self.samples.append({
+                't': time.perf_counter() - self.start_time,
+                'inserted': inserted, 'backlog': backlog})
+            if self._stopped.wait(self.interval):
+                return
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+
+class InferenceRunner:
+    """
+    Runs the inference command in the background.
+
+    Arguments:
+    ----------
+    cmd: str
+    interval: float
+        If positive, the command is run every `interval` seconds
+        (or right after the previous run if it takes longer).
+        Otherwise it is started once and stopped with SIGINT by `stop`.
+    logger: Logger
+    """
+    def __init__(self, cmd: str, interval: float, logger) -> None:
+        self.cmd = shlex.split(cmd)
+        self.interval = interval
+        self.logger = logger
+        self.n_runs = 0
+        self._process: Optional[subprocess.Popen] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def _run_periodically(self) -> None:
+        while not self._stopped.is_set():
+            start = time.perf_counter()
+            self._process = subprocess.Popen(self.cmd)
+            returncode = self._process.wait()
+            self.n_runs += 1
+            if returncode != 0:
+                self.logger.warning(f"Inference exited with {returncode}")
+            self._stopped.wait(self.interval - (time.perf_counter() - start))
+
+    def start(self) -> None:
+        if self.interval > 0:
+            self._thread = threading.Thread(target=self._run_periodically,
+                                            daemon=True, name='inference')
+            self._thread.start()
+        else:
+            self._process = subprocess.Popen(self.cmd)
+            self.n_runs = 1
+
+    def stop(self, timeout: float = 30.0) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            # Let the running one-shot inference finish.
+            self._thread.join()
+            return
+        self._process.send_signal(signal.SIGINT)
+        try:
+            self._process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+
+
+def feed(db, args: argparse.Namespace, logger) -> (int, float):
+    """Inserts rows by the pattern. Returns number of rows and seconds."""
+    rng = np.random.default_rng(args.seed)
+    base_rows = load_base_rows()
+    n_ticks = int(round(args.duration / args.tick))
+    n_inserted = 0
+    carry = 0.0
+    start = time.perf_counter()
+    for i_tick in range(n_ticks):
+        delay = start + i_tick * args.tick - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        expected = get_expected_rows(args, i_tick)
+        if args.pattern == 'poisson':
+            n_rows = int(rng.poisson(expected))
+        else:
+            n_rows = int(expected + carry)
+            carry = expected + carry - n_rows
+        if n_rows == 0:
+            continue
+        rows = make_rows(rng, base_rows, n_rows, args.noise)
+        copy_to_table(db, pd.DataFrame(rows, columns=FREQ_COLUMNS),
+                      DATA_TABLE, args.copy_format)
+        n_inserted += n_rows
+    elapsed = time.perf_counter() - start
+    logger.info(f"Inserted {n_inserted} rows in {elapsed:.1f} s " \
+                f"({n_inserted / elapsed:.0f} rows/s)")
+    return n_inserted, elapsed
+
+
+def wait_for_drain(db, min_id: int, timeout: float, interval: float) -> int:
+    """Waits until rows above min_id are predicted. Returns the backlog left."""
+    deadline = time.perf_counter() + timeout
+    while True:
+        _, backlog = count_backlog(db, min_id)
+        if backlog == 0 or time.perf_counter() >= deadline:
+            return backlog
+        time.sleep(interval)
+
+
+def get_lags(db, min_id: int) -> (np.ndarray, Optional[float]):
+    """
+    Returns insert-to-prediction lags (seconds) of rows above min_id and
+    seconds from the first insert to the last prediction.
+    A row predicted several times counts with its first prediction.
+    """
+    with db._conn.cursor(cursor_factory=psycopg2.extensions.cursor) as curs:
+        curs.execute(
+            "SELECT EXTRACT(EPOCH FROM min(p.created_at) - f.created_at) " \
+            f"FROM {DATA_TABLE} AS f " \
+            f"JOIN {PREDICTIONS_TABLE} AS p ON p.frequencies_id = f.id " \
+            "WHERE f.id > %(min_id)s GROUP BY f.id, f.created_at;",
+            {'min_id': min_id})
+        lags = np.array([row[0] for row in curs.fetchall()], dtype=float)
+        curs.execute(
+            "SELECT EXTRACT(EPOCH FROM max(p.created_at) - min(f.created_at)) " \
+            f"FROM {DATA_TABLE} AS f " \
+            f"JOIN {PREDICTIONS_TABLE} AS p ON p.frequencies_id = f.id " \
+            "WHERE f.id > %(min_id)s;", {'min_id': min_id})
+        span = curs.fetchone()[0]
+    return lags, None if span is None else float(span)
+
+
+def get_backlog_slope(samples: List[Dict[str, float]],
+                      insert_seconds: float) -> float:
+    """Backlog growth (rows/s) fitted over samples taken while inserting."""
+    feed_samples = [s for s in samples if s['t'] <= insert_seconds]
+    if len(feed_samples) < 2:
+        return float('nan')
+    t = [s['t'] for s in feed_samples]
+    backlog = [s['backlog'] for s in feed_samples]
+    return float(np.polyfit(t, backlog, 1)[0])
+
+
+def delete_rows(db, min_id: int) -> None:
+    with db._conn.cursor() as curs:
+        curs.execute(f"DELETE FROM {PREDICTIONS_TABLE} " \
+                     "WHERE frequencies_id > %(min_id)s;", {'min_id': min_id})
+        curs.execute(f"DELETE FROM {DATA_TABLE} WHERE id > %(min_id)s;",
+                     {'min_id': min_id})
+
+
+if __name__ == "__main__":
+    logger = Logger(show=True).get_logger(__name__)
+    args = parse_args()
+
+    db = create_db_object(args, logger)
+    sampler_db = create_db_object(args, logger)
+    add_created_at_columns(db)
+    # Rows of other writers inserted during the run are counted too.
+    min_id = get_max_id(db)
+
+    runner = None
+    if args.inference_cmd:
+        runner = InferenceRunner(args.inference_cmd, args.inference_interval,
+                                 logger)
+        runner.start()
+        time.sleep(args.inference_warmup)
+
+    sampler = BacklogSampler(sampler_db, min_id, args.sample_interval)
+    sampler.start()
+    try:
+        n_inserted, insert_seconds = feed(db, args, logger)
+        not_predicted = wait_for_drain(db, min_id, args.drain_timeout,
+                                       args.sample_interval)
+    finally:
+        sampler.stop()
+        if runner is not None:
+            runner.stop()
+
+    lags, span = get_lags(db, min_id)
+    p50, p95, p99 = (np.percentile(lags, [50, 95, 99])
+                     if len(lags) else [float('nan')] * 3)
+    report = {
+        'pattern': args.pattern,
+        'rate': args.rate,
+        'duration': args.duration,
+        'inserted': n_inserted,
+        'insert_rows_per_s': n_inserted / insert_seconds,
+        'predicted': len(lags),
+        'not_predicted': not_predicted,
+        'predicted_rows_per_s': len(lags) / span if span else float('nan'),
+        'inference_runs': runner.n_runs if runner is not None else None,
+        'lag_p50_s': float(p50),
+        'lag_p95_s': float(p95),
+        'lag_p99_s': float(p99),
+        'lag_max_s': float(lags.max()) if len(lags) else float('nan'),
+        'max_backlog': max(s['backlog'] for s in sampler.samples),
+        'backlog_slope_rows_per_s': get_backlog_slope(sampler.samples,
+                                                      insert_seconds),
+        'backlog': sampler.samples,
+    }
+
+    logger.info(
+        f"{report['predicted']} of {report['inserted']} rows predicted " \
+        f"({report['predicted_rows_per_s']:.0f} rows/s), " \
+        f"lag p50 {report['lag_p50_s']:.3f} s, p95 {report['lag_p95_s']:.3f} s, " \
+        f"p99 {report['lag_p99_s']:.3f} s, max {report['lag_max_s']:.3f} s; " \
+        f"backlog max {report['max_backlog']}, " \
+        f"growth {report['backlog_slope_rows_per_s']:.1f} rows/s")
+
+    if args.cleanup:
+        delete_rows(db, min_id)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
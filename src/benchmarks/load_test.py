@@ -0,0 +1,138 @@
+"""
+Load test of prediction_server.py.
+
+`--concurrency` clients send single-row /predict requests over
+keep-alive connections, each client waiting for a response before
+sending its next request. Reports latency percentiles and requests/s.
+
+Usage:
+    python src/prediction_server.py --port 8000 &
+    python src/benchmarks/load_test.py --url http://127.0.0.1:8000 --concurrency 32 --requests 20000
+"""
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import argparse
+import http.client
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from logger import Logger
+
+
+N_FREQS = 60
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", type=str, default='http://127.0.0.1:8000')
+    parser.add_argument("--concurrency", type=int, default=32,
+                        help="Number of concurrent clients.")
+    parser.add_argument("--requests", type=int, default=10_000,
+                        help="Total number of requests.")
+    parser.add_argument("--warmup-requests", type=int, default=200)
+    parser.add_argument("--output", type=str, default=None,
+                        help="Path to save the report as json.")
+    return parser.parse_args()
+
+
+def run_client(host: str, port: int, n_requests: int,
+               seed: int) -> (List[float], int):
+    """
+    Sends `n_requests` requests one after another.
+    Returns latencies of successful requests (seconds) and number of errors.
+    """
+    rng = np.random.default_rng(seed)
+    bodies = [json.dumps({'frequencies': row.tolist(), 'id': i}).encode()
+              for i, row in enumerate(rng.random((min(n_requests, 1000), N_FREQS)))]
+    headers = {'Content-Type': 'application/json'}
+    latencies = []
+    n_errors = 0
+    conn = http.client.HTTPConnection(host, port)
+    try:
+        for i in range(n_requests):
+            start = time.perf_counter()
+            try:
+                conn.request('POST', '/predict', bodies[i % len(bodies)], headers)
+                response = conn.getresponse()
+                response.read()
+            except (http.client.HTTPException, OSError):
+                n_errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection(host, port)
+                continue
+            if response.status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                n_errors += 1
+    finally:
+        conn.close()
+    return latencies, n_errors
+
+
+def run_load(host: str, port: int, concurrency: int,
+             n_requests: int) -> Dict[str, float]:
+    per_client = [n_requests // concurrency
+                  + (i < n_requests % concurrency) for i in range(concurrency)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(run_client, [host] * concurrency,
+                                    [port] * concurrency, per_client,
+                                    range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.concatenate([np.array(client_latencies)
+                                for client_latencies, _ in results])
+    n_errors = sum(client_errors for _, client_errors in results)
+    p50, p95, p99 = (np.percentile(latencies, [50, 95, 99]) * 1e3
+                     if len(latencies) else [float('nan')] * 3)
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': n_errors,
+        'seconds': elapsed,
+        'requests_per_second': len(latencies) / elapsed,
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+    }
+
+
+def get_health(host: str, port: int) -> Dict:
+    conn = http.client.HTTPConnection(host, port)
+    try:
+        conn.request('GET', '/health')
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    logger = Logger(show=True).get_logger(__name__)
+    args = parse_args()
+    url = urlsplit(args.url)
+
+    if args.warmup_requests:
+        run_load(url.hostname, url.port, args.concurrency, args.warmup_requests)
+    health_before = get_health(url.hostname, url.port)
+    report = run_load(url.hostname, url.port, args.concurrency, args.requests)
+    health_after = get_health(url.hostname, url.port)
+    n_batches = health_after['batches'] - health_before['batches']
+    n_predicted = health_after['requests'] - health_before['requests']
+    report['mean_batch_size'] = n_predicted / max(n_batches, 1)
+
+    logger.info(
+        f"{report['requests']} requests ({report['errors']} errors) " \
+        f"with concurrency {report['concurrency']}: " \
+        f"{report['requests_per_second']:.0f} req/s, " \
+        f"p50 {report['p50_ms']:.2f} ms, p95 {report['p95_ms']:.2f} ms, " \
+        f"p99 {report['p99_ms']:.2f} ms, " \
+        f"mean batch {report['mean_batch_size']:.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
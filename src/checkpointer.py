@@ -0,0 +1,141 @@
+"""
+Checkpoints written by a background thread.
+
+`AsyncCheckpointer.save` only copies tensors of the state to the CPU (the
+training loop keeps updating the originals in place) and queues it;
+serialization and disk I/O happen in a writer thread. Every file is
+written next to its path, fsynced and atomically renamed, so a crash
+leaves either the previous checkpoint or the new one, never a partially
+written file. Rotated checkpoints are deleted when more than `keep_last`
+of them exist, counting the ones left by earlier runs, e.g. before
+training was resumed. At most `max_queued` states wait to be written:
+`save` blocks while the queue is full, so a slow disk can't pile up
+copies of the state in memory.
+"""
+
+import glob
+import os
+import queue
+import re
+import threading
+from collections import deque
+from typing import Any, Deque, List, Optional
+
+import torch
+
+
+def copy_to_cpu(obj: Any) -> Any:
+    """Copies tensors of nested dicts, lists and tuples to the CPU."""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {key: copy_to_cpu(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(copy_to_cpu(value) for value in obj)
+    return obj
+
+
+def save_atomic(obj: Any, path: str) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def find_checkpoints(path_pattern: str) -> List[str]:
+    """
+    Returns existing files matching a path with '{epoch}' (e.g.
+    'checkpoints/epoch_{epoch}.pt') sorted by epoch.
+    """
+    match = re.search(r'\{epoch(:[^}]*)?\}', path_pattern)
+    if match is None:
+        return [path_pattern] if os.path.exists(path_pattern) else []
+    prefix = path_pattern[:match.start()]
+    suffix = path_pattern[match.end():]
+    path_regex = re.compile(re.escape(prefix) + r'(\d+)' + re.escape(suffix))
+    epochs = {}
+    for path in glob.glob(glob.escape(prefix) + '*' + glob.escape(suffix)):
+        path_match = path_regex.fullmatch(path)
+        if path_match is not None:
+            epochs[path] = int(path_match.group(1))
+    return sorted(epochs, key=epochs.get)
+
+
+class AsyncCheckpointer:
+    """
+    Arguments:
+    ----------
+    keep_last: int
+        Number of the latest rotated checkpoints kept on disk,
+        0 - keep all.
+    path_pattern: Optional[str]
+        Path of the rotated checkpoints with '{epoch}'. Existing files
+        matching it are counted as rotated, oldest epoch first.
+    max_queued: int
+        Number of states waiting to be written, after which `save`
+        blocks.
+    """
+    def __init__(self, keep_last: int = 3,
+                 path_pattern: Optional[str] = None,
+                 max_queued: int = 2) -> None:
+        self.keep_last = keep_last
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queued)
+        self._rotated: Deque[str] = deque(
+            find_checkpoints(path_pattern) if path_pattern else [])
+        self._error: Optional[BaseException] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _write(self) -> None:
+        while True:
+            state, path, rotate = self._queue.get()
+            try:
+                if self._error is None:
+                    save_atomic(state, path)
+                    if rotate:
+                        self._rotate(path)
+            except BaseException as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _rotate(self, path: str) -> None:
+        if path in self._rotated:
+            self._rotated.remove(path)
+        self._rotated.append(path)
+        while self.keep_last and len(self._rotated) > self.keep_last:
+            old_path = self._rotated.popleft()
+            if os.path.exists(old_path):
+                os.remove(old_path)
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Checkpoint writing failed") from error
+
+    def save(self, state: Any, path: str, rotate: bool = False) -> None:
+        """
+        Queues `state` to be saved to `path`. Returns after copying its
+        tensors to the CPU and, if `max_queued` states are already
+        waiting, after one of them is written.
+
+        Arguments:
+        ----------
+        state: Any
+            torch.save-able object.
+        path: str
+        rotate: bool
+            Count the file among the checkpoints limited by `keep_last`.
+        """
+        self._raise_error()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._write, daemon=True,
+                                            name='checkpointer')
+            self._thread.start()
+        self._queue.put((copy_to_cpu(state), path, rotate))
+
+    def wait(self) -> None:
+        """Blocks until queued checkpoints are written."""
+        self._queue.join()
+        self._raise_error()
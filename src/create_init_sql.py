@@ -10,8 +10,26 @@ CREATE TABLE predictions
     frequencies_id   INT NOT NULL,
     prediction       TEXT  NOT NULL,
     m_probability    FLOAT NOT NULL,
+    created_at       TIMESTAMPTZ DEFAULT clock_timestamp(),
     FOREIGN KEY (frequencies_id) REFERENCES frequencies (id)
 );
+
+CREATE INDEX predictions_frequencies_id_idx ON predictions (frequencies_id);
+"""
+
+# Wakes up listeners (inference_service.py) once per inserting statement.
+CREATE_NOTIFY_TRIGGER_STATEMENT = \
+"""
+CREATE FUNCTION notify_new_frequencies() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('new_frequencies', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER frequencies_notify_insert
+AFTER INSERT ON frequencies
+FOR EACH STATEMENT EXECUTE FUNCTION notify_new_frequencies();
 """
 
 
@@ -22,7 +40,8 @@ def get_create_frequencies_statement(col_names) -> str:
     for col_name in col_names:
         statement += f"\n    {col_name}      FLOAT  NOT NULL,"
     
-    statement = statement[:-1]
+    # Insert time, used to measure the lag of predictions.
+    statement += "\n    created_at  TIMESTAMPTZ DEFAULT clock_timestamp()"
 
     statement += "\n);"
 
@@ -58,4 +77,5 @@ if __name__ == "__main__":
     fill_freq_statement = get_fill_freq_table_statements(X, col_names)
 
     with open("init.sql", 'w') as f:
-        f.write(f"{create_freq_table_statement}\n{CREATE_PRED_TABLE_STATEMENT}\n{fill_freq_statement}")
+        f.write(f"{create_freq_table_statement}\n{CREATE_PRED_TABLE_STATEMENT}" \
+                f"{CREATE_NOTIFY_TRIGGER_STATEMENT}\n{fill_freq_statement}")
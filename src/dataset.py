@@ -1,26 +1,109 @@
+import math
 from collections import Counter
+from typing import Iterator, Optional, Tuple
 
 import torch
 import numpy as np  # For type hints.
 
+from labels import I2LABEL, LABEL2I
+
+
+def load_split(X_path: str, y_path: str,
+               mmap: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Loads features (float32) and label indices (int64) saved by
+    prepare_data.py. The format is chosen by file extension.
+
+    Arguments:
+    ----------
+    X_path: str
+        Path to X_*.npy or X_*.csv.
+    y_path: str
+        Path to y_*.npy or y_*.csv.
+    mmap: bool
+        If True, .npy files are memory-mapped copy-on-write: pages are
+        read from disk on first access and shared with the page cache
+        instead of being copied into process memory.
+    """
+    mmap_mode = 'c' if mmap else None
+    if X_path.endswith('.npy'):
+        X = np.load(X_path, mmap_mode=mmap_mode)
+    else:
+        X = np.loadtxt(X_path, delimiter=",", dtype=np.float32, ndmin=2)
+    if y_path.endswith('.npy'):
+        y = np.load(y_path, mmap_mode=mmap_mode)
+    else:
+        y_strs = np.loadtxt(y_path, delimiter=",", dtype=str, ndmin=1)
+        y = np.array(list(map(LABEL2I.get, y_strs)), dtype=np.int64)
+    return X, y
+
 
 class SonarDataset(torch.utils.data.Dataset):
-    i2label = ['R', 'M']
-    label2i = {label: i for i, label in enumerate(i2label)}
-
-    def __init__(self, X_csv_path: str, y_csv_path: str) -> None:
-        X = np.loadtxt(X_csv_path, delimiter=",", dtype=float)
-        y_strs = np.loadtxt(y_csv_path, delimiter=",", dtype=str)
-        y_list  = list(map(self.label2i.get, y_strs))
-        
-        self.y = torch.tensor(y_list, dtype = torch.long, requires_grad=False)
-        self.X = torch.tensor(X, dtype = torch.float32, requires_grad=False)
-        
+    i2label = I2LABEL
+    label2i = LABEL2I
+
+    def __init__(self, X_path: str, y_path: str, mmap: bool = True) -> None:
+        X, y = load_split(X_path, y_path, mmap)
+
+        # No copy if dtypes already match, i.e. for .npy splits.
+        self.y = torch.as_tensor(y, dtype = torch.long)
+        self.X = torch.as_tensor(X, dtype = torch.float32)
+
     def __len__(self):
         return len(self.y)
-    
+
     def __getitem__(self, idx):
         return self.X[idx], self.y[idx]
-    
+
     def get_classes_distribution(self):
-        return Counter(map(lambda i: self.i2label[int(i)], self.y.numpy().flatten()))
\ No newline at end of file
+        return Counter(map(lambda i: self.i2label[int(i)], self.y.numpy().flatten()))
+
+
+class TensorBatchLoader:
+    """
+    Batches of a dataset whose features and labels are already tensors
+    (`dataset.X`, `dataset.y`, e.g. SonarDataset). Unlike DataLoader, it
+    doesn't get and collate rows one by one: a batch is a slice of the
+    tensors (a view, no copy) or, with `shuffle`, one indexing by a
+    slice of a random permutation.
+
+    Arguments:
+    ----------
+    dataset: torch.utils.data.Dataset
+        Dataset with `X` and `y` tensors of the same length.
+    batch_size: int
+    shuffle: bool
+        Rows are permuted every epoch with the global torch generator
+        (or `generator`).
+    drop_last: bool
+        Drop the last incomplete batch.
+    generator: Optional[torch.Generator]
+    """
+    def __init__(self, dataset: torch.utils.data.Dataset, batch_size: int = 1,
+                 shuffle: bool = False, drop_last: bool = False,
+                 generator: Optional[torch.Generator] = None) -> None:
+        if len(dataset.X) != len(dataset.y):
+            raise ValueError("X and y of the dataset should have equal length")
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.generator = generator
+
+    def __len__(self) -> int:
+        n_rows = len(self.dataset.y)
+        if self.drop_last:
+            return n_rows // self.batch_size
+        return math.ceil(n_rows / self.batch_size)
+
+    def __iter__(self) -> Iterator[Tuple[torch.Tensor, torch.Tensor]]:
+        X, y = self.dataset.X, self.dataset.y
+        if self.shuffle:
+            permutation = torch.randperm(len(y), generator=self.generator)
+        for i in range(len(self)):
+            start, end = i * self.batch_size, (i + 1) * self.batch_size
+            if self.shuffle:
+                index = permutation[start:end]
+                yield X[index], y[index]
+            else:
+                yield X[start:end], y[start:end]
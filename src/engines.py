@@ -0,0 +1,68 @@
+"""
+Selection of the inference engine.
+
+Engines are imported lazily, so that with the numpy engine
+torch is never imported.
+"""
+
+import hashlib
+import os
+from typing import Optional, Protocol
+
+import numpy as np
+
+
+ENGINES = ['torch', 'numpy']
+# See precision.py. Only the torch engine supports reduced precision.
+PRECISIONS = ['fp32', 'int8', 'bf16', 'fp16']
+
+
+class Predictor(Protocol):
+    def predict_proba(self, X: np.ndarray,
+                      batch_size: Optional[int] = None) -> np.ndarray:
+        """
+        Returns model outputs (class probabilities) for features X,
+        computed `batch_size` rows at a time (all at once if None).
+        """
+        ...
+
+
+def load_predictor(config, model_name, logger,
+                   engine: str = 'torch',
+                   precision: str = 'fp32') -> Predictor:
+    if precision not in PRECISIONS:
+        raise ValueError(f"precision should be one of {PRECISIONS}")
+    if engine == 'numpy':
+        if precision != 'fp32':
+            raise ValueError("numpy engine supports only fp32 precision")
+        from numpy_model import load_numpy_model
+        return load_numpy_model(config, model_name, logger)
+    if engine == 'torch':
+        from autotune import set_torch_threads
+        from model import load_model
+        set_torch_threads(config, 'inference', logger)
+        model = load_model(config, model_name, logger)
+        if precision == 'fp32':
+            return model
+        from precision import convert_precision
+        return convert_precision(model, precision)
+    raise ValueError(f"engine should be one of {ENGINES}")
+
+
+def get_model_version(config, model_name, engine: str = 'torch',
+                      precision: str = 'fp32') -> str:
+    """
+    Returns an id of the model `load_predictor` loads with the same
+    arguments: engine, precision and content hash of the model file.
+    """
+    if engine == 'numpy':
+        sha256 = hashlib.sha256()
+        with open(config[model_name]["numpy_model_path"], 'rb') as f:
+            sha256.update(f.read())
+        return f"numpy-{precision}-{sha256.hexdigest()}"
+    # The registry caches hashes until the file changes.
+    from model_registry import REGISTRY
+    path = config[model_name].get("model_path")
+    if path is None or not os.path.exists(path):
+        path = config[model_name]["model_optimizer_loss_dict_path"]
+    return f"{engine}-{precision}-{REGISTRY.get_version(path)}"
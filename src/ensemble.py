@@ -0,0 +1,341 @@
+"""
+Training of several MlpSonarModels at once: k-fold cross-validation or
+an ensemble of models with different initial weights.
+
+The model is tiny, so k separate Trainer runs are dominated by Python
+and framework overhead. Here the weights of all members are stacked
+into an MlpSonarEnsemble and every step is a few batched matmuls for
+all members. Each member sees only its rows: a (n_members, n_rows)
+mask selects them, and the loss of a member is the mean cross-entropy
+over its rows. Members share no parameters and Adam, AdamW and SGD
+update every element independently, so with full-dataset batches
+(the default, same as train.py) every member follows exactly the
+trajectory of a separate Trainer run on its rows.
+
+With --batch-size, batches are drawn from all rows and every member
+uses its masked part of each batch, so member batches are smaller and
+vary in size compared to a Trainer with the same batch size.
+
+Modes:
+    kfold  member i is trained on all folds of the train split but the
+           i-th and validated on the i-th one.
+    seeds  every member is trained on the whole train split with
+           different initial weights and validated on the test split.
+
+Per-member histories have the format of Trainer.history. Members
+are saved as an MlpSonarEnsemble artifact that averages their outputs
+and is loaded by model.load_model like a single model.
+
+Usage:
+    python src/ensemble.py --mode kfold --n-members 5
+    python src/ensemble.py --mode seeds --n-members 5 --output experiments/mlp_ensemble.pt
+"""
+
+import argparse
+import configparser
+import json
+import os
+import time
+from copy import deepcopy
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sklearn.model_selection import StratifiedKFold
+import torch
+import torch.nn.functional as F
+
+from autotune import set_torch_threads
+from dataset import load_split
+from logger import Logger
+from metric_accumulators import get_confusion_metrics
+from model import MlpSonarEnsemble, MlpSonarModel
+from model_registry import save_artifact
+from train import CONFIG_NAME, MODEL_NAME, get_optimizer, get_train_params
+
+
+SHOW_LOG = True
+MODES = ['kfold', 'seeds']
+
+
+def get_kfold_masks(y: np.ndarray, n_folds: int,
+                    seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns boolean (n_folds, n_rows) train and validation masks of
+    stratified folds: row j is in the validation set of member i if it
+    belongs to the i-th fold.
+    """
+    val_masks = np.zeros((n_folds, len(y)), dtype=bool)
+    folds = StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=seed)
+    for i, (_, val_index) in enumerate(folds.split(np.zeros(len(y)), y)):
+        val_masks[i, val_index] = True
+    return ~val_masks, val_masks
+
+
+def stack_models(models: List[MlpSonarModel]) -> MlpSonarEnsemble:
+    linear_1, linear_2 = models[0].model[0], models[0].model[2]
+    ensemble = MlpSonarEnsemble(len(models), linear_1.in_features,
+                                linear_1.out_features, linear_2.out_features)
+    ensemble.load_members(models)
+    return ensemble
+
+
+class EnsembleTrainer:
+    """
+    Trains all members of an MlpSonarEnsemble at once.
+
+    `history[i]` is the history of the i-th member in the format of
+    Trainer.history: {phase: {'f1_score', 'accuracy', 'loss': [...]}}.
+    Metrics are accumulated on the device as per-member confusion
+    matrices and copied to the host once per phase.
+
+    Arguments:
+    ----------
+    model: MlpSonarEnsemble
+    optimizer: torch.optim.Optimizer
+        An optimizer of `model.parameters()` that updates elements
+        independently (see OPTIMIZERS in train.py).
+    data: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]
+        {phase: (X, y, masks)} for phases 'train' and 'val'. `masks` is
+        a boolean (n_members, n_rows) array of the rows of every member.
+    batch_size: Optional[int]
+        Rows per batch (of all members). The whole phase is one batch
+        if None.
+    device: Optional[torch.device]
+    """
+    def __init__(self, model: MlpSonarEnsemble,
+                 optimizer: torch.optim.Optimizer,
+                 data: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]],
+                 batch_size: Optional[int] = None,
+                 device: Optional[torch.device] = None) -> None:
+        self.device = device or torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.model = model.to(self.device)
+        self.optimizer = optimizer
+        self.batch_size = batch_size
+        self.n_classes = self.model.w2.shape[2]
+        self.epoch = 0
+        self.phases = ['train', 'val']
+        self.data = {}
+        for phase in self.phases:
+            X, y, masks = data[phase]
+            if masks.shape != (model.n_members, len(y)):
+                raise ValueError(f"{phase} masks should have shape " \
+                                 f"{(model.n_members, len(y))}, got {masks.shape}")
+            self.data[phase] = (
+                torch.as_tensor(X, dtype=torch.float32).to(self.device),
+                torch.as_tensor(y, dtype=torch.long).to(self.device),
+                torch.as_tensor(masks, dtype=torch.float32).to(self.device))
+
+        self.phase_history_keys = ['f1_score', 'accuracy', 'loss']
+        self.history = [{
+            phase_name: {
+                key: [] for key in self.phase_history_keys
+            } for phase_name in self.phases
+        } for _ in range(model.n_members)]
+
+    def _get_batches(self, phase: str, n_rows: int) -> List[torch.Tensor]:
+        if self.batch_size is None or self.batch_size >= n_rows:
+            return [torch.arange(n_rows, device=self.device)]
+        if phase == 'train':
+            index = torch.randperm(n_rows, device=self.device)
+        else:
+            index = torch.arange(n_rows, device=self.device)
+        return list(torch.split(index, self.batch_size))
+
+    def run_phase(self, phase: str) -> None:
+        X, y, masks = self.data[phase]
+        n_members = self.model.n_members
+        member_index = torch.arange(n_members, device=self.device)[:, None]
+        loss_sum = torch.zeros(n_members, device=self.device)
+        n_batches = torch.zeros(n_members, device=self.device)
+        # [member, true class, predicted class]
+        confusion = torch.zeros(n_members, self.n_classes, self.n_classes,
+                                device=self.device)
+
+        self.model.train(phase == 'train')
+        with torch.set_grad_enabled(phase == 'train'):
+            for index in self._get_batches(phase, len(y)):
+                out = self.model.forward_members(X[index])
+                y_batch = y[index]
+                mask = masks[:, index]
+                rows = mask.sum(dim=1)
+                losses = F.cross_entropy(
+                    out.reshape(-1, self.n_classes),
+                    y_batch.repeat(n_members),
+                    reduction='none').view(n_members, -1)
+                # Mean over member's rows; members without rows get 0.
+                member_losses = (losses * mask).sum(dim=1) / rows.clamp(min=1)
+
+                if phase == 'train':
+                    self.optimizer.zero_grad()
+                    member_losses.sum().backward()
+                    self.optimizer.step()
+
+                loss_sum += member_losses.detach()
+                n_batches += rows > 0
+                preds = out.detach().argmax(dim=2)
+                confusion.index_put_(
+                    (member_index.expand_as(preds),
+                     y_batch.expand_as(preds), preds),
+                    mask, accumulate=True)
+
+        losses = (loss_sum / n_batches.clamp(min=1)).tolist()
+        for i, metrics in enumerate(self.get_metrics(confusion.cpu().numpy())):
+            metrics['loss'] = losses[i]
+            for metric_name, metric_value in metrics.items():
+                self.history[i][phase][metric_name].append(metric_value)
+
+    @staticmethod
+    def get_metrics(confusion: np.ndarray) -> List[Dict[str, float]]:
+        """
+        Accuracy and macro F1 of every member from (n_members, n_classes,
+        n_classes) confusion matrices. Like sklearn, F1 is averaged over
+        classes present in the labels or the predictions.
+        """
+        metrics = get_confusion_metrics(confusion)
+        return [{'accuracy': float(metrics['accuracy'][i]),
+                 'f1_score': float(metrics['f1_score'][i])}
+                for i in range(len(confusion))]
+
+    def train(self, n_epochs: int) -> None:
+        for _ in range(n_epochs):
+            for phase in self.phases:
+                self.run_phase(phase)
+            self.epoch += 1
+
+
+def get_ensemble_data(mode: str, n_members: int, seed: int,
+                      config: configparser.ConfigParser
+                      ) -> Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Returns EnsembleTrainer data for the mode from the SPLIT_DATA splits."""
+    X_train, y_train = load_split(config["SPLIT_DATA"]['X_train'],
+                                  config["SPLIT_DATA"]['y_train'])
+    if mode == 'kfold':
+        train_masks, val_masks = get_kfold_masks(y_train, n_members, seed)
+        return {'train': (X_train, y_train, train_masks),
+                'val': (X_train, y_train, val_masks)}
+    X_test, y_test = load_split(config["SPLIT_DATA"]['X_test'],
+                                config["SPLIT_DATA"]['y_test'])
+    return {'train': (X_train, y_train, np.ones((n_members, len(y_train)), bool)),
+            'val': (X_test, y_test, np.ones((n_members, len(y_test)), bool))}
+
+
+def train_sequentially(models: List[MlpSonarModel],
+                       data: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]],
+                       train_params: Dict, batch_size: Optional[int]
+                       ) -> List[Dict]:
+    """Trains members with separate Trainers, returns their histories."""
+    from train import Trainer
+
+    histories = []
+    for i, model in enumerate(models):
+        dataloaders = {}
+        for phase, (X, y, masks) in data.items():
+            dataset = torch.utils.data.TensorDataset(
+                torch.as_tensor(X[masks[i]], dtype=torch.float32),
+                torch.as_tensor(y[masks[i]], dtype=torch.long))
+            dataloaders[phase] = torch.utils.data.DataLoader(
+                dataset, batch_size=batch_size or len(dataset),
+                shuffle=phase == 'train')
+        optimizer = get_optimizer(train_params['optimizer'], model.parameters(),
+                                  train_params['lr'], train_params['weight_decay'])
+        trainer = Trainer(model, optimizer, torch.nn.CrossEntropyLoss(),
+                          dataloaders, device=torch.device('cpu'))
+        trainer.train(train_params['epochs'])
+        histories.append(trainer.history)
+    return histories
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", type=str, default='kfold', choices=MODES)
+    parser.add_argument("--n-members", type=int, default=5,
+                        help="Number of folds or of ensemble members.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--epochs", type=int, default=None,
+                        help="Epochs, from [mlp] of config.ini if not given.")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--output", type=str,
+                        default=os.path.join('.', 'experiments', 'mlp_ensemble.pt'),
+                        help="Path of the ensemble artifact.")
+    parser.add_argument("--no-save", action='store_true',
+                        help="Don't save the ensemble artifact.")
+    parser.add_argument("--history-output", type=str, default=None,
+                        help="Path of a json with per-member histories.")
+    parser.add_argument("--compare-sequential", action='store_true',
+                        help="Also train the members with separate " \
+                            "Trainers and compare time and histories.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logger_getter = Logger(SHOW_LOG)
+    logger = logger_getter.get_logger(__name__)
+
+    args = parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(CONFIG_NAME)
+    set_torch_threads(config, 'train', logger)
+
+    train_params = get_train_params(config, MODEL_NAME)
+    if args.epochs is not None:
+        train_params['epochs'] = args.epochs
+    logger.info(f"Training {args.n_members} members ({args.mode}) " \
+                f"with parameters {train_params}")
+
+    data = get_ensemble_data(args.mode, args.n_members, args.seed, config)
+
+    torch.manual_seed(args.seed)
+    model_params = {
+        'input_size': 60,
+        'hidden_size': train_params['hidden_size'],
+        'output_size': 2,
+    }
+    models = [MlpSonarModel(**model_params) for _ in range(args.n_members)]
+    ensemble = stack_models(models)
+    optimizer = get_optimizer(train_params['optimizer'], ensemble.parameters(),
+                              train_params['lr'], train_params['weight_decay'])
+    trainer = EnsembleTrainer(ensemble, optimizer, data, args.batch_size,
+                              device=torch.device('cpu'))
+
+    start = time.perf_counter()
+    trainer.train(train_params['epochs'])
+    ensemble_time = time.perf_counter() - start
+    logger.info(f"Trained {args.n_members} members in {ensemble_time:.2f} s")
+
+    for i, history in enumerate(trainer.history):
+        logger.info(f"Member {i}: " + ", ".join(
+            f"val {metric} {values[-1]:.4f}"
+            for metric, values in history['val'].items()))
+    for metric in trainer.phase_history_keys:
+        values = [history['val'][metric][-1] for history in trainer.history]
+        logger.info(f"val {metric}: {np.mean(values):.4f} " \
+                    f"+- {np.std(values):.4f}")
+
+    if args.compare_sequential:
+        start = time.perf_counter()
+        histories = train_sequentially(
+            [deepcopy(model) for model in models], data, train_params,
+            args.batch_size)
+        sequential_time = time.perf_counter() - start
+        max_diff = max(
+            abs(a - b)
+            for history, ensemble_history in zip(histories, trainer.history)
+            for phase in trainer.phases
+            for metric in trainer.phase_history_keys
+            for a, b in zip(history[phase][metric],
+                            ensemble_history[phase][metric]))
+        logger.info(f"Separate Trainers: {sequential_time:.2f} s " \
+                    f"({sequential_time / ensemble_time:.1f}x), " \
+                    f"max history difference {max_diff:.2e}")
+
+    if args.history_output is not None:
+        with open(args.history_output, 'w') as f:
+            json.dump(trainer.history, f)
+
+    if not args.no_save:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        save_artifact(ensemble, {'n_members': args.n_members, **model_params},
+                      args.output)
+        logger.info(f"Saved the ensemble to {args.output}. Set model_path " \
+                    f"of [{MODEL_NAME}] in {CONFIG_NAME} to use it for inference")
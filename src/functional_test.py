@@ -1,3 +1,4 @@
+import argparse
 import configparser
 import sys
 import os
@@ -6,13 +7,12 @@ from datetime import datetime
 import shutil
 import yaml
 
-import torch
 import numpy as np
 from sklearn.metrics import accuracy_score, f1_score
 
-from logger import Logger
-from dataset import SonarDataset
-from model import load_model
+from logger import Logger, flush_logs
+from labels import LABEL2I
+from engines import ENGINES, load_predictor
 
 
 SHOW_LOG = True
@@ -32,11 +32,9 @@ def functional_test(model, config, logger):
                 logger.exception()
                 sys.exit(1)
 
-            X = torch.tensor(data['X'], dtype = torch.float32, requires_grad=False)
-            y_list = [SonarDataset.label2i[label] for label in data['y']]
-            with torch.no_grad():
-                probs = model(X)
-                probs = probs.numpy()
+            X = np.array(data['X'], dtype=np.float32)
+            y_list = [LABEL2I[label] for label in data['y']]
+            probs = model.predict_proba(X)
             preds = np.argmax(probs, axis=1)
             accuracy = accuracy_score(preds, y_list)
             
@@ -55,9 +53,17 @@ def functional_test(model, config, logger):
             os.mkdir(exp_dir)
             with open(os.path.join(exp_dir,"exp_config.yaml"), 'w') as exp_f:
                 yaml.safe_dump(exp_data, exp_f, sort_keys=False)
+            # Records are written by a background thread.
+            flush_logs()
             shutil.copy(os.path.join(os.getcwd(), "logfile.log"), os.path.join(exp_dir,"exp_logfile.log"))
 
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engine", type=str, default='torch', choices=ENGINES)
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
     logger_getter = Logger(SHOW_LOG)
     logger = logger_getter.get_logger(__name__)
@@ -65,7 +71,8 @@ if __name__ == "__main__":
     config = configparser.ConfigParser()
     config.read(CONFIG_NAME)
 
+    args = parse_args()
 
-    model = load_model(config, MODEL_NAME, logger)
+    model = load_predictor(config, MODEL_NAME, logger, args.engine)
     
     functional_test(model, config, logger)
\ No newline at end of file
@@ -5,17 +5,24 @@ and writes the predictions back to the database.
 
 import argparse
 import configparser
+import logging
 import sys
+import time
+from typing import Dict, Iterator, Optional, Tuple
 
 import greenplumpython as gp
+import psycopg2
 import pandas as pd
-import torch
 import numpy as np
 
-from model import load_model
-from db_utils import write_to_table
-from dataset import SonarDataset
-from logger import Logger
+from autotune import get_tuned_value
+from engines import (ENGINES, PRECISIONS, Predictor,
+                     get_model_version, load_predictor)
+from db_utils import CopyWriter, COPY_FORMATS
+from inference_metrics import InferenceMetrics
+from labels import get_preds_and_m_probs
+from logger import Lazy, Logger
+from prediction_cache import DEFAULT_CACHE_TABLE, PredictionCache
 
 
 SHOW_LOG = True
@@ -23,19 +30,83 @@ CONFIG_NAME = 'config.ini'
 MODEL_NAME = 'mlp'
 DATA_TABLE = 'frequencies'
 PREDICTIONS_TABLE = 'predictions'
+N_FREQS = 60
+FREQ_COLUMNS = [f'freq_{i}' for i in range(N_FREQS)]
+PREDICTIONS_COLUMNS = ['frequencies_id', 'prediction', 'm_probability']
 
 
-def parse_args() -> argparse.Namespace:
+def get_args_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
     parser.add_argument("--db-host", type=str, required=True)
     parser.add_argument("--db-port", type=int, required=True)
     parser.add_argument("--db-user", type=str, required=True)
     parser.add_argument("--db-password", type=str, required=True)
     parser.add_argument("--db-name", type=str, required=True)
+    parser.add_argument(
+        "--chunk-size", type=int, default=0,
+        help="If positive, the backlog is streamed from the database " \
+            "and predicted in chunks of this many rows. " \
+            "Otherwise the whole backlog is predicted at once.")
+    parser.add_argument(
+        "--copy-format", type=str, default='csv', choices=COPY_FORMATS,
+        help="Format of COPY FROM STDIN used to write predictions.")
+    parser.add_argument(
+        "--engine", type=str, default='torch', choices=ENGINES,
+        help="numpy engine doesn't import torch. " \
+            "It needs the model exported with numpy_model.py.")
+    parser.add_argument(
+        "--precision", type=str, default='fp32', choices=PRECISIONS,
+        help="Inference precision of the torch engine. " \
+            "Check its parity with fp32 with precision.py.")
+    parser.add_argument(
+        "--batch-size", type=int, default=None,
+        help="Number of rows the model predicts at a time. " \
+            "Defaults to inference_batch_size found by autotune.py, " \
+            "otherwise the whole chunk is one batch.")
+    parser.add_argument(
+        "--cache-size", type=int, default=0,
+        help="If positive, predictions of up to this many feature " \
+            "vectors are cached in memory and duplicates are predicted once.")
+    parser.add_argument(
+        "--cache-decimals", type=int, default=6,
+        help="Features are rounded to this many decimals for the cache key.")
+    parser.add_argument(
+        "--cache-table", type=str, nargs='?', default=None,
+        const=DEFAULT_CACHE_TABLE,
+        help="Also keep cached predictions in this table " \
+            f"(default name: {DEFAULT_CACHE_TABLE}).")
+    return parser
+
+
+def parse_args() -> argparse.Namespace:
+    parser = get_args_parser()
+    parser.add_argument(
+        "--metrics-file", type=str, default=None,
+        help="Write metrics of the run to this file in the Prometheus " \
+            "text format (for the node_exporter textfile collector).")
     return parser.parse_args()
 
-def create_db_object(args: argparse.Namespace, logger: Logger) -> gp.Database:
-    params = dict(
+def get_batch_size(args: argparse.Namespace,
+                   config: configparser.ConfigParser) -> Optional[int]:
+    """Returns --batch-size or the tuned one, None means no batching."""
+    batch_size = args.batch_size
+    if batch_size is None:
+        batch_size = get_tuned_value(config, 'inference', 'batch_size')
+    return batch_size or None
+
+def create_prediction_cache(args: argparse.Namespace,
+                            config: configparser.ConfigParser,
+                            db: gp.Database) -> Optional[PredictionCache]:
+    """Returns the cache configured by --cache-* arguments or None."""
+    if args.cache_size <= 0:
+        return None
+    return PredictionCache(
+        get_model_version(config, MODEL_NAME, args.engine, args.precision),
+        max_size=args.cache_size, decimals=args.cache_decimals,
+        db=db, table=args.cache_table)
+
+def get_db_params(args: argparse.Namespace) -> Dict[str, str]:
+    return dict(
         host=args.db_host,
         port=args.db_port,
         dbname=args.db_name,
@@ -43,8 +114,16 @@ def create_db_object(args: argparse.Namespace, logger: Logger) -> gp.Database:
         password=args.db_password
     )
 
+def connect_db(args: argparse.Namespace) -> gp.Database:
+    """
+    Connects to the database. Unlike `create_db_object`, raises
+    psycopg2 errors instead of exiting, so that callers can retry.
+    """
+    return gp.Database(params=get_db_params(args))
+
+def create_db_object(args: argparse.Namespace, logger: Logger) -> gp.Database:
     try:
-        db = gp.Database(params=params)
+        db = connect_db(args)
         logger.debug(f"Created Database object")
     except:
         logger.exception(f"Failed to create database object")
@@ -55,6 +134,9 @@ def create_db_object(args: argparse.Namespace, logger: Logger) -> gp.Database:
 def log_table_columns_to_debug(db: gp.Database,
                                table_name: str,
                                logger: Logger) -> None:
+    # Costs a query, skip it unless the result is logged.
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
     with db._conn.cursor() as curs:
         curs.execute(
             "select column_name, data_type " \
@@ -64,67 +146,135 @@ def log_table_columns_to_debug(db: gp.Database,
         logger.debug(f"prediction_table_columns: {prediction_table_columns}")
     
 
-def get_feats_without_preds(db: gp.Database, 
-                            logger: Logger) -> (np.ndarray, np.ndarray):
-    """
-    Returns array of features that have no predictions yet
-    and array of their ids.
+def get_feats_without_preds_query(incremental: bool = False,
+                                  bounded: bool = False) -> str:
     """
-    X = gp.DataFrame.from_table(DATA_TABLE, db=db)    
+    Returns a query that selects ids and features of `DATA_TABLE` rows
+    that have no rows in `PREDICTIONS_TABLE` yet.
 
-    X = pd.DataFrame(X)
-
-    X = X.rename(columns={"id": "frequencies_id"})
-
-    logger.debug(f"X.columns = {X.columns}")
-
-    preds_gp = gp.DataFrame.from_table(PREDICTIONS_TABLE, db=db)
-
-    preds_df = pd.DataFrame(preds_gp)
-    
-    if len(preds_df) == 0:
-        logger.debug("preds_df is empty")
-        preds_df = pd.DataFrame(columns = ['prediction_id', 'frequencies_id', 'prediction', 'm_probability'])
-
-    merged_df = X.join(
-        preds_df, how = 'left', on = "frequencies_id", rsuffix="_pred_table")
-    merged_df= merged_df.drop('frequencies_id_pred_table', axis = 1)
-
-    logger.debug(f"merged_df.columns = {merged_df.columns}")
-
-    logger.debug(f"merged_df.head(): \n{merged_df.head()}")
-
-    not_predicted_df = merged_df[merged_df['prediction'].isnull()]
-
-    n_freqs = 60
-    data_np = not_predicted_df[[f'freq_{i}' for i in range(n_freqs)]].values
-
-    freq_ids_np = not_predicted_df[['frequencies_id']].values
+    The anti-join is done by the database, so only the backlog
+    (not the whole tables) is transferred to the client.
 
+    If `incremental` is True, only rows with `id > %(min_id)s` are selected.
+    If `bounded` is True, only rows with `id <= %(max_id)s` are selected.
+    """
+    freq_columns_str = ", ".join(f"f.{col}" for col in FREQ_COLUMNS)
+    return f"SELECT f.id, {freq_columns_str} " \
+        f"FROM {DATA_TABLE} AS f " \
+        "WHERE NOT EXISTS (" \
+        f"SELECT 1 FROM {PREDICTIONS_TABLE} AS p " \
+        "WHERE p.frequencies_id = f.id) " \
+        + ("AND f.id > %(min_id)s " if incremental else "") \
+        + ("AND f.id <= %(max_id)s " if bounded else "") \
+        + "ORDER BY f.id"
+
+
+def rows_to_feats_and_ids(rows: list) -> (np.ndarray, np.ndarray):
+    """
+    Converts (id, freq_0, ..., freq_59) rows into array of features
+    and array of ids.
+    """
+    if len(rows) == 0:
+        return np.empty((0, N_FREQS)), np.empty((0, 1), dtype=np.int64)
+    rows_np = np.array(rows, dtype=float)
+    data_np = rows_np[:, 1:]
+    freq_ids_np = rows_np[:, :1].astype(np.int64)
     return data_np, freq_ids_np
 
 
-def get_pred_table_new_vals_df(model_input: np.ndarray,
-                               freq_ids: np.ndarray) -> pd.DataFrame:
-    model_input = torch.tensor(model_input,
-                              dtype = torch.float32,
-                              requires_grad=False)
-
-    model = load_model(config, MODEL_NAME, logger)
-
-    outs = model(model_input)
-    outs_np = outs.numpy(force = True)
+def get_feats_without_preds(db: gp.Database, 
+                            logger: Logger,
+                            min_id: Optional[int] = None,
+                            metrics: Optional[InferenceMetrics] = None
+                            ) -> (np.ndarray, np.ndarray):
+    """
+    Returns array of features that have no predictions yet
+    and array of their ids.
 
-    m_index = SonarDataset.label2i['M']
-    m_probs = outs_np[:, m_index]
+    If `min_id` is given, only rows with greater ids are considered.
+    """
+    start = time.perf_counter()
+    # greenplumpython connection uses RealDictCursor by default.
+    # Plain tuples are much cheaper to build and to convert to numpy.
+    with db._conn.cursor(cursor_factory=psycopg2.extensions.cursor) as curs:
+        if min_id is None:
+            curs.execute(get_feats_without_preds_query())
+        else:
+            curs.execute(get_feats_without_preds_query(incremental=True),
+                         {'min_id': min_id})
+        rows = curs.fetchall()
+
+    logger.debug("Fetched %d rows without predictions", len(rows))
+
+    feats_and_ids = rows_to_feats_and_ids(rows)
+    if metrics is not None:
+        metrics.observe_stage('fetch', time.perf_counter() - start,
+                              len(rows), round_trips=1)
+    return feats_and_ids
+
+
+def iter_feats_without_preds(db: gp.Database,
+                             chunk_size: int,
+                             logger: Logger,
+                             min_id: Optional[int] = None,
+                             max_id: Optional[int] = None,
+                             metrics: Optional[InferenceMetrics] = None
+                             ) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Yields chunks of features that have no predictions yet
+    and arrays of their ids.
 
-    preds = outs_np.argmax(axis = 1)
+    Rows are read through a server-side (named) cursor, so at most
+    `chunk_size` rows are held by the client at a time.
+    If given, only ids in (`min_id`, `max_id`] are considered.
+    """
+    query = get_feats_without_preds_query(incremental=min_id is not None,
+                                          bounded=max_id is not None)
+    # The connection is in autocommit mode, so the cursor is declared
+    # WITH HOLD to outlive the transactions that write predictions.
+    with db._conn.cursor(name='feats_without_preds',
+                         withhold=True,
+                         cursor_factory=psycopg2.extensions.cursor) as curs:
+        curs.itersize = chunk_size
+        start = time.perf_counter()
+        # DECLARE, then a FETCH per chunk.
+        curs.execute(query, {'min_id': min_id, 'max_id': max_id})
+        round_trips = 2
+        while True:
+            rows = curs.fetchmany(chunk_size)
+            if len(rows) == 0:
+                break
+            logger.debug("Fetched chunk of %d rows without predictions",
+                         len(rows))
+            feats_and_ids = rows_to_feats_and_ids(rows)
+            if metrics is not None:
+                metrics.observe_stage('fetch', time.perf_counter() - start,
+                                      len(rows), round_trips)
+            yield feats_and_ids
+            start = time.perf_counter()
+            round_trips = 1
+        if metrics is not None:
+            metrics.observe_stage('fetch', time.perf_counter() - start,
+                                  round_trips=round_trips)
 
-    logger.debug(f"preds.shape = {preds.shape}")
-    logger.debug(f"m_probs.shape = {m_probs.shape}")
-    logger.debug(f"freq_ids_np.shape = {freq_ids_np.shape}")
 
-    preds = [SonarDataset.i2label[pred] for pred in preds]
+def get_pred_table_new_vals_df(model_input: np.ndarray,
+                               freq_ids: np.ndarray,
+                               model: Predictor,
+                               logger: Logger,
+                               batch_size: Optional[int] = None,
+                               cache: Optional[PredictionCache] = None,
+                               metrics: Optional[InferenceMetrics] = None
+                               ) -> pd.DataFrame:
+    start = time.perf_counter()
+    if cache is not None:
+        preds, m_probs = cache.predict(model, model_input, batch_size)
+    else:
+        outs_np = model.predict_proba(model_input, batch_size)
+        preds, m_probs = get_preds_and_m_probs(outs_np)
+
+    logger.debug("preds.shape = %s, m_probs.shape = %s, freq_ids.shape = %s",
+                 preds.shape, m_probs.shape, freq_ids.shape)
 
     pred_table_abscent_data = pd.DataFrame(
         {
@@ -134,8 +284,73 @@ def get_pred_table_new_vals_df(model_input: np.ndarray,
         }
     )
 
+    if metrics is not None:
+        metrics.observe_stage('forward', time.perf_counter() - start,
+                              len(model_input))
     return pred_table_abscent_data
-                               
+
+
+def write_predictions(writer: CopyWriter,
+                      pred_table_abscent_data: pd.DataFrame,
+                      metrics: Optional[InferenceMetrics] = None) -> None:
+    """Writes predictions with `writer` and flushes it."""
+    start = time.perf_counter()
+    round_trips = writer.n_round_trips
+    writer.write(pred_table_abscent_data)
+    writer.flush()
+    if metrics is not None:
+        metrics.observe_stage('write', time.perf_counter() - start,
+                              len(pred_table_abscent_data),
+                              writer.n_round_trips - round_trips)
+
+
+def predict_backlog_in_chunks(db: gp.Database,
+                              model: Predictor,
+                              chunk_size: int,
+                              logger: Logger,
+                              copy_format: str = 'csv',
+                              batch_size: Optional[int] = None,
+                              cache: Optional[PredictionCache] = None,
+                              metrics: Optional[InferenceMetrics] = None,
+                              min_id: Optional[int] = None,
+                              max_id: Optional[int] = None
+                              ) -> int:
+    """
+    Predicts and writes rows without predictions chunk by chunk.
+    If given, only ids in (`min_id`, `max_id`] are predicted.
+
+    Peak memory depends on `chunk_size` only, not on the backlog size.
+
+    Returns:
+    --------
+    int: number of predicted rows
+    """
+    writer = CopyWriter(db, PREDICTIONS_TABLE, PREDICTIONS_COLUMNS,
+                        copy_format=copy_format,
+                        max_buffer_rows=chunk_size)
+    with writer:
+        for data_np, freq_ids_np in iter_feats_without_preds(
+                db, chunk_size, logger, min_id=min_id, max_id=max_id,
+                metrics=metrics):
+            pred_table_abscent_data = get_pred_table_new_vals_df(
+                data_np, freq_ids_np, model, logger, batch_size, cache,
+                metrics)
+            write_predictions(writer, pred_table_abscent_data, metrics)
+            logger.debug("Wrote %d predictions so far", writer.n_written)
+    return writer.n_written
+
+
+def log_table_head_to_debug(db: gp.Database,
+                            table_name: str,
+                            logger: Logger,
+                            n_rows: int = 5) -> None:
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    with db._conn.cursor() as curs:
+        curs.execute(f"SELECT * FROM {table_name} LIMIT {n_rows};")
+        head_df = pd.DataFrame(curs.fetchall())
+    logger.debug(f"reading data from table:\n{head_df}\netc.")
+
 
 if __name__ == "__main__":
     logger_getter = Logger(SHOW_LOG)
@@ -146,24 +361,55 @@ if __name__ == "__main__":
 
     args = parse_args()
 
+    metrics = InferenceMetrics()
+
     db = create_db_object(args, logger)
 
     log_table_columns_to_debug(db, PREDICTIONS_TABLE, logger)
-    
-    data_np, freq_ids_np = get_feats_without_preds(db, logger)
 
-    if len(data_np) == 0:
+    start = time.perf_counter()
+    model = load_predictor(config, MODEL_NAME, logger, args.engine,
+                           args.precision)
+    metrics.observe_model_load(time.perf_counter() - start)
+
+    batch_size = get_batch_size(args, config)
+    cache = create_prediction_cache(args, config, db)
+
+    start = time.perf_counter()
+    if args.chunk_size > 0:
+        n_predicted = predict_backlog_in_chunks(
+            db, model, args.chunk_size, logger, args.copy_format, batch_size,
+            cache, metrics)
+        logger.debug(f"Predicted {n_predicted} rows in chunks " \
+                     f"of {args.chunk_size}")
+    else:
+        data_np, freq_ids_np = get_feats_without_preds(db, logger,
+                                                       metrics=metrics)
+        n_predicted = len(data_np)
+
+        if n_predicted > 0:
+            pred_table_abscent_data = get_pred_table_new_vals_df(
+                data_np, freq_ids_np, model, logger, batch_size, cache,
+                metrics)
+
+            logger.debug("preparing to wite data:\n%s\netc.",
+                         Lazy(pred_table_abscent_data.head))
+
+            write_predictions(
+                CopyWriter(db, PREDICTIONS_TABLE, PREDICTIONS_COLUMNS,
+                           copy_format=args.copy_format),
+                pred_table_abscent_data, metrics)
+
+    metrics.observe_run(time.perf_counter() - start, n_predicted,
+                        backlog_rows=metrics.rows_fetched)
+    if args.metrics_file:
+        metrics.write_textfile(args.metrics_file)
+
+    if n_predicted == 0:
         logger.debug("No new data to predict")
         sys.exit(0)
-    
-    pred_table_abscent_data = get_pred_table_new_vals_df(data_np, freq_ids_np)
-    
-    logger.debug(f"preparing to wite data:\n{pred_table_abscent_data.head()}\netc.")
-
-    write_to_table(db, pred_table_abscent_data, PREDICTIONS_TABLE)
-
-    preds_gp = gp.DataFrame.from_table(PREDICTIONS_TABLE, db=db)
 
-    preds_gp_df = pd.DataFrame(preds_gp)
+    if cache is not None:
+        logger.info(f"Prediction cache: {cache.get_stats()}")
 
-    logger.debug(f"reading data from table:\n{preds_gp_df.head()}\netc.")
+    log_table_head_to_debug(db, PREDICTIONS_TABLE, logger)
@@ -0,0 +1,179 @@
+"""
+Metrics of the inference job in the Prometheus text exposition format.
+
+One-shot runs (inference.py --metrics-file) write them to a file for the
+node_exporter textfile collector; the long-running service
+(inference_service.py --metrics-port) serves them on GET /metrics.
+The format is rendered here, no client library is needed.
+
+Metrics (prefixed with `sonar_inference_`):
+    rows_fetched_total          rows without predictions read from the database
+    rows_predicted_total        predictions written
+    db_round_trips_total        queries, fetches and COPY statements of the
+                                fetch and write stages
+    stage_seconds{stage}        summary (_sum, _count) of fetch, forward and
+                                write calls
+    stage_rows_total{stage}     rows processed by the stage
+    backlog_rows                rows without predictions found by the last pass
+    model_load_seconds          time of the last model load
+    model_loads_total
+    runs_total                  inference passes
+    last_run_seconds, last_run_rows, last_run_rows_per_second
+    last_run_timestamp_seconds  unix time of the end of the last pass
+
+A one-shot run writes its file only on success, so a stale
+`last_run_timestamp_seconds` means failing or not running inference.
+"""
+
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+
+PREFIX = 'sonar_inference'
+STAGES = ('fetch', 'forward', 'write')
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class InferenceMetrics:
+    """
+    Counters and gauges of inference, safe to update and render from
+    different threads.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.rows_fetched = 0
+        self.rows_predicted = 0
+        self.db_round_trips = 0
+        self.stage_seconds: Dict[str, float] = {stage: 0.0 for stage in STAGES}
+        self.stage_calls: Dict[str, int] = {stage: 0 for stage in STAGES}
+        self.stage_rows: Dict[str, int] = {stage: 0 for stage in STAGES}
+        self.backlog_rows = 0
+        self.model_load_seconds = 0.0
+        self.model_loads = 0
+        self.runs = 0
+        self.last_run: Dict[str, float] = {
+            'seconds': 0.0, 'rows': 0, 'rows_per_second': 0.0,
+            'timestamp_seconds': 0.0}
+
+    def observe_stage(self, stage: str, seconds: float, n_rows: int = 0,
+                      round_trips: int = 0) -> None:
+        if stage not in STAGES:
+            raise ValueError(f"stage should be one of {STAGES}")
+        with self._lock:
+            self.stage_seconds[stage] += seconds
+            self.stage_calls[stage] += 1
+            self.stage_rows[stage] += n_rows
+            self.db_round_trips += round_trips
+            if stage == 'fetch':
+                self.rows_fetched += n_rows
+            elif stage == 'write':
+                self.rows_predicted += n_rows
+
+    def observe_model_load(self, seconds: float) -> None:
+        with self._lock:
+            self.model_load_seconds = seconds
+            self.model_loads += 1
+
+    def observe_run(self, seconds: float, n_rows: int,
+                    backlog_rows: int) -> None:
+        """Records a pass over `backlog_rows` rows that predicted `n_rows`."""
+        with self._lock:
+            self.runs += 1
+            self.backlog_rows = backlog_rows
+            self.last_run = {
+                'seconds': seconds,
+                'rows': n_rows,
+                'rows_per_second': n_rows / seconds if seconds > 0 else 0.0,
+                'timestamp_seconds': time.time()}
+
+    def render(self) -> str:
+        """Returns the metrics in the Prometheus text format."""
+        lines: List[str] = []
+
+        def add(name: str, metric_type: str, help_text: str, samples) -> None:
+            lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}_{name} {metric_type}")
+            for suffix, labels, value in samples:
+                labels_str = ",".join(f'{key}="{label}"'
+                                      for key, label in labels.items())
+                labels_str = f"{{{labels_str}}}" if labels_str else ""
+                lines.append(f"{PREFIX}_{name}{suffix}{labels_str} {value!r}")
+
+        with self._lock:
+            add('rows_fetched_total', 'counter',
+                "Rows without predictions read from the database.",
+                [('', {}, self.rows_fetched)])
+            add('rows_predicted_total', 'counter', "Predictions written.",
+                [('', {}, self.rows_predicted)])
+            add('db_round_trips_total', 'counter',
+                "Database round trips of the fetch and write stages.",
+                [('', {}, self.db_round_trips)])
+            add('stage_seconds', 'summary', "Time spent in inference stages.",
+                [(suffix, {'stage': stage}, value[stage])
+                 for stage in STAGES
+                 for suffix, value in [('_sum', self.stage_seconds),
+                                       ('_count', self.stage_calls)]])
+            add('stage_rows_total', 'counter', "Rows processed by stages.",
+                [('', {'stage': stage}, self.stage_rows[stage])
+                 for stage in STAGES])
+            add('backlog_rows', 'gauge',
+                "Rows without predictions found by the last pass.",
+                [('', {}, self.backlog_rows)])
+            add('model_load_seconds', 'gauge', "Time of the last model load.",
+                [('', {}, self.model_load_seconds)])
+            add('model_loads_total', 'counter', "Model loads.",
+                [('', {}, self.model_loads)])
+            add('runs_total', 'counter', "Inference passes.",
+                [('', {}, self.runs)])
+            for key, help_text in [
+                    ('seconds', "Duration of the last pass."),
+                    ('rows', "Rows predicted by the last pass."),
+                    ('rows_per_second', "Throughput of the last pass."),
+                    ('timestamp_seconds', "Unix time of the end of the last pass.")]:
+                add(f'last_run_{key}', 'gauge', help_text,
+                    [('', {}, self.last_run[key])])
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str) -> None:
+        """
+        Writes the metrics for the textfile collector. The file is
+        replaced atomically, so the collector never reads half of it.
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    # Set by `start_metrics_server`.
+    metrics: InferenceMetrics
+
+    def do_GET(self) -> None:
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = self.metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        # Scrapes are not worth a log line.
+        pass
+
+
+def start_metrics_server(metrics: InferenceMetrics, port: int,
+                         host: str = '0.0.0.0') -> ThreadingHTTPServer:
+    """Serves GET /metrics from a daemon thread."""
+    handler = type('Handler', (MetricsRequestHandler,), {'metrics': metrics})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True,
+                     name='metrics-server').start()
+    return server
@@ -0,0 +1,251 @@
+"""
+Pipelined inference over the backlog.
+
+Reading rows without predictions, running the model and writing
+predictions are done by three threads that work at the same time:
+
+    reader --(queue)--> predictor --(queue)--> writer
+
+Queues are bounded, so a slow stage makes the previous ones wait
+instead of piling up chunks in memory. Reader and writer use separate
+connections from a `DatabasePool`. psycopg2 I/O and torch / numpy kernels
+release the GIL, so the stages really overlap.
+"""
+
+import configparser
+import queue
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from inference import (get_args_parser, get_db_params, get_batch_size,
+                       create_db_object, create_prediction_cache,
+                       iter_feats_without_preds, get_pred_table_new_vals_df,
+                       CONFIG_NAME, MODEL_NAME, PREDICTIONS_TABLE,
+                       PREDICTIONS_COLUMNS)
+from db_utils import CopyWriter, DatabasePool
+from engines import Predictor, load_predictor
+from logger import Logger
+from prediction_cache import PredictionCache
+
+
+SHOW_LOG = True
+DEFAULT_CHUNK_SIZE = 10_000
+# Marks the end of a stream of chunks.
+END_OF_STREAM = None
+
+
+class StageStats:
+    """
+    Counts rows processed by a pipeline stage and the time the stage
+    was busy (as opposed to waiting on its queues).
+    """
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.n_chunks = 0
+        self.n_rows = 0
+        self.busy_seconds = 0.0
+
+    def add(self, n_rows: int, busy_seconds: float) -> None:
+        self.n_chunks += 1
+        self.n_rows += n_rows
+        self.busy_seconds += busy_seconds
+
+    def get_report(self, wall_seconds: float) -> Dict[str, float]:
+        return {
+            'stage': self.name,
+            'chunks': self.n_chunks,
+            'rows': self.n_rows,
+            'busy_seconds': self.busy_seconds,
+            # Rows per second of busy time: the throughput the stage
+            # could sustain on its own. The smallest one is the bottleneck.
+            'rows_per_busy_second': self.n_rows / max(self.busy_seconds, 1e-9),
+            'utilization': self.busy_seconds / max(wall_seconds, 1e-9),
+        }
+
+
+class InferencePipeline:
+    """
+    Arguments:
+    ----------
+    pool: DatabasePool
+        Pool with at least two connections (reader and writer).
+    model: Predictor
+    logger: Logger
+    chunk_size: int
+        Number of rows read, predicted and written at a time.
+    queue_size: int
+        Maximum number of chunks waiting between two stages.
+    copy_format: str
+        Format of COPY FROM STDIN used to write predictions.
+    batch_size: Optional[int]
+        Number of rows the model predicts at a time.
+    cache: Optional[PredictionCache]
+        Cache of predictions, used by the predicting thread only.
+    """
+    def __init__(self, pool: DatabasePool, model: Predictor,
+                 logger: Logger, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 queue_size: int = 4, copy_format: str = 'csv',
+                 batch_size: Optional[int] = None,
+                 cache: Optional[PredictionCache] = None) -> None:
+        self.pool = pool
+        self.model = model
+        self.logger = logger
+        self.chunk_size = chunk_size
+        self.copy_format = copy_format
+        self.batch_size = batch_size
+        self.cache = cache
+
+        self.feats_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.preds_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+
+        self.stats = {name: StageStats(name)
+                      for name in ['read', 'predict', 'write']}
+        self.failed = threading.Event()
+        self.errors: List[BaseException] = []
+
+    def _put(self, q: queue.Queue, item: Any) -> None:
+        # Waits for a free slot but gives up if another stage failed,
+        # otherwise a stage could block forever on a queue nobody reads.
+        while not self.failed.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _get(self, q: queue.Queue) -> Any:
+        while not self.failed.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return END_OF_STREAM
+
+    def read(self) -> None:
+        with self.pool.connection() as db:
+            chunks = iter_feats_without_preds(db, self.chunk_size, self.logger)
+            while not self.failed.is_set():
+                start = time.perf_counter()
+                chunk = next(chunks, END_OF_STREAM)
+                if chunk is END_OF_STREAM:
+                    break
+                self.stats['read'].add(len(chunk[0]),
+                                       time.perf_counter() - start)
+                self._put(self.feats_queue, chunk)
+            chunks.close()
+        self._put(self.feats_queue, END_OF_STREAM)
+
+    def predict(self) -> None:
+        while True:
+            chunk = self._get(self.feats_queue)
+            if chunk is END_OF_STREAM:
+                break
+            start = time.perf_counter()
+            data_np, freq_ids_np = chunk
+            pred_table_abscent_data = get_pred_table_new_vals_df(
+                data_np, freq_ids_np, self.model, self.logger, self.batch_size,
+                self.cache)
+            self.stats['predict'].add(len(data_np),
+                                      time.perf_counter() - start)
+            self._put(self.preds_queue, pred_table_abscent_data)
+        self._put(self.preds_queue, END_OF_STREAM)
+
+    def write(self) -> None:
+        with self.pool.connection() as db:
+            writer = CopyWriter(db, PREDICTIONS_TABLE, PREDICTIONS_COLUMNS,
+                                copy_format=self.copy_format,
+                                max_buffer_rows=self.chunk_size)
+            while True:
+                pred_table_abscent_data = self._get(self.preds_queue)
+                if pred_table_abscent_data is END_OF_STREAM:
+                    break
+                start = time.perf_counter()
+                writer.write(pred_table_abscent_data)
+                self.stats['write'].add(len(pred_table_abscent_data),
+                                        time.perf_counter() - start)
+            if not self.failed.is_set():
+                start = time.perf_counter()
+                writer.close()
+                self.stats['write'].busy_seconds += time.perf_counter() - start
+
+    def _run_stage(self, stage: Callable[[], None]) -> None:
+        try:
+            stage()
+        except BaseException as e:
+            self.logger.exception(f"Stage {stage.__name__} failed")
+            self.errors.append(e)
+            self.failed.set()
+
+    def run(self) -> List[Dict[str, float]]:
+        """
+        Predicts the whole backlog.
+        Returns per-stage throughput report.
+        """
+        start = time.perf_counter()
+        threads = [
+            threading.Thread(target=self._run_stage, args=(stage,),
+                             name=f"inference-{stage.__name__}")
+            for stage in [self.read, self.predict, self.write]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_seconds = time.perf_counter() - start
+
+        if self.errors:
+            raise self.errors[0]
+
+        report = [stats.get_report(wall_seconds)
+                  for stats in self.stats.values()]
+        for stage_report in report:
+            self.logger.info(
+                f"{stage_report['stage']:>7}: {stage_report['rows']} rows " \
+                f"in {stage_report['chunks']} chunks, " \
+                f"{stage_report['rows_per_busy_second']:.0f} rows/s busy, " \
+                f"utilization {stage_report['utilization']:.0%}")
+        n_rows = self.stats['write'].n_rows
+        self.logger.info(f"Pipeline: {n_rows} rows in {wall_seconds:.3f} s, " \
+                         f"{n_rows / max(wall_seconds, 1e-9):.0f} rows/s")
+        return report
+
+
+if __name__ == "__main__":
+    logger_getter = Logger(SHOW_LOG)
+    logger = logger_getter.get_logger(__name__)
+
+    config = configparser.ConfigParser()
+    config.read(CONFIG_NAME)
+
+    parser = get_args_parser()
+    parser.add_argument("--queue-size", type=int, default=4,
+                        help="Maximum number of chunks between two stages.")
+    args = parser.parse_args()
+
+    model = load_predictor(config, MODEL_NAME, logger, args.engine,
+                           args.precision)
+
+    try:
+        pool = DatabasePool(get_db_params(args), size=2)
+    except Exception:
+        logger.exception("Failed to create database connection pool")
+        sys.exit(1)
+
+    pipeline = InferencePipeline(
+        pool, model, logger,
+        chunk_size=args.chunk_size or DEFAULT_CHUNK_SIZE,
+        queue_size=args.queue_size,
+        copy_format=args.copy_format,
+        batch_size=get_batch_size(args, config),
+        # The cache table gets its own connection: reader and writer
+        # connections are busy with their streams.
+        cache=create_prediction_cache(
+            args, config,
+            create_db_object(args, logger) if args.cache_table else None))
+    try:
+        pipeline.run()
+    finally:
+        pool.close()
+    if pipeline.cache is not None:
+        logger.info(f"Prediction cache: {pipeline.cache.get_stats()}")
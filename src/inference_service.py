@@ -0,0 +1,295 @@
+"""
+Long-running inference service.
+
+Keeps the model and the database connection warm and predicts rows of
+`frequencies` as soon as they arrive. The service LISTENs on the channel
+notified by the insert trigger on `frequencies` (see init.sql). Every
+`--poll-interval` seconds, with or without notifications, the whole
+backlog is swept, so rows are predicted even if a notification was
+missed or they were committed after rows with higher ids.
+With `--metrics-port` metrics of the service (see inference_metrics.py)
+are served on GET /metrics.
+"""
+
+import configparser
+import select
+import signal
+import threading
+import time
+from typing import Optional
+
+import greenplumpython as gp
+import psycopg2
+
+from inference import (get_args_parser, connect_db, get_batch_size,
+                       create_prediction_cache, predict_backlog_in_chunks,
+                       CONFIG_NAME, MODEL_NAME, DATA_TABLE)
+from engines import Predictor, get_model_version, load_predictor
+from inference_metrics import InferenceMetrics, start_metrics_server
+from logger import Lazy, Logger
+from prediction_cache import PredictionCache
+
+
+SHOW_LOG = True
+NOTIFY_CHANNEL = 'new_frequencies'
+# Errors of a lost or unreachable database, after which the service
+# reconnects.
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class InferenceService:
+    """
+    Predicts new rows of `DATA_TABLE` on NOTIFY, falling back to polling.
+
+    Rows with ids above `watermark` are predicted on every notification.
+    Rows that were committed out of id order are picked up by the full
+    sweep of the backlog done every `poll_interval` seconds, also under
+    a steady stream of notifications.
+
+    With the torch engine the model is taken from `model.load_model`
+    before every pass. Model artifacts are cached by the model registry,
+    so this costs a file stat and a retrained model is picked up without
+    a restart.
+
+    Arguments:
+    ----------
+    db: gp.Database
+    config: configparser.ConfigParser
+    logger: Logger
+    poll_interval: float
+        Seconds between sweeps of the backlog.
+    chunk_size: int
+        Number of rows read, predicted and written at a time.
+    copy_format: str
+        Format of COPY FROM STDIN used to write predictions.
+    engine: str
+        Inference engine, one of engines.ENGINES.
+    precision: str
+        Inference precision, one of engines.PRECISIONS.
+    batch_size: Optional[int]
+        Number of rows the model predicts at a time.
+    cache: Optional[PredictionCache]
+        Cache of predictions. It is switched to the new model version
+        when the model changes.
+    metrics: Optional[InferenceMetrics]
+        Metrics updated by every pass.
+    """
+    def __init__(self, db: gp.Database, config: configparser.ConfigParser,
+                 logger: Logger, poll_interval: float = 60.0,
+                 chunk_size: int = 10_000, copy_format: str = 'csv',
+                 engine: str = 'torch', precision: str = 'fp32',
+                 batch_size: Optional[int] = None,
+                 cache: Optional[PredictionCache] = None,
+                 metrics: Optional[InferenceMetrics] = None) -> None:
+        self.db = db
+        self.config = config
+        self.engine = engine
+        self.precision = precision
+        self.batch_size = batch_size
+        self.cache = cache
+        self.metrics = metrics
+        self.model: Optional[Predictor] = None
+        self.logger = logger
+        self.poll_interval = poll_interval
+        self.chunk_size = chunk_size
+        self.copy_format = copy_format
+        self.watermark = 0
+        self.last_sweep = time.monotonic()
+        self.stopped = False
+
+    def listen(self) -> None:
+        with self.db._conn.cursor() as curs:
+            curs.execute(f"LISTEN {NOTIFY_CHANNEL};")
+        self.logger.debug(f"Listening on {NOTIFY_CHANNEL}")
+
+    def wait_for_notification(self, timeout: float) -> bool:
+        """
+        Returns True if a notification arrived within `timeout` seconds.
+
+        All pending notifications are consumed: one pass over new rows
+        serves any number of inserts.
+        """
+        conn = self.db._conn
+        deadline = time.monotonic() + timeout
+        while not conn.notifies and not self.stopped:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            # Wake up at least once a second to notice `stop`.
+            ready, _, _ = select.select([conn], [], [], min(remaining, 1.0))
+            if ready:
+                conn.poll()
+        notified = len(conn.notifies) > 0
+        conn.notifies.clear()
+        return notified
+
+    def get_max_data_id(self) -> int:
+        with self.db._conn.cursor() as curs:
+            curs.execute(f"SELECT coalesce(max(id), 0) AS max_id FROM {DATA_TABLE};")
+            return curs.fetchone()['max_id']
+
+    def sweep(self) -> int:
+        """Predicts the whole backlog. Returns number of predicted rows."""
+        max_id = self.get_max_data_id()
+        n_predicted = predict_backlog_in_chunks(
+            self.db, self.model, self.chunk_size, self.logger, self.copy_format,
+            self.batch_size, self.cache, self.metrics)
+        self.watermark = max(self.watermark, max_id)
+        self.last_sweep = time.monotonic()
+        return n_predicted
+
+    def predict_new_rows(self) -> int:
+        """
+        Predicts rows with ids above the watermark chunk by chunk, so a
+        burst of inserts isn't loaded at once.
+        Returns number of predicted rows.
+        """
+        max_id = self.get_max_data_id()
+        if max_id <= self.watermark:
+            return 0
+        n_predicted = predict_backlog_in_chunks(
+            self.db, self.model, self.chunk_size, self.logger, self.copy_format,
+            self.batch_size, self.cache, self.metrics,
+            min_id=self.watermark, max_id=max_id)
+        self.watermark = max_id
+        return n_predicted
+
+    def refresh_model(self) -> None:
+        if self.model is not None and (
+                self.engine != 'torch'
+                or "model_path" not in self.config[MODEL_NAME]):
+            # Only registry artifacts are cached, don't reload others
+            # every time.
+            return
+        start = time.perf_counter()
+        model = load_predictor(self.config, MODEL_NAME, self.logger,
+                               self.engine, self.precision)
+        if self.metrics is not None and model is not self.model:
+            self.metrics.observe_model_load(time.perf_counter() - start)
+        if self.model is not None and model is not self.model:
+            self.logger.info("Model artifact changed, using the new model")
+        if self.cache is not None and model is not self.model:
+            self.cache.set_model_version(get_model_version(
+                self.config, MODEL_NAME, self.engine, self.precision))
+        self.model = model
+
+    def observe_pass(self, seconds: float, n_predicted: int) -> None:
+        if self.metrics is not None:
+            # Every fetched row is predicted: the pass found a backlog
+            # of `n_predicted` rows.
+            self.metrics.observe_run(seconds, n_predicted,
+                                     backlog_rows=n_predicted)
+
+    def stop(self, *_) -> None:
+        self.logger.info("Stopping inference service")
+        self.stopped = True
+
+    def run(self) -> None:
+        self.listen()
+        self.refresh_model()
+        start = time.perf_counter()
+        n_predicted = self.sweep()
+        self.observe_pass(time.perf_counter() - start, n_predicted)
+        self.logger.info(f"Predicted {n_predicted} backlog rows on startup")
+        while not self.stopped:
+            next_sweep = self.last_sweep + self.poll_interval
+            notified = self.wait_for_notification(
+                max(next_sweep - time.monotonic(), 0.0))
+            start = time.perf_counter()
+            self.refresh_model()
+            if time.monotonic() >= next_sweep:
+                n_predicted = self.sweep()
+                reason = "poll"
+            elif notified:
+                n_predicted = self.predict_new_rows()
+                reason = "notification"
+            else:
+                # Stopped while waiting.
+                continue
+            self.observe_pass(time.perf_counter() - start, n_predicted)
+            if n_predicted:
+                self.logger.info(
+                    f"Predicted {n_predicted} rows on {reason} in " \
+                    f"{time.perf_counter() - start:.3f} s")
+                if self.cache is not None:
+                    self.logger.debug("Prediction cache: %s",
+                                      Lazy(self.cache.get_stats))
+
+
+def run_with_reconnects(args, config: configparser.ConfigParser,
+                        logger: Logger,
+                        reconnect_delay: float = 1.0,
+                        max_reconnect_delay: float = 60.0) -> None:
+    """
+    Runs the service, reconnecting when the database is lost or
+    unreachable. The delay between attempts doubles from
+    `reconnect_delay` up to `max_reconnect_delay` and is reset once the
+    service is connected.
+    """
+    service: Optional[InferenceService] = None
+    stopped = threading.Event()
+    # Survives reconnects, so counters don't reset.
+    metrics = InferenceMetrics()
+    if args.metrics_port:
+        start_metrics_server(metrics, args.metrics_port)
+        logger.info(f"Serving metrics on port {args.metrics_port}")
+
+    def stop(*_):
+        stopped.set()
+        if service is not None:
+            service.stop()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    delay = reconnect_delay
+    while not stopped.is_set():
+        db = None
+        try:
+            db = connect_db(args)
+            logger.debug("Connected to the database")
+            delay = reconnect_delay
+            service = InferenceService(
+                db, config, logger, poll_interval=args.poll_interval,
+                chunk_size=args.chunk_size or 10_000,
+                copy_format=args.copy_format,
+                engine=args.engine,
+                precision=args.precision,
+                batch_size=get_batch_size(args, config),
+                cache=create_prediction_cache(args, config, db),
+                metrics=metrics)
+            if stopped.is_set():
+                break
+            service.run()
+        except CONNECTION_ERRORS:
+            logger.exception("Lost database connection. " \
+                             f"Reconnecting in {delay:.0f} s")
+            stopped.wait(delay)
+            delay = min(delay * 2, max_reconnect_delay)
+        finally:
+            if db is not None:
+                try:
+                    db.close()
+                except CONNECTION_ERRORS:
+                    pass
+
+
+if __name__ == "__main__":
+    logger_getter = Logger(SHOW_LOG)
+    logger = logger_getter.get_logger(__name__)
+
+    config = configparser.ConfigParser()
+    config.read(CONFIG_NAME)
+
+    parser = get_args_parser()
+    parser.add_argument(
+        "--poll-interval", type=float, default=60.0,
+        help="Seconds between sweeps of the whole backlog, done " \
+            "whether or not notifications arrive.")
+    parser.add_argument(
+        "--metrics-port", type=int, default=0,
+        help="If positive, metrics are served on " \
+            "http://0.0.0.0:PORT/metrics in the Prometheus text format.")
+    args = parser.parse_args()
+
+    run_with_reconnects(args, config, logger)
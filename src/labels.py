@@ -0,0 +1,19 @@
+# Class labels of the sonar dataset. Kept apart from dataset.py
+# so that code without torch (e.g. the numpy inference engine) can use them.
+from typing import Tuple
+
+import numpy as np
+
+
+I2LABEL = ['R', 'M']
+LABEL2I = {label: i for i, label in enumerate(I2LABEL)}
+
+
+def get_preds_and_m_probs(outs_np: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Converts model outputs into labels ('M' or 'R') and probabilities
+    of 'M', i.e. `prediction` and `m_probability` columns of predictions.
+    """
+    m_probs = outs_np[:, LABEL2I['M']]
+    preds = np.array(I2LABEL)[outs_np.argmax(axis=1)]
+    return preds, m_probs
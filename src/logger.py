@@ -1,21 +1,96 @@
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
 import sys
+import threading
+from typing import Any, Callable, Dict, Tuple
 
 FORMATTER = logging.Formatter(
     "%(asctime)s — %(name)s — %(levelname)s — %(message)s")
 LOG_FILE = os.path.join(os.getcwd(), "logfile.log")
+# Default level of loggers, e.g. LOG_LEVEL=INFO skips DEBUG records
+# (and their lazy payloads) on hot paths.
+LOG_LEVEL_NAMES = ['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG']
+
+
+def get_env_log_level(default: str = 'DEBUG') -> int:
+    """
+    Returns the level named by the LOG_LEVEL environment variable (case
+    insensitive). An unknown name falls back to `default` with a warning
+    instead of failing when the first logger is created.
+    """
+    name = os.environ.get('LOG_LEVEL', default).strip().upper()
+    if name not in LOG_LEVEL_NAMES:
+        sys.stderr.write(f"Unknown LOG_LEVEL '{name}', expected one of " \
+                         f"{LOG_LEVEL_NAMES}. Using {default}\n")
+        name = default
+    return getattr(logging, name)
+
+
+LOG_LEVEL = get_env_log_level()
+
+_lock = threading.Lock()
+# Handlers are shared by all loggers of the process: a log file is opened
+# (and truncated) once, not on every `get_logger` call.
+_file_handlers: Dict[str, logging.FileHandler] = {}
+_console_handler = None
+# (log file, show) -> queue and listener writing its records.
+_listeners: Dict[Tuple[str, bool],
+                 Tuple[queue.Queue, logging.handlers.QueueListener]] = {}
+
+
+class Lazy:
+    """
+    Log message argument evaluated only if the record is emitted:
+    logger.debug("head:\\n%s", Lazy(df.head)) doesn't call df.head()
+    when DEBUG is disabled.
+    """
+    def __init__(self, func: Callable[..., Any], *args, **kwargs) -> None:
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self) -> str:
+        return str(self.func(*self.args, **self.kwargs))
+
+
+def flush_logs() -> None:
+    """Blocks until queued records are written by their handlers."""
+    with _lock:
+        listeners = list(_listeners.values())
+    for log_queue, listener in listeners:
+        log_queue.join()
+        for handler in listener.handlers:
+            handler.flush()
+
+
+@atexit.register
+def _stop_listeners() -> None:
+    with _lock:
+        listeners = list(_listeners.values())
+        _listeners.clear()
+    for _, listener in listeners:
+        listener.stop()
 
 
 class Logger:
     """
     Class for logging behaviour of data exporting - ExportingTool class object
+
+    Loggers only put records into a queue, writing them to the file and
+    the console is done by a background thread
+    (logging.handlers.QueueListener). Messages are still formatted by
+    the calling thread (QueueHandler.prepare), so expensive arguments
+    should be wrapped in `Lazy`. Records are written at exit or by
+    `flush_logs`.
     """
 
     def __init__(self,
                  show: bool,
                  filename: str = LOG_FILE,
-                 level: int = logging.DEBUG) -> None:
+                 level: int = LOG_LEVEL) -> None:
         """
         Arguments:
         ----------
@@ -36,25 +111,47 @@ class Logger:
         logging.StreamHandler:
             Handler object for streaming output through terminal
         """
-        console_handler = logging.StreamHandler(sys.stdout)
-        console_handler.setFormatter(FORMATTER)
-        return console_handler
+        global _console_handler
+        if _console_handler is None:
+            _console_handler = logging.StreamHandler(sys.stdout)
+            _console_handler.setFormatter(FORMATTER)
+        return _console_handler
 
     def get_file_handler(self) -> logging.FileHandler:
         """
-        Gets a file handler to write logs in file LOG_FILE
+        Gets a file handler to write logs in file LOG_FILE.
+        The file is truncated when it is opened first in the process.
 
         Returns:
             logging.FileHandler: handler object for streaming output
                 through std::filestream
         """
-        file_handler = logging.FileHandler(self.filename, mode='w')
-        file_handler.setFormatter(FORMATTER)
-        return file_handler
+        path = os.path.abspath(self.filename)
+        if path not in _file_handlers:
+            file_handler = logging.FileHandler(path, mode='w')
+            file_handler.setFormatter(FORMATTER)
+            _file_handlers[path] = file_handler
+        return _file_handlers[path]
+
+    def get_queue(self) -> queue.Queue:
+        """Returns the queue of the listener writing to this Logger's handlers."""
+        key = (os.path.abspath(self.filename), self.show)
+        with _lock:
+            if key not in _listeners:
+                handlers = [self.get_file_handler()]
+                if self.show:
+                    handlers.insert(0, self.get_console_handler())
+                log_queue = queue.Queue()
+                listener = logging.handlers.QueueListener(log_queue, *handlers)
+                listener.start()
+                _listeners[key] = (log_queue, listener)
+            return _listeners[key][0]
 
     def get_logger(self, logger_name: str) -> logging.Logger:
         """
-        Class method which creates logger with certain name
+        Class method which creates logger with certain name.
+        Calling it again for the same name doesn't add handlers: the
+        logger is switched to this Logger's handlers and level.
 
         Args:
         -----
@@ -68,8 +165,12 @@ class Logger:
         """
         logger = logging.getLogger(logger_name)
         logger.setLevel(self.level)
-        if self.show:
-            logger.addHandler(self.get_console_handler())
-        logger.addHandler(self.get_file_handler())
+        log_queue = self.get_queue()
+        for handler in list(logger.handlers):
+            if isinstance(handler, logging.handlers.QueueHandler):
+                if handler.queue is log_queue:
+                    return logger
+                logger.removeHandler(handler)
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
         logger.propagate = False
-        return logger
\ No newline at end of file
+        return logger
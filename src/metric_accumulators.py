@@ -0,0 +1,118 @@
+"""
+Streaming accumulators of the loss and the confusion matrix that stay on
+the training device.
+
+Trainer used to copy every batch's loss, labels and outputs to the host
+and compute sklearn metrics over Python lists at the end of the epoch.
+The accumulators only add to device tensors per batch (no host sync),
+and `compute` copies the totals to the host once per epoch. The values
+are the same as Trainer computed before:
+- loss: mean of batch losses, summed as Python floats in the same order
+- accuracy and macro F1: from the confusion matrix with the formulas of
+  sklearn `accuracy_score` and `f1_score(average='macro')`, which
+  averages over classes present in the labels or the predictions.
+"""
+
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+
+
+def get_confusion_metrics(confusion: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Returns accuracy and macro F1 of confusion matrices
+    [..., true class, predicted class]. Leading dimensions (e.g. ensemble
+    members) are kept.
+    """
+    confusion = np.asarray(confusion, dtype=np.float64)
+    tp = np.diagonal(confusion, axis1=-2, axis2=-1)
+    n_true = confusion.sum(axis=-1)
+    n_pred = confusion.sum(axis=-2)
+    total = confusion.sum(axis=(-2, -1))
+    present = (n_true + n_pred) > 0
+    f1 = np.divide(2 * tp, n_true + n_pred,
+                   out=np.zeros_like(tp), where=present)
+    return {
+        'accuracy': tp.sum(axis=-1) / np.maximum(total, 1),
+        'f1_score': f1.sum(axis=-1) / np.maximum(present.sum(axis=-1), 1),
+    }
+
+
+class LossAccumulator:
+    """
+    Mean of batch losses.
+
+    Batch losses are kept as device tensors, a few bytes per batch, and
+    copied to the host at once by `compute`.
+    """
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.losses: List[torch.Tensor] = []
+
+    def update(self, loss: torch.Tensor) -> None:
+        self.losses.append(loss.detach())
+
+    def compute(self) -> float:
+        if not self.losses:
+            return 0.0
+        # Summed as Python floats in the order of batches, the same as
+        # `running_loss += loss.item()`.
+        return sum(torch.stack(self.losses).tolist()) / len(self.losses)
+
+
+class ConfusionMatrixAccumulator:
+    """
+    Confusion matrix [true class, predicted class] of argmax predictions.
+
+    Cells of a batch (true class * n_classes + predicted class) are
+    buffered and added to the matrix with one `bincount` every
+    `flush_every` batches, which is cheaper than a bincount per batch.
+
+    Arguments:
+    ----------
+    device: torch.device
+    n_classes: Optional[int]
+        Taken from the last dimension of the first outputs if None.
+    flush_every: int
+    """
+    def __init__(self, device: torch.device,
+                 n_classes: Optional[int] = None,
+                 flush_every: int = 64) -> None:
+        self.device = device
+        self.n_classes = n_classes
+        self.flush_every = flush_every
+        self.reset()
+
+    def reset(self) -> None:
+        self.confusion = None
+        if self.n_classes is not None:
+            self.confusion = torch.zeros(self.n_classes * self.n_classes,
+                                         dtype=torch.long, device=self.device)
+        self._cells: List[torch.Tensor] = []
+
+    def _flush(self) -> None:
+        if self._cells:
+            self.confusion += torch.bincount(
+                torch.cat(self._cells),
+                minlength=self.n_classes * self.n_classes)
+            self._cells = []
+
+    def update(self, outputs: torch.Tensor, labels: torch.Tensor) -> None:
+        if self.confusion is None:
+            self.n_classes = outputs.shape[-1]
+            self.reset()
+        preds = outputs.detach().argmax(dim=-1).flatten()
+        self._cells.append(labels.flatten() * self.n_classes + preds)
+        if len(self._cells) >= self.flush_every:
+            self._flush()
+
+    def compute(self) -> Dict[str, float]:
+        if self.confusion is None:
+            raise ValueError("No batches were accumulated")
+        self._flush()
+        confusion = self.confusion.view(self.n_classes, self.n_classes)
+        return {name: float(value) for name, value in
+                get_confusion_metrics(confusion.cpu().numpy()).items()}
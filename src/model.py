@@ -1,5 +1,8 @@
+import os
 import sys
+from typing import List, Optional
 
+import numpy as np
 import torch
 
 
@@ -20,8 +23,107 @@ class MlpSonarModel(torch.nn.Module):
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         return self.model(x)
 
+    def predict_proba(self, X: np.ndarray,
+                      batch_size: Optional[int] = None) -> np.ndarray:
+        """
+        Returns model outputs for a numpy array of features,
+        computed `batch_size` rows at a time (all at once if None).
+        Same interface as numpy_model.NumpyMlpSonarModel.
+        """
+        X = torch.as_tensor(X, dtype=torch.float32)
+        with torch.no_grad():
+            if batch_size is None or len(X) <= batch_size:
+                return self(X).numpy(force=True)
+            return torch.cat([self(batch) for batch in X.split(batch_size)]
+                             ).numpy(force=True)
+
+
+class MlpSonarEnsemble(torch.nn.Module):
+    """
+    `n_members` MlpSonarModels with stacked weights, computed at once
+    with batched matmuls. `forward_members` returns outputs of every
+    member, `forward` (and `predict_proba`) their average, so a saved
+    ensemble is used by inference like a single model.
+
+    Arguments:
+    ----------
+    n_members: int
+    input_size, hidden_size, output_size: int
+        Same as MlpSonarModel, shared by all members.
+    """
+    def __init__(self,
+                 n_members: int = 5,
+                 input_size: int = 60,
+                 hidden_size: int = 40,
+                 output_size: int = 2) -> None:
+        super().__init__()
+        # Weights are stored transposed (in, out): x @ w + b.
+        self.w1 = torch.nn.Parameter(torch.empty(n_members, input_size, hidden_size))
+        self.b1 = torch.nn.Parameter(torch.empty(n_members, 1, hidden_size))
+        self.w2 = torch.nn.Parameter(torch.empty(n_members, hidden_size, output_size))
+        self.b2 = torch.nn.Parameter(torch.empty(n_members, 1, output_size))
+        members = [MlpSonarModel(input_size, hidden_size, output_size)
+                   for _ in range(n_members)]
+        self.load_members(members)
+
+    @property
+    def n_members(self) -> int:
+        return self.w1.shape[0]
+
+    def load_members(self, members: List[MlpSonarModel]) -> None:
+        """Copies weights of the models into the stacked parameters."""
+        with torch.no_grad():
+            for i, member in enumerate(members):
+                linear_1, linear_2 = member.model[0], member.model[2]
+                self.w1[i].copy_(linear_1.weight.T)
+                self.b1[i, 0].copy_(linear_1.bias)
+                self.w2[i].copy_(linear_2.weight.T)
+                self.b2[i, 0].copy_(linear_2.bias)
+
+    def get_member(self, i: int) -> MlpSonarModel:
+        """Returns a copy of the i-th member as an MlpSonarModel."""
+        member = MlpSonarModel(*self.w1.shape[1:], self.w2.shape[2])
+        with torch.no_grad():
+            member.model[0].weight.copy_(self.w1[i].T)
+            member.model[0].bias.copy_(self.b1[i, 0])
+            member.model[2].weight.copy_(self.w2[i].T)
+            member.model[2].bias.copy_(self.b2[i, 0])
+        return member
+
+    def forward_members(self, x: torch.Tensor) -> torch.Tensor:
+        """(batch, input_size) -> (n_members, batch, output_size)"""
+        x = x.expand(self.n_members, *x.shape)
+        hidden = torch.relu(torch.baddbmm(self.b1, x, self.w1))
+        return torch.sigmoid(torch.baddbmm(self.b2, hidden, self.w2))
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.forward_members(x).mean(dim=0)
+
+    predict_proba = MlpSonarModel.predict_proba
+
 
 def load_model(config, model_name, logger) -> torch.nn.Module:
+    """
+    Loads the model described by `config[model_name]`.
+
+    `model_path` (an artifact of model_registry.save_artifact) is preferred:
+    it is cached in process and reloaded when the file changes. Otherwise
+    the legacy pickled dict at `model_optimizer_loss_dict_path` is loaded.
+    """
+    # model_registry imports this module, so it is imported here.
+    from model_registry import REGISTRY
+
+    model_path = config[model_name].get("model_path")
+    if model_path is not None and os.path.exists(model_path):
+        try:
+            return REGISTRY.get(model_path)
+        except Exception:
+            logger.exception(f"Failed to load model artifact {model_path}")
+            sys.exit(1)
+    if model_path is not None:
+        logger.warning(f"File {model_path} is missing, " \
+                       "falling back to model_optimizer_loss_dict_path")
+
     mol_path = config[model_name]["model_optimizer_loss_dict_path"]
     try:
         mol = torch.load(mol_path)
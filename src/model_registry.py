@@ -0,0 +1,146 @@
+"""
+Model artifacts and an in-process cache of loaded models.
+
+An artifact is a `torch.save`d dict of plain data: the model class name,
+its constructor config and its `state_dict`. It is loaded with
+`weights_only=True` (no arbitrary unpickling) and `mmap=True`, so the
+weights are mapped from the file instead of being read and copied.
+
+`ModelRegistry` caches loaded models by (path, content hash). Every
+`get` stats the file, and if it has changed the new version is loaded,
+so long-running processes pick up retrained models without a restart.
+"""
+
+import hashlib
+import os
+import threading
+from typing import Any, Dict, Tuple
+
+import torch
+
+from model import MlpSonarEnsemble, MlpSonarModel
+
+
+ARTIFACT_FORMAT_VERSION = 1
+MODEL_CLASSES = {
+    'MlpSonarModel': MlpSonarModel,
+    'MlpSonarEnsemble': MlpSonarEnsemble,
+}
+
+
+def get_file_hash(path: str) -> str:
+    """Returns sha256 of the file content."""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def save_artifact(model: torch.nn.Module,
+                  model_config: Dict[str, Any],
+                  path: str) -> str:
+    """
+    Saves model `state_dict` and the config needed to rebuild the model.
+
+    The file is written next to `path` and atomically renamed, so readers
+    never see a partially written artifact.
+
+    Arguments:
+    ----------
+    model: torch.nn.Module
+        Model of one of MODEL_CLASSES.
+    model_config: Dict[str, Any]
+        Keyword arguments of the model constructor.
+    path: str
+
+    Returns:
+    --------
+    str: sha256 of the saved artifact
+    """
+    model_class = type(model).__name__
+    if model_class not in MODEL_CLASSES:
+        raise ValueError(f"Unknown model class {model_class}")
+    state_dict = {name: tensor.detach().cpu()
+                  for name, tensor in model.state_dict().items()}
+    tmp_path = f"{path}.tmp"
+    torch.save({
+        'format_version': ARTIFACT_FORMAT_VERSION,
+        'model_class': model_class,
+        'config': dict(model_config),
+        'state_dict': state_dict,
+    }, tmp_path)
+    os.replace(tmp_path, path)
+    return get_file_hash(path)
+
+
+def load_artifact(path: str) -> torch.nn.Module:
+    """Builds a model in eval mode from an artifact saved by `save_artifact`."""
+    artifact = torch.load(path, map_location='cpu',
+                          weights_only=True, mmap=True)
+    if artifact.get('format_version') != ARTIFACT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifact format of {path}")
+    model = MODEL_CLASSES[artifact['model_class']](**artifact['config'])
+    # assign=True keeps the memory-mapped tensors instead of copying them
+    # into freshly allocated parameters.
+    model.load_state_dict(artifact['state_dict'], assign=True)
+    model.eval()
+    return model
+
+
+class ModelRegistry:
+    """
+    Thread-safe in-process cache of models loaded from artifacts.
+
+    Models are keyed by (absolute path, content hash). The hash is only
+    recomputed when the file's mtime or size changes, so a cache hit
+    costs one `os.stat`. Only the latest version of each path is kept.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # abs path -> ((mtime_ns, size), content hash)
+        self._file_versions: Dict[str, Tuple[Tuple[int, int], str]] = {}
+        # (abs path, content hash) -> model
+        self._models: Dict[Tuple[str, str], torch.nn.Module] = {}
+
+    def _get_version(self, path: str) -> str:
+        stat = os.stat(path)
+        file_stat = (stat.st_mtime_ns, stat.st_size)
+        known = self._file_versions.get(path)
+        if known is not None and known[0] == file_stat:
+            return known[1]
+        content_hash = get_file_hash(path)
+        self._file_versions[path] = (file_stat, content_hash)
+        return content_hash
+
+    def get_version(self, path: str) -> str:
+        """Returns content hash of the artifact at `path`."""
+        path = os.path.abspath(path)
+        with self._lock:
+            return self._get_version(path)
+
+    def get(self, path: str) -> torch.nn.Module:
+        """
+        Returns the model saved at `path`, loading it only if the
+        artifact is new or has changed since the previous call.
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            key = (path, self._get_version(path))
+            model = self._models.get(key)
+            if model is None:
+                model = load_artifact(path)
+                self._models = {cached_key: cached_model
+                                for cached_key, cached_model in self._models.items()
+                                if cached_key[0] != path}
+                self._models[key] = model
+            return model
+
+    def clear(self) -> None:
+        with self._lock:
+            self._file_versions.clear()
+            self._models.clear()
+
+
+# Shared by all users of `model.load_model` in the process.
+REGISTRY = ModelRegistry()
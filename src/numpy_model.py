@@ -0,0 +1,120 @@
+"""
+Pure NumPy inference engine for MlpSonarModel.
+
+MlpSonarModel is Linear -> ReLU -> Linear -> Sigmoid, so its forward pass
+is two matrix products. Weights are exported once to a compact `.npz`
+file and `NumpyMlpSonarModel` reproduces `MlpSonarModel.forward` without
+importing torch, which saves its import time and memory in inference.
+
+Usage (export weights of the model from config.ini):
+    python src/numpy_model.py
+"""
+
+import configparser
+import os
+import sys
+from typing import Dict, Optional
+
+import numpy as np
+
+
+CONFIG_NAME = 'config.ini'
+MODEL_NAME = 'mlp'
+# Keys of MlpSonarModel.state_dict() in forward order.
+STATE_DICT_KEYS = {
+    'w1': 'model.0.weight',
+    'b1': 'model.0.bias',
+    'w2': 'model.2.weight',
+    'b2': 'model.2.bias',
+}
+
+
+def export_npz(model, path: str) -> None:
+    """
+    Saves weights of an MlpSonarModel to a compressed `.npz` file.
+
+    Arguments:
+    ----------
+    model: MlpSonarModel
+    path: str
+    """
+    state_dict = model.state_dict()
+    weights = {key: state_dict[sd_key].detach().cpu().numpy().astype(np.float32)
+               for key, sd_key in STATE_DICT_KEYS.items()}
+    np.savez_compressed(path, **weights)
+
+
+class NumpyMlpSonarModel:
+    """
+    NumPy implementation of MlpSonarModel inference.
+
+    Computations are done in float32 like in torch, so outputs match
+    `MlpSonarModel.forward` up to float rounding.
+    """
+    def __init__(self, weights: Dict[str, np.ndarray]) -> None:
+        # Transposed once so that forward is `X @ w + b`.
+        self.w1 = np.ascontiguousarray(weights['w1'].T, dtype=np.float32)
+        self.b1 = np.asarray(weights['b1'], dtype=np.float32)
+        self.w2 = np.ascontiguousarray(weights['w2'].T, dtype=np.float32)
+        self.b2 = np.asarray(weights['b2'], dtype=np.float32)
+
+    @classmethod
+    def from_npz(cls, path: str) -> 'NumpyMlpSonarModel':
+        with np.load(path) as npz:
+            return cls({key: npz[key] for key in STATE_DICT_KEYS})
+
+    def forward(self, X: np.ndarray) -> np.ndarray:
+        hidden = np.asarray(X, dtype=np.float32) @ self.w1
+        hidden += self.b1
+        np.maximum(hidden, 0, out=hidden)
+        logits = hidden @ self.w2
+        logits += self.b2
+        # Numerically stable sigmoid: 1 / (1 + exp(-x)).
+        return np.exp(-np.logaddexp(0, -logits)).astype(np.float32)
+
+    def predict_proba(self, X: np.ndarray,
+                      batch_size: Optional[int] = None) -> np.ndarray:
+        """
+        Returns model outputs for X, computed `batch_size` rows at a time
+        (all at once if batch_size is None).
+        """
+        if batch_size is None or len(X) <= batch_size:
+            return self.forward(X)
+        return np.concatenate([self.forward(X[i: i + batch_size])
+                               for i in range(0, len(X), batch_size)])
+
+    __call__ = forward
+
+
+def load_numpy_model(config, model_name, logger) -> NumpyMlpSonarModel:
+    npz_path = config[model_name].get("numpy_model_path")
+    if npz_path is None:
+        logger.error(f"numpy_model_path is missing in [{model_name}]. " \
+                     "Export the model with numpy_model.py")
+        sys.exit(1)
+    try:
+        return NumpyMlpSonarModel.from_npz(npz_path)
+    except FileNotFoundError:
+        logger.exception(f'File {npz_path} is missing')
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    # Exporting needs the torch model, inference with this module doesn't.
+    from logger import Logger
+    from model import load_model
+
+    logger = Logger(show=True).get_logger(__name__)
+
+    config = configparser.ConfigParser()
+    config.read(CONFIG_NAME)
+
+    model = load_model(config, MODEL_NAME, logger)
+    npz_path = os.path.join('.', 'experiments', MODEL_NAME + '.npz')
+    export_npz(model, npz_path)
+
+    config[MODEL_NAME]['numpy_model_path'] = npz_path
+    with open(CONFIG_NAME, 'w') as configfile:
+        config.write(configfile)
+
+    logger.info(f"Exported {MODEL_NAME} weights to {npz_path}")
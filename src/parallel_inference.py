@@ -0,0 +1,215 @@
+"""
+Multi-process sharded inference over the backlog.
+
+The id range of rows without predictions is split into shards that are
+processed by a pool of worker processes. Every worker has its own
+database connection. Model weights are moved to shared memory once
+by the parent process and the workers map the same memory instead of
+unpickling their own copy.
+"""
+
+import configparser
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+import greenplumpython as gp
+import torch
+import torch.multiprocessing
+
+from inference import (get_args_parser, get_db_params, get_batch_size,
+                       iter_feats_without_preds, get_pred_table_new_vals_df,
+                       CONFIG_NAME, MODEL_NAME, DATA_TABLE, PREDICTIONS_TABLE,
+                       PREDICTIONS_COLUMNS)
+from db_utils import CopyWriter
+from engines import Predictor, get_model_version, load_predictor
+from logger import Logger
+from prediction_cache import PredictionCache
+
+
+SHOW_LOG = True
+DEFAULT_CHUNK_SIZE = 10_000
+
+# State of a worker process, set by `init_worker`.
+_worker: Dict = {}
+
+
+def get_backlog_id_range(db: gp.Database) -> Optional[Tuple[int, int]]:
+    """
+    Returns (min_id, max_id) of rows without predictions
+    or None if there are no such rows.
+    """
+    with db._conn.cursor() as curs:
+        curs.execute(
+            "SELECT min(f.id) AS min_id, max(f.id) AS max_id " \
+            f"FROM {DATA_TABLE} AS f " \
+            "WHERE NOT EXISTS (" \
+            f"SELECT 1 FROM {PREDICTIONS_TABLE} AS p " \
+            "WHERE p.frequencies_id = f.id);")
+        row = curs.fetchone()
+    if row['min_id'] is None:
+        return None
+    return row['min_id'], row['max_id']
+
+
+def split_id_range(min_id: int, max_id: int,
+                   n_shards: int) -> List[Tuple[int, int]]:
+    """
+    Splits [min_id, max_id] into at most `n_shards` contiguous shards.
+
+    Each shard is returned as (exclusive lower bound, inclusive upper bound)
+    to match `iter_feats_without_preds`.
+    """
+    n_ids = max_id - min_id + 1
+    n_shards = max(1, min(n_shards, n_ids))
+    bounds = [min_id - 1 + (n_ids * i) // n_shards for i in range(n_shards + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def init_worker(model: Predictor, db_params: Dict[str, str],
+                chunk_size: int, copy_format: str, n_threads: int,
+                precision: str = 'fp32',
+                batch_size: Optional[int] = None,
+                cache_params: Optional[Dict] = None) -> None:
+    # One process per core: intra-op threads would only oversubscribe.
+    torch.set_num_threads(n_threads)
+    if precision != 'fp32':
+        # Quantized modules can't be pickled to the workers,
+        # so the shared fp32 model is converted by each of them.
+        from precision import convert_precision
+        model = convert_precision(model, precision)
+    _worker['model'] = model
+    _worker['db'] = gp.Database(params=db_params)
+    _worker['chunk_size'] = chunk_size
+    _worker['copy_format'] = copy_format
+    _worker['batch_size'] = batch_size
+    # Every worker has its own in-memory cache, the table is shared.
+    _worker['cache'] = (PredictionCache(db=_worker['db'], **cache_params)
+                        if cache_params is not None else None)
+    # Logger() would reopen (and truncate) the parent's log file.
+    _worker['logger'] = logging.getLogger(f"{__name__}.worker_{os.getpid()}")
+
+
+def predict_shard(min_id: int, max_id: int) -> Tuple[int, float]:
+    """
+    Predicts rows without predictions with ids in (min_id, max_id].
+    Runs in a worker process. Returns number of rows and elapsed seconds.
+    """
+    start = time.perf_counter()
+    db = _worker['db']
+    logger = _worker['logger']
+    writer = CopyWriter(db, PREDICTIONS_TABLE, PREDICTIONS_COLUMNS,
+                        copy_format=_worker['copy_format'],
+                        max_buffer_rows=_worker['chunk_size'])
+    with writer:
+        for data_np, freq_ids_np in iter_feats_without_preds(
+                db, _worker['chunk_size'], logger, min_id, max_id):
+            writer.write(get_pred_table_new_vals_df(
+                data_np, freq_ids_np, _worker['model'], logger,
+                _worker['batch_size'], _worker['cache']))
+    if _worker['cache'] is not None:
+        logger.debug(f"Prediction cache: {_worker['cache'].get_stats()}")
+    return writer.n_written, time.perf_counter() - start
+
+
+def predict_backlog_in_parallel(db: gp.Database,
+                                db_params: Dict[str, str],
+                                model: Predictor,
+                                logger: Logger,
+                                n_workers: int,
+                                shards_per_worker: int = 4,
+                                chunk_size: int = DEFAULT_CHUNK_SIZE,
+                                copy_format: str = 'csv',
+                                n_threads_per_worker: int = 1,
+                                precision: str = 'fp32',
+                                batch_size: Optional[int] = None,
+                                cache_params: Optional[Dict] = None) -> int:
+    """
+    Predicts the backlog with `n_workers` processes.
+
+    The id range is split into `n_workers * shards_per_worker` shards,
+    so workers that got sparse shards take more of them.
+    `model` should be in fp32, workers convert it to `precision`.
+    If `cache_params` (keyword arguments of PredictionCache except `db`)
+    are given, every worker caches predictions.
+
+    Returns:
+    --------
+    int: number of predicted rows
+    """
+    id_range = get_backlog_id_range(db)
+    if id_range is None:
+        return 0
+    shards = split_id_range(*id_range, n_workers * shards_per_worker)
+    logger.debug(f"Split ids {id_range} into {len(shards)} shards")
+
+    if isinstance(model, torch.nn.Module):
+        model.eval()
+        model.share_memory()
+    elif precision != 'fp32':
+        raise ValueError("Only torch models support reduced precision")
+
+    start = time.perf_counter()
+    n_predicted = 0
+    # spawn: forking a process that already runs torch threads is unsafe.
+    # torch.multiprocessing pickles the shared tensors as handles,
+    # so the weights are not copied into the workers.
+    with ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=torch.multiprocessing.get_context('spawn'),
+            initializer=init_worker,
+            initargs=(model, db_params, chunk_size,
+                      copy_format, n_threads_per_worker,
+                      precision, batch_size, cache_params)) as executor:
+        futures = {executor.submit(predict_shard, *shard): shard
+                   for shard in shards}
+        for future in as_completed(futures):
+            n_rows, seconds = future.result()
+            n_predicted += n_rows
+            logger.debug(f"Shard {futures[future]}: {n_rows} rows " \
+                         f"in {seconds:.3f} s")
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"Predicted {n_predicted} rows with {n_workers} workers " \
+                f"in {elapsed:.3f} s, {n_predicted / max(elapsed, 1e-9):.0f} rows/s")
+    return n_predicted
+
+
+if __name__ == "__main__":
+    logger_getter = Logger(SHOW_LOG)
+    logger = logger_getter.get_logger(__name__)
+
+    config = configparser.ConfigParser()
+    config.read(CONFIG_NAME)
+
+    parser = get_args_parser()
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes.")
+    parser.add_argument("--shards-per-worker", type=int, default=4)
+    args = parser.parse_args()
+
+    db_params = get_db_params(args)
+    try:
+        db = gp.Database(params=db_params)
+    except Exception:
+        logger.exception("Failed to create database object")
+        sys.exit(1)
+
+    model = load_predictor(config, MODEL_NAME, logger, args.engine)
+
+    predict_backlog_in_parallel(
+        db, db_params, model, logger,
+        n_workers=args.workers,
+        shards_per_worker=args.shards_per_worker,
+        chunk_size=args.chunk_size or DEFAULT_CHUNK_SIZE,
+        copy_format=args.copy_format,
+        precision=args.precision,
+        batch_size=get_batch_size(args, config),
+        cache_params=dict(
+            model_version=get_model_version(config, MODEL_NAME,
+                                            args.engine, args.precision),
+            max_size=args.cache_size, decimals=args.cache_decimals,
+            table=args.cache_table) if args.cache_size > 0 else None)
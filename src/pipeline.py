@@ -0,0 +1,566 @@
+"""
+Incremental runner of the project pipeline:
+
+    prepare_data -> train -> functional_test
+                          -> inference
+                          -> unit_tests
+
+Stages form a DAG. A stage's fingerprint is a content hash of
+- its commands,
+- code: the scripts it runs and the src modules they import (recursively),
+- input files (globs),
+- `config.ini` sections it reads, and files their values point to
+  (e.g. the split files listed in [SPLIT_DATA]).
+
+After a stage runs, its output files (files referenced by the config
+sections it writes and explicit outputs) are copied into a
+content-addressed object store and the written config sections are
+recorded. A stage whose fingerprint matches the recorded one is skipped:
+missing or changed outputs are restored from the store, written config
+sections are restored in `config.ini`. So a stage reruns only when
+something it depends on changed, and if it reproduces the same outputs,
+stages downstream of it are still skipped.
+
+Stages whose dependencies are done run in parallel (e.g. functional
+tests, inference and unit tests after training). Inference depends on
+the database state, which is not fingerprinted, so it always runs.
+
+Usage:
+    python src/pipeline.py --db-host database --db-port 5432 --db-user ... --db-password ... --db-name ...
+    python src/pipeline.py train functional_test   # these stages and their upstream
+    python src/pipeline.py --dry-run               # only show what would run
+"""
+
+import argparse
+import ast
+import configparser
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, List, Optional, Set
+
+from logger import Logger
+
+
+SHOW_LOG = True
+CONFIG_NAME = 'config.ini'
+SRC_DIR = os.path.join('.', 'src')
+# In ./data, as it's the volume persisted by docker-compose.
+DEFAULT_CACHE_DIR = os.path.join('.', 'data', '.pipeline')
+UNIT_TESTS = [
+    'test_prepare_data', 'test_dataset', 'test_model', 'test_db_utils',
+    'test_parallel_inference', 'test_model_registry', 'test_numpy_model',
+    'test_precision', 'test_autotune', 'test_prediction_server',
+    'test_prediction_cache', 'test_pipeline', 'test_sweep', 'test_ensemble',
+    'test_metric_accumulators', 'test_train', 'test_checkpointer',
+    'test_inference_metrics', 'test_logger',
+]
+
+
+class Stage:
+    """
+    Arguments:
+    ----------
+    name: str
+    cmds: List[List[str]]
+        Commands run one after another. Python scripts among their
+        arguments are fingerprinted with the src modules they import.
+    deps: List[str]
+        Names of stages that should finish before this one.
+    inputs: List[str]
+        Globs of input files.
+    config_sections: List[str]
+        Sections of config.ini the stage reads. "section:key1,key2"
+        means only these keys of the section.
+    output_sections: List[str]
+        Sections of config.ini the stage writes. Files their values
+        point to are outputs of the stage.
+    outputs: List[str]
+        Other output files.
+    cache: bool
+        If False, the stage always runs.
+    """
+    def __init__(self, name: str, cmds: List[List[str]],
+                 deps: Iterable[str] = (), inputs: Iterable[str] = (),
+                 config_sections: Iterable[str] = (),
+                 output_sections: Iterable[str] = (),
+                 outputs: Iterable[str] = (), cache: bool = True) -> None:
+        self.name = name
+        self.cmds = cmds
+        self.deps = list(deps)
+        self.inputs = list(inputs)
+        self.config_sections = list(config_sections)
+        self.output_sections = list(output_sections)
+        self.outputs = list(outputs)
+        self.cache = cache
+
+
+def get_unit_test_cmds() -> List[List[str]]:
+    coverage = [sys.executable, '-m', 'coverage']
+    cmds = [coverage + ['run'] + (['-a'] if i else [])
+            + [f'src/unit_tests/{test}.py']
+            for i, test in enumerate(UNIT_TESTS)]
+    return cmds + [coverage + ['report', '-m']]
+
+
+def get_stages(args: argparse.Namespace) -> List[Stage]:
+    python = sys.executable
+    stages = [
+        Stage('prepare_data',
+              [[python, 'src/prepare_data.py']],
+              config_sections=['PREPARE_DATA_PARAMETERS'],
+              output_sections=['SPLIT_DATA']),
+        Stage('train',
+              [[python, 'src/train.py']],
+              deps=['prepare_data'],
+              # Only keys the stage reads: the rest of [mlp] is its output.
+              config_sections=['SPLIT_DATA', 'AUTOTUNE',
+                               'mlp:hidden_size,lr,epochs,optimizer,' \
+                               'weight_decay,patience,min_delta,target,' \
+                               'time_budget'],
+              output_sections=['mlp']),
+        Stage('functional_test',
+              [[python, 'src/functional_test.py']],
+              deps=['train'],
+              inputs=['tests/*.json'],
+              config_sections=['mlp', 'AUTOTUNE']),
+        Stage('unit_tests',
+              get_unit_test_cmds(),
+              deps=['prepare_data', 'train'],
+              inputs=['tests/*.json'],
+              config_sections=['PREPARE_DATA_PARAMETERS', 'SPLIT_DATA', 'mlp']),
+    ]
+    db_args = [args.db_host, args.db_port, args.db_user,
+               args.db_password, args.db_name]
+    if all(arg is not None for arg in db_args):
+        stages.append(Stage(
+            'inference',
+            [[python, 'src/inference.py',
+              '--db-host', args.db_host, '--db-port', str(args.db_port),
+              '--db-user', args.db_user, '--db-password', args.db_password,
+              '--db-name', args.db_name]],
+            deps=['train'],
+            config_sections=['mlp', 'AUTOTUNE'],
+            cache=False))
+    return stages
+
+
+def get_code_files(script: str, src_dir: str = SRC_DIR) -> Set[str]:
+    """
+    Returns the script and src modules it imports, recursively.
+    Imports are found statically, so lazy imports inside functions count.
+    """
+    code_files: Set[str] = set()
+    to_visit = [os.path.normpath(script)]
+    while to_visit:
+        path = to_visit.pop()
+        if path in code_files:
+            continue
+        code_files.add(path)
+        with open(path) as f:
+            tree = ast.parse(f.read(), filename=path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0:
+                modules = [node.module]
+            else:
+                continue
+            for module in modules:
+                top_module = module.split('.')[0]
+                for module_dir in (src_dir, os.path.dirname(path)):
+                    module_path = os.path.normpath(
+                        os.path.join(module_dir, top_module + '.py'))
+                    if os.path.isfile(module_path):
+                        to_visit.append(module_path)
+                        break
+    return code_files
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class PipelineRunner:
+    """
+    Runs stages of a DAG, skipping stages whose inputs didn't change.
+
+    Arguments:
+    ----------
+    stages: List[Stage]
+    logger: Logger
+    cache_dir: str
+        Directory with state.json, the object store and stage logs.
+    config_path: str
+    max_workers: Optional[int]
+        Maximum number of stages run at once.
+    src_dir: str
+        Directory of modules imported by the stages' scripts.
+    """
+    def __init__(self, stages: List[Stage], logger,
+                 cache_dir: str = DEFAULT_CACHE_DIR,
+                 config_path: str = CONFIG_NAME,
+                 max_workers: Optional[int] = None,
+                 src_dir: str = SRC_DIR) -> None:
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"Stage {stage.name} depends on " \
+                                     f"unknown stage {dep}")
+        self.logger = logger
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        self.logs_dir = os.path.join(cache_dir, 'logs')
+        self.state_path = os.path.join(cache_dir, 'state.json')
+        self.config_path = config_path
+        self.max_workers = max_workers or len(stages)
+        self.src_dir = src_dir
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.logs_dir, exist_ok=True)
+        self.state = self._load_state()
+
+    def _load_state(self) -> Dict:
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                return json.load(f)
+        return {'stages': {}, 'file_hashes': {}}
+
+    def _save_state(self) -> None:
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=4)
+        os.replace(tmp_path, self.state_path)
+
+    def hash_file(self, path: str) -> str:
+        """
+        Content hash of a file. Hashes are memoized by size and mtime,
+        so unchanged files are not read again.
+        """
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        cached = self.state['file_hashes'].get(key)
+        if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return cached[2]
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2 ** 20), b''):
+                hasher.update(block)
+        digest = hasher.hexdigest()
+        self.state['file_hashes'][key] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def _read_config(self) -> configparser.ConfigParser:
+        config = configparser.ConfigParser()
+        config.read(self.config_path)
+        return config
+
+    def _write_config(self, config: configparser.ConfigParser) -> None:
+        # Atomic, as stages running in parallel read the config.
+        tmp_path = self.config_path + '.tmp'
+        with open(tmp_path, 'w') as configfile:
+            config.write(configfile)
+        os.replace(tmp_path, self.config_path)
+
+    @staticmethod
+    def _get_section(config: configparser.ConfigParser,
+                     section: str) -> Optional[Dict[str, str]]:
+        if section not in config:
+            return None
+        return dict(config[section])
+
+    @staticmethod
+    def _get_section_files(items: Optional[Dict[str, str]]) -> List[str]:
+        """Values of a config section that are paths to existing files."""
+        if items is None:
+            return []
+        return sorted(os.path.normpath(value) for value in items.values()
+                      if os.path.isfile(value))
+
+    def get_fingerprint(self, stage: Stage) -> str:
+        config = self._read_config()
+        sections = {}
+        for entry in stage.config_sections:
+            section, _, keys = entry.partition(':')
+            items = self._get_section(config, section)
+            if items is not None and keys:
+                items = {key: items[key] for key in keys.split(',')
+                         if key in items}
+            sections[entry] = items
+        code_files: Set[str] = set()
+        for cmd in stage.cmds:
+            for arg in cmd:
+                if arg.endswith('.py') and os.path.isfile(arg):
+                    code_files |= get_code_files(arg, self.src_dir)
+        input_files = set()
+        for pattern in stage.inputs:
+            input_files.update(os.path.normpath(path)
+                               for path in glob.glob(pattern))
+        for items in sections.values():
+            input_files.update(self._get_section_files(items))
+        fingerprint = {
+            'cmds': stage.cmds,
+            'code': {path: self.hash_file(path) for path in sorted(code_files)},
+            'inputs': {path: self.hash_file(path)
+                       for path in sorted(input_files)},
+            'config_sections': sections,
+        }
+        return hash_bytes(json.dumps(fingerprint, sort_keys=True).encode())
+
+    def get_outputs(self, stage: Stage,
+                    config: configparser.ConfigParser) -> List[str]:
+        outputs = [os.path.normpath(path) for path in stage.outputs]
+        for section in stage.output_sections:
+            outputs.extend(self._get_section_files(
+                self._get_section(config, section)))
+        return sorted(set(outputs))
+
+    def _get_object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def _store(self, path: str) -> str:
+        digest = self.hash_file(path)
+        object_path = self._get_object_path(digest)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            shutil.copyfile(path, object_path + '.tmp')
+            os.replace(object_path + '.tmp', object_path)
+        return digest
+
+    def _restore(self, path: str, digest: str) -> None:
+        # Replaced, not overwritten: processes that memory-mapped
+        # the old file keep reading it.
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        shutil.copyfile(self._get_object_path(digest), path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    def try_restore(self, stage: Stage, fingerprint: str) -> bool:
+        """
+        If the stage ran with this fingerprint and its outputs are
+        available, restores changed outputs and returns True.
+        """
+        record = self.state['stages'].get(stage.name)
+        if record is None or record['fingerprint'] != fingerprint:
+            return False
+        to_restore = {}
+        for path, digest in record['outputs'].items():
+            if os.path.isfile(path) and self.hash_file(path) == digest:
+                continue
+            if not os.path.exists(self._get_object_path(digest)):
+                return False
+            to_restore[path] = digest
+        for path, digest in to_restore.items():
+            self._restore(path, digest)
+            self.logger.info(f"{stage.name}: restored {path} from cache")
+
+        config = self._read_config()
+        changed_sections = [
+            section for section, items in record['output_sections'].items()
+            if self._get_section(config, section) != items]
+        if changed_sections:
+            for section in changed_sections:
+                config[section] = record['output_sections'][section]
+            self._write_config(config)
+            self.logger.info(f"{stage.name}: restored {changed_sections} " \
+                             f"in {self.config_path} from cache")
+        return True
+
+    def _commit(self, stage: Stage, fingerprint: str, duration: float) -> None:
+        config = self._read_config()
+        self.state['stages'][stage.name] = {
+            'fingerprint': fingerprint,
+            'outputs': {path: self._store(path)
+                        for path in self.get_outputs(stage, config)},
+            'output_sections': {
+                section: self._get_section(config, section)
+                for section in stage.output_sections
+                if section in config},
+            'duration': duration,
+        }
+        self._save_state()
+
+    def _run_cmds(self, stage: Stage) -> int:
+        log_path = os.path.join(self.logs_dir, f'{stage.name}.log')
+        with open(log_path, 'w') as log_file:
+            for cmd in stage.cmds:
+                try:
+                    returncode = subprocess.run(
+                        cmd, stdout=log_file,
+                        stderr=subprocess.STDOUT).returncode
+                except OSError as e:
+                    log_file.write(f"Failed to start {cmd[0]}: {e}\n")
+                    return 127
+                if returncode != 0:
+                    return returncode
+        return 0
+
+    def _log_failure(self, stage: Stage, n_lines: int = 20) -> None:
+        log_path = os.path.join(self.logs_dir, f'{stage.name}.log')
+        with open(log_path, errors='replace') as f:
+            tail = f.readlines()[-n_lines:]
+        self.logger.error(f"{stage.name} failed, see {log_path}:\n" \
+                          + ''.join(tail))
+
+    def get_plan(self, targets: Optional[Iterable[str]] = None) -> List[str]:
+        """
+        Returns names of the target stages and their upstream stages
+        in topological order. All stages if targets is None.
+        """
+        targets = list(self.stages) if not targets else list(targets)
+        for name in targets:
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage {name}")
+        plan: List[str] = []
+        visiting: Set[str] = set()
+
+        def visit(name: str) -> None:
+            if name in plan:
+                return
+            if name in visiting:
+                raise ValueError(f"Dependency cycle through stage {name}")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            plan.append(name)
+
+        for name in targets:
+            visit(name)
+        return plan
+
+    def run(self, targets: Optional[Iterable[str]] = None,
+            force: Iterable[str] = (), dry_run: bool = False
+            ) -> Dict[str, str]:
+        """
+        Runs the stages and returns {stage: status}, where status is one of
+        'ran', 'cached', 'failed', 'upstream failed' (or 'would run'
+        with dry_run).
+        """
+        force = set(force)
+        pending = self.get_plan(targets)
+        statuses: Dict[str, str] = {}
+        running: Dict[Future, tuple] = {}
+        done_statuses = ('ran', 'cached', 'would run')
+        failed_statuses = ('failed', 'upstream failed')
+
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            while pending or running:
+                progress = True
+                while progress:
+                    progress = False
+                    for name in list(pending):
+                        stage = self.stages[name]
+                        dep_statuses = [statuses.get(dep) for dep in stage.deps]
+                        if any(status in failed_statuses
+                               for status in dep_statuses):
+                            statuses[name] = 'upstream failed'
+                        elif not all(status in done_statuses
+                                     for status in dep_statuses):
+                            continue
+                        else:
+                            statuses[name] = self._start(
+                                stage, force, dry_run, dep_statuses,
+                                pool, running)
+                        pending.remove(name)
+                        progress = True
+                if not running:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage, fingerprint, start = running.pop(future)
+                    duration = time.perf_counter() - start
+                    try:
+                        returncode = future.result()
+                    except BaseException:
+                        # E.g. the log file can't be written: the stage
+                        # fails, the rest of the DAG goes on.
+                        self.logger.exception(f"{stage.name} failed")
+                        statuses[stage.name] = 'failed'
+                        continue
+                    if returncode == 0:
+                        if stage.cache:
+                            self._commit(stage, fingerprint, duration)
+                        statuses[stage.name] = 'ran'
+                        self.logger.info(f"{stage.name}: done " \
+                                         f"in {duration:.1f} s")
+                    else:
+                        statuses[stage.name] = 'failed'
+                        self._log_failure(stage)
+        self._save_state()
+        return statuses
+
+    def _start(self, stage: Stage, force: Set[str], dry_run: bool,
+               dep_statuses: List[str], pool: ThreadPoolExecutor,
+               running: Dict[Future, tuple]) -> Optional[str]:
+        """Restores the stage from cache or submits it to the pool."""
+        if dry_run and 'would run' in dep_statuses:
+            return 'would run'
+        fingerprint = self.get_fingerprint(stage)
+        if stage.cache and stage.name not in force:
+            record = self.state['stages'].get(stage.name)
+            if dry_run:
+                if record is not None and record['fingerprint'] == fingerprint:
+                    return 'cached'
+                return 'would run'
+            if self.try_restore(stage, fingerprint):
+                self.logger.info(f"{stage.name}: cached, skipped")
+                return 'cached'
+        if dry_run:
+            return 'would run'
+        self.logger.info(f"{stage.name}: running")
+        future = pool.submit(self._run_cmds, stage)
+        running[future] = (stage, fingerprint, time.perf_counter())
+        return 'running'
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("stages", type=str, nargs='*',
+                        help="Stages to run with their upstream stages. " \
+                            "All stages by default.")
+    parser.add_argument("--force", type=str, nargs='+', default=[],
+                        help="Stages to run even if cached.")
+    parser.add_argument("--dry-run", action='store_true',
+                        help="Only show which stages would run.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Maximum number of stages run at once.")
+    parser.add_argument("--cache-dir", type=str, default=DEFAULT_CACHE_DIR)
+    # Without the database arguments the inference stage is left out.
+    parser.add_argument("--db-host", type=str, default=None)
+    parser.add_argument("--db-port", type=int, default=None)
+    parser.add_argument("--db-user", type=str, default=None)
+    parser.add_argument("--db-password", type=str, default=None)
+    parser.add_argument("--db-name", type=str, default=None)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logger_getter = Logger(SHOW_LOG)
+    logger = logger_getter.get_logger(__name__)
+
+    args = parse_args()
+
+    stages = get_stages(args)
+    if 'inference' not in [stage.name for stage in stages]:
+        logger.info("Database arguments are not given, " \
+                    "inference stage is skipped")
+
+    runner = PipelineRunner(stages, logger, args.cache_dir,
+                            max_workers=args.workers)
+    start = time.perf_counter()
+    statuses = runner.run(args.stages, args.force, args.dry_run)
+    for name, status in statuses.items():
+        logger.info(f"{name:>16}: {status}")
+    logger.info(f"Pipeline finished in {time.perf_counter() - start:.1f} s")
+
+    if any(status in ('failed', 'upstream failed')
+           for status in statuses.values()):
+        sys.exit(1)
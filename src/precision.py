@@ -0,0 +1,226 @@
+"""
+Reduced precision inference modes for MlpSonarModel and their parity check.
+
+Modes:
+- fp32: the model as trained
+- int8: dynamic quantization of Linear layers (int8 weights,
+  activations quantized on the fly). Models without Linear layers
+  (MlpSonarEnsemble) are rejected
+- bf16 / fp16: weights and inputs cast to bfloat16 / float16
+
+Running this module compares every mode with fp32 on tests/*.json and
+on the held-out split: accuracy delta, drift of `m_probability` and
+throughput. It exits with code 1 if a mode exceeds the tolerances.
+
+Usage:
+    python src/precision.py --precisions int8 bf16 fp16 --output precision.json
+"""
+
+import argparse
+import configparser
+import copy
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import weakref
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from dataset import load_split
+from engines import PRECISIONS
+from labels import LABEL2I
+
+
+CONFIG_NAME = 'config.ini'
+MODEL_NAME = 'mlp'
+HALF_DTYPES = {'bf16': torch.bfloat16, 'fp16': torch.float16}
+
+
+class HalfPrecisionModel:
+    """
+    Runs a model with weights and inputs in a 16-bit float dtype.
+    Outputs are returned as float32 numpy arrays.
+    """
+    def __init__(self, model: torch.nn.Module, dtype: torch.dtype) -> None:
+        self.model = copy.deepcopy(model).to(dtype)
+        self.model.eval()
+        self.dtype = dtype
+
+    def predict_proba(self, X: np.ndarray,
+                      batch_size: Optional[int] = None) -> np.ndarray:
+        X = torch.as_tensor(X).to(self.dtype)
+        with torch.no_grad():
+            if batch_size is None or len(X) <= batch_size:
+                return self.model(X).float().numpy(force=True)
+            return torch.cat([self.model(batch) for batch in X.split(batch_size)]
+                             ).float().numpy(force=True)
+
+
+# model -> {precision: converted model}. Cached, so that callers which
+# fetch the model on every pass (see inference_service.py) get the same
+# converted model until the original one changes. Weak keys: models
+# replaced in the model registry are freed with their converted copies.
+_converted: "weakref.WeakKeyDictionary[torch.nn.Module, Dict]" = \
+    weakref.WeakKeyDictionary()
+_converted_lock = threading.Lock()
+
+
+def _convert_precision(model: torch.nn.Module, precision: str):
+    if precision == 'int8':
+        # Otherwise quantize_dynamic silently returns an fp32 copy, e.g.
+        # of MlpSonarEnsemble with stacked weights.
+        if not any(isinstance(module, torch.nn.Linear)
+                   for module in model.modules()):
+            raise ValueError("int8 precision quantizes Linear layers, " \
+                             f"{type(model).__name__} has none. " \
+                             "Use fp32, bf16 or fp16")
+        quantized = torch.ao.quantization.quantize_dynamic(
+            copy.deepcopy(model), {torch.nn.Linear}, dtype=torch.qint8)
+        quantized.eval()
+        return quantized
+    if precision in HALF_DTYPES:
+        return HalfPrecisionModel(model, HALF_DTYPES[precision])
+    raise ValueError(f"precision should be one of {PRECISIONS}")
+
+
+def convert_precision(model: torch.nn.Module, precision: str):
+    """
+    Returns a predictor (object with `predict_proba`) running `model`
+    in `precision`. The original model is not modified.
+    """
+    if precision == 'fp32':
+        # Not cached: the value would keep its weak key alive.
+        return model
+    with _converted_lock:
+        by_precision = _converted.setdefault(model, {})
+        if precision not in by_precision:
+            by_precision[precision] = _convert_precision(model, precision)
+        return by_precision[precision]
+
+
+def get_parity_datasets(config) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Returns {name: (X, y)} for every tests/*.json and the held-out split.
+    """
+    datasets = {}
+    tests_path = os.path.join('.', "tests")
+    for test in sorted(os.listdir(tests_path)):
+        with open(os.path.join(tests_path, test)) as f:
+            data = json.load(f)
+        datasets[test] = (np.array(data['X'], dtype=np.float32),
+                          np.array([LABEL2I[label] for label in data['y']]))
+
+    if "SPLIT_DATA" in config:
+        datasets['held_out'] = load_split(config["SPLIT_DATA"]['X_test'],
+                                          config["SPLIT_DATA"]['y_test'],
+                                          mmap=False)
+    return datasets
+
+
+def measure_throughput(predictor, n_rows: int, n_runs: int = 5) -> float:
+    """Returns rows per second of predict_proba on a batch of n_rows."""
+    X = np.random.default_rng(0).random((n_rows, 60), dtype=np.float32)
+    predictor.predict_proba(X)  # warm-up
+    times = []
+    for _ in range(n_runs):
+        start = time.perf_counter()
+        predictor.predict_proba(X)
+        times.append(time.perf_counter() - start)
+    return n_rows / statistics.median(times)
+
+
+def check_parity(model: torch.nn.Module,
+                 precisions: List[str],
+                 datasets: Dict[str, Tuple[np.ndarray, np.ndarray]],
+                 throughput_rows: int = 65536) -> List[Dict]:
+    """
+    Compares every precision with fp32 on every dataset.
+
+    Returns a list of reports, one per (precision, dataset) plus
+    a throughput report per precision (dataset 'throughput').
+    """
+    m_index = LABEL2I['M']
+    reference = {name: model.predict_proba(X) for name, (X, _) in datasets.items()}
+    reports = []
+    for precision in precisions:
+        predictor = convert_precision(model, precision)
+        for name, (X, y) in datasets.items():
+            probs = predictor.predict_proba(X)
+            ref_probs = reference[name]
+            drift = np.abs(probs[:, m_index] - ref_probs[:, m_index])
+            accuracy = float(np.mean(probs.argmax(axis=1) == y))
+            ref_accuracy = float(np.mean(ref_probs.argmax(axis=1) == y))
+            reports.append({
+                'precision': precision,
+                'dataset': name,
+                'accuracy': accuracy,
+                'accuracy_delta': accuracy - ref_accuracy,
+                'prediction_agreement': float(np.mean(
+                    probs.argmax(axis=1) == ref_probs.argmax(axis=1))),
+                'm_probability_max_drift': float(drift.max()),
+                'm_probability_mean_drift': float(drift.mean()),
+            })
+        reports.append({
+            'precision': precision,
+            'dataset': 'throughput',
+            'rows_per_second': measure_throughput(predictor, throughput_rows),
+        })
+    return reports
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--precisions", type=str, nargs='+',
+                        default=PRECISIONS, choices=PRECISIONS)
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.02)
+    parser.add_argument("--max-probability-drift", type=float, default=0.05)
+    parser.add_argument("--throughput-rows", type=int, default=65536)
+    parser.add_argument("--output", type=str, default=None,
+                        help="Path to save the reports as json.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    from logger import Logger
+    from model import load_model
+
+    logger = Logger(show=True).get_logger(__name__)
+    args = parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(CONFIG_NAME)
+
+    model = load_model(config, MODEL_NAME, logger)
+    reports = check_parity(model, args.precisions, get_parity_datasets(config),
+                           args.throughput_rows)
+
+    failed = False
+    for report in reports:
+        if report['dataset'] == 'throughput':
+            logger.info(f"{report['precision']:>5} throughput: " \
+                        f"{report['rows_per_second']:.0f} rows/s")
+            continue
+        ok = (report['accuracy_delta'] >= -args.max_accuracy_drop and
+              report['m_probability_max_drift'] <= args.max_probability_drift)
+        failed = failed or not ok
+        logger.info(
+            f"{report['precision']:>5} {report['dataset']:>12}: " \
+            f"accuracy {report['accuracy']:.3f} " \
+            f"({report['accuracy_delta']:+.3f}), " \
+            f"agreement {report['prediction_agreement']:.3f}, " \
+            f"m_probability drift max {report['m_probability_max_drift']:.2e} " \
+            f"mean {report['m_probability_mean_drift']:.2e} " \
+            f"{'OK' if ok else 'FAIL'}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=4)
+
+    if failed:
+        logger.error("Some precisions exceed the tolerances")
+        sys.exit(1)
@@ -0,0 +1,211 @@
+"""
+Cache of predictions keyed by the feature vector and the model version.
+
+The sonar feed often re-sends identical or near-duplicate vectors.
+Features are quantised (rounded to `decimals` decimal places), so such
+vectors get the same key: a 128-bit hash of the quantised vector whose
+coefficients are derived from the model version. Keys of a whole batch
+are computed with a few numpy operations. The batch is deduplicated by
+key before the cache lookup, and only the unique vectors that miss the
+cache go through the model.
+
+Cached predictions are kept in an in-memory LRU and, optionally, in a
+database table shared by all inference processes:
+
+    CREATE TABLE prediction_cache (
+        key            BYTEA NOT NULL PRIMARY KEY,
+        prediction     TEXT  NOT NULL,
+        m_probability  FLOAT NOT NULL
+    );
+"""
+
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import greenplumpython as gp
+import numpy as np
+import psycopg2.extensions
+import psycopg2.extras
+
+from engines import Predictor
+from labels import get_preds_and_m_probs
+
+
+DEFAULT_CACHE_TABLE = 'prediction_cache'
+
+
+class PredictionCache:
+    """
+    Arguments:
+    ----------
+    model_version: str
+        Id of the model, e.g. from `engines.get_model_version`.
+        Predictions of other versions are never returned.
+    max_size: int
+        Maximum number of predictions kept in memory.
+    decimals: int
+        Features are rounded to this many decimal places before hashing.
+    db: Optional[gp.Database]
+        Connection to the database with the persistent cache table.
+    table: Optional[str]
+        Name of the persistent cache table. It is created if missing.
+        If None, the cache is in memory only.
+    """
+    def __init__(self, model_version: str, max_size: int = 100_000,
+                 decimals: int = 6, db: Optional[gp.Database] = None,
+                 table: Optional[str] = None) -> None:
+        if table is not None and db is None:
+            raise ValueError("`db` is required for a persistent cache table")
+        self.model_version = model_version
+        self.max_size = max_size
+        self.decimals = decimals
+        self.db = db
+        self.table = table
+        self._lru: OrderedDict = OrderedDict()
+        self._hash_coefficients = self._get_hash_coefficients(model_version)
+        self.stats = {
+            'rows': 0,       # rows passed to `predict`
+            'lookups': 0,    # unique vectors looked up
+            'hits': 0,       # found in memory
+            'db_hits': 0,    # found in the table
+            'misses': 0,     # predicted by the model
+        }
+        if self.table is not None:
+            self._create_table()
+
+    def _create_table(self) -> None:
+        with self.db._conn.cursor() as curs:
+            curs.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} (" \
+                "key BYTEA NOT NULL PRIMARY KEY, " \
+                "prediction TEXT NOT NULL, " \
+                "m_probability FLOAT NOT NULL);")
+
+    def set_model_version(self, model_version: str) -> None:
+        """Switches to another model. Cached predictions are dropped."""
+        if model_version != self.model_version:
+            self.model_version = model_version
+            self._hash_coefficients = self._get_hash_coefficients(model_version)
+            self._lru.clear()
+
+    def quantise(self, X: np.ndarray) -> np.ndarray:
+        # Integers, so that e.g. 0.0 and -0.0 get the same bytes.
+        return np.round(np.asarray(X, dtype=np.float64)
+                        * 10 ** self.decimals).astype(np.int64)
+
+    @staticmethod
+    def _get_hash_coefficients(model_version: str,
+                               n_features: int = 60) -> np.ndarray:
+        seed = int.from_bytes(hashlib.blake2b(model_version.encode(),
+                                              digest_size=8).digest(), 'little')
+        # Two independent 64-bit lanes of random odd coefficients.
+        coefficients = np.random.default_rng(seed).integers(
+            0, 2 ** 63, size=(n_features, 2), dtype=np.uint64)
+        return coefficients * np.uint64(2) + np.uint64(1)
+
+    def get_keys(self, X_quantised: np.ndarray) -> np.ndarray:
+        """
+        Returns 16-byte keys (numpy void) of the quantised rows:
+        sum(x_i * a_i) modulo 2 ** 64 for two sets of coefficients a_i.
+        """
+        lanes = X_quantised.view(np.uint64) @ self._hash_coefficients
+        return np.ascontiguousarray(lanes).view(np.dtype((np.void, 16))).ravel()
+
+    def _get_lru(self, keys: List[bytes]) -> List[Optional[Tuple[str, float]]]:
+        values = [self._lru.get(key) for key in keys]
+        for key, value in zip(keys, values):
+            if value is not None:
+                self._lru.move_to_end(key)
+        return values
+
+    def _put_lru(self, keys: List[bytes],
+                 values: List[Tuple[str, float]]) -> None:
+        self._lru.update(zip(keys, values))
+        for _ in range(len(self._lru) - self.max_size):
+            self._lru.popitem(last=False)
+
+    def _get_from_table(self, keys: List[bytes]) -> Dict[bytes, Tuple[str, float]]:
+        with self.db._conn.cursor(
+                cursor_factory=psycopg2.extensions.cursor) as curs:
+            curs.execute(
+                "SELECT key, prediction, m_probability " \
+                f"FROM {self.table} WHERE key = ANY(%s);",
+                ([psycopg2.Binary(key) for key in keys],))
+            return {bytes(key): (prediction, m_probability)
+                    for key, prediction, m_probability in curs.fetchall()}
+
+    def _put_to_table(self, items: List[Tuple[bytes, str, float]]) -> None:
+        with self.db._conn.cursor() as curs:
+            psycopg2.extras.execute_values(
+                curs,
+                f"INSERT INTO {self.table} (key, prediction, m_probability) " \
+                "VALUES %s ON CONFLICT (key) DO NOTHING;",
+                [(psycopg2.Binary(key), prediction, m_probability)
+                 for key, prediction, m_probability in items],
+                page_size=1000)
+
+    def predict(self, model: Predictor, X: np.ndarray,
+                batch_size: Optional[int] = None
+                ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns predictions ('M' or 'R') and m_probability for every row
+        of X. Only unique vectors that are not cached go through the model.
+        """
+        n_rows = len(X)
+        if n_rows == 0:
+            return np.empty(0, dtype='<U1'), np.empty(0)
+        unique_keys, unique_index, inverse = np.unique(
+            self.get_keys(self.quantise(X)),
+            return_index=True, return_inverse=True)
+        keys: List[bytes] = unique_keys.tolist()
+
+        values = self._get_lru(keys)
+        missing = [i for i, value in enumerate(values) if value is None]
+        n_hits = len(keys) - len(missing)
+
+        n_db_hits = 0
+        if missing and self.table is not None:
+            found = self._get_from_table([keys[i] for i in missing])
+            n_db_hits = len(found)
+            for i in missing:
+                values[i] = found.get(keys[i])
+            self._put_lru(list(found), list(found.values()))
+            missing = [i for i in missing if values[i] is None]
+
+        if missing:
+            outs_np = model.predict_proba(X[unique_index[missing]], batch_size)
+            preds, m_probs = get_preds_and_m_probs(outs_np)
+            missing_keys = [keys[i] for i in missing]
+            new_values = list(zip(preds.tolist(), m_probs.tolist()))
+            for i, value in zip(missing, new_values):
+                values[i] = value
+            self._put_lru(missing_keys, new_values)
+            if self.table is not None:
+                self._put_to_table([(key, prediction, m_probability)
+                                    for key, (prediction, m_probability)
+                                    in zip(missing_keys, new_values)])
+
+        self.stats['rows'] += n_rows
+        self.stats['lookups'] += len(keys)
+        self.stats['hits'] += n_hits
+        self.stats['db_hits'] += n_db_hits
+        self.stats['misses'] += len(missing)
+
+        unique_preds = np.array([value[0] for value in values])
+        unique_m_probs = np.array([value[1] for value in values])
+        inverse = inverse.reshape(-1)
+        return unique_preds[inverse], unique_m_probs[inverse]
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        Returns counters and
+        - hit_rate: fraction of unique vectors found in memory or the table
+        - forward_rate: fraction of rows that went through the model
+        """
+        stats = dict(self.stats)
+        stats['size'] = len(self._lru)
+        stats['hit_rate'] = ((stats['hits'] + stats['db_hits'])
+                             / max(stats['lookups'], 1))
+        stats['forward_rate'] = stats['misses'] / max(stats['rows'], 1)
+        return stats
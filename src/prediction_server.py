@@ -0,0 +1,293 @@
+"""
+HTTP/JSON prediction server with dynamic micro-batching.
+
+Concurrent requests are grouped into one model call by `MicroBatcher`:
+a batch is predicted as soon as it has `max_batch_size` rows or
+`max_wait_ms` milliseconds passed since its first row arrived.
+With `max_wait_ms` = 0 batches are formed only of requests that queued
+up while the previous batch was predicted, so a lone request doesn't
+wait. Waiting pays off when a model call is expensive compared to
+handling a request (bigger models, GPU).
+
+Endpoints:
+- POST /predict
+    Request: {"frequencies": [freq_0, ..., freq_59], "id": 1}
+        ("id" is optional)
+    Response: {"frequencies_id": 1, "prediction": "M", "m_probability": 0.93}
+        (same columns as `inference.py` writes to predictions;
+        "frequencies_id" only if "id" was given)
+- GET /health
+    Response: {"status": "ok", "requests": ..., "batches": ...,
+               "mean_batch_size": ...}
+
+Usage:
+    python src/prediction_server.py --port 8000 --max-batch-size 64 --max-wait-ms 0
+Load test: src/benchmarks/load_test.py
+"""
+
+import argparse
+import configparser
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from engines import ENGINES, PRECISIONS, Predictor, load_predictor
+from labels import get_preds_and_m_probs
+from logger import Logger
+
+
+SHOW_LOG = True
+CONFIG_NAME = 'config.ini'
+MODEL_NAME = 'mlp'
+N_FREQS = 60
+# Seconds a request waits for its prediction before failing.
+REQUEST_TIMEOUT = 10.0
+# Largest accepted /predict body, bytes. A request is ~1.5 KB.
+MAX_BODY_SIZE = 64 * 1024
+
+
+class MicroBatcher:
+    """
+    Groups single-row predictions into batches predicted by a
+    background thread.
+
+    Arguments:
+    ----------
+    model: Predictor
+    max_batch_size: int
+        Maximum number of rows in a batch.
+    max_wait_ms: float
+        Maximum time the first row of a batch waits for more rows.
+    """
+    def __init__(self, model: Predictor, max_batch_size: int = 64,
+                 max_wait_ms: float = 0.0) -> None:
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.requests: queue.Queue = queue.Queue()
+        self.n_requests = 0
+        self.n_batches = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run,
+                                       name="micro-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, features: np.ndarray) -> Future:
+        """
+        Schedules prediction of one row of features.
+        The future's result is a (prediction, m_probability) tuple.
+        """
+        future: Future = Future()
+        self.requests.put((features, future))
+        return future
+
+    def predict(self, features: np.ndarray,
+                timeout: Optional[float] = REQUEST_TIMEOUT) -> Tuple[str, float]:
+        return self.submit(features).result(timeout)
+
+    def _get_batch(self) -> List[Tuple[np.ndarray, Future]]:
+        try:
+            batch = [self.requests.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                if timeout > 0:
+                    batch.append(self.requests.get(timeout=timeout))
+                else:
+                    # Rows that are already queued are taken without waiting.
+                    batch.append(self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while not self.stopped.is_set():
+            batch = self._get_batch()
+            if not batch:
+                continue
+            # Requests whose futures were cancelled are skipped.
+            batch = [(features, future) for features, future in batch
+                     if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            futures = [future for _, future in batch]
+            try:
+                outs_np = self.model.predict_proba(
+                    np.stack([features for features, _ in batch]))
+                preds, m_probs = get_preds_and_m_probs(outs_np)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, pred, m_prob in zip(futures, preds, m_probs):
+                future.set_result((str(pred), float(m_prob)))
+            self.n_requests += len(futures)
+            self.n_batches += 1
+
+    def get_stats(self) -> Dict[str, float]:
+        return {
+            'requests': self.n_requests,
+            'batches': self.n_batches,
+            'mean_batch_size': self.n_requests / max(self.n_batches, 1),
+        }
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+
+def parse_request(body: bytes) -> Tuple[np.ndarray, Optional[int]]:
+    """
+    Returns features and optional id of a /predict request.
+    Raises ValueError if the request is malformed.
+    """
+    try:
+        request = json.loads(body)
+        features = np.asarray(request['frequencies'], dtype=np.float32)
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Expected {{\"frequencies\": [{N_FREQS} numbers]}}: {e}")
+    if features.shape != (N_FREQS,):
+        raise ValueError(f"Expected {N_FREQS} frequencies, " \
+                         f"got shape {features.shape}")
+    frequencies_id = request.get('id')
+    # bool is a subclass of int, but JSON true/false are not ids.
+    if frequencies_id is not None and (isinstance(frequencies_id, bool)
+                                       or not isinstance(frequencies_id, int)):
+        raise ValueError("id should be an integer")
+    return features, frequencies_id
+
+
+class PredictionRequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so clients don't open a connection per request.
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately. With Nagle's algorithm
+    # the body would wait for the client's delayed ACK (~40 ms).
+    disable_nagle_algorithm = True
+    # Set by `create_server`.
+    batcher: MicroBatcher
+    logger: Logger
+
+    def _send_json(self, status: int, payload: Dict) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error_and_close(self, status: int, error: str) -> None:
+        # The body is left unread, so the connection can't be reused.
+        self.close_connection = True
+        self._send_json(status, {'error': error})
+
+    def _read_body(self) -> Optional[bytes]:
+        """
+        Reads the request body of Content-Length bytes. Responds with
+        411, 400 or 413 and returns None if the length is missing,
+        not a non-negative integer or larger than MAX_BODY_SIZE.
+        """
+        content_length = self.headers.get('Content-Length')
+        if content_length is None:
+            self._send_error_and_close(411, "Content-Length is required")
+            return None
+        content_length = content_length.strip()
+        if not (content_length.isascii() and content_length.isdigit()):
+            self._send_error_and_close(
+                400, f"Invalid Content-Length '{content_length}'")
+            return None
+        if int(content_length) > MAX_BODY_SIZE:
+            self._send_error_and_close(
+                413, f"Request body is larger than {MAX_BODY_SIZE} bytes")
+            return None
+        return self.rfile.read(int(content_length))
+
+    def do_GET(self) -> None:
+        if self.path != '/health':
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+            return
+        self._send_json(200, {'status': 'ok', **self.batcher.get_stats()})
+
+    def do_POST(self) -> None:
+        if self.path != '/predict':
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+            return
+        body = self._read_body()
+        if body is None:
+            return
+        try:
+            features, frequencies_id = parse_request(body)
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        try:
+            prediction, m_probability = self.batcher.predict(features)
+        except Exception:
+            self.logger.exception("Prediction failed")
+            self._send_json(500, {'error': "Prediction failed"})
+            return
+        response = {'prediction': prediction, 'm_probability': m_probability}
+        if frequencies_id is not None:
+            response = {'frequencies_id': frequencies_id, **response}
+        self._send_json(200, response)
+
+    def log_message(self, format: str, *args) -> None:
+        # Access log per request at info level would cost more than
+        # the prediction itself.
+        self.logger.debug(format, *args)
+
+
+def create_server(host: str, port: int, batcher: MicroBatcher,
+                  logger: Logger) -> ThreadingHTTPServer:
+    handler = type('Handler', (PredictionRequestHandler,),
+                   {'batcher': batcher, 'logger': logger})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=64,
+                        help="Maximum number of requests predicted at once.")
+    parser.add_argument("--max-wait-ms", type=float, default=0.0,
+                        help="Maximum time a request waits for others " \
+                            "to fill its batch.")
+    parser.add_argument("--engine", type=str, default='torch', choices=ENGINES)
+    parser.add_argument("--precision", type=str, default='fp32',
+                        choices=PRECISIONS)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logger_getter = Logger(SHOW_LOG)
+    logger = logger_getter.get_logger(__name__)
+
+    config = configparser.ConfigParser()
+    config.read(CONFIG_NAME)
+
+    args = parse_args()
+
+    model = load_predictor(config, MODEL_NAME, logger, args.engine,
+                           args.precision)
+    batcher = MicroBatcher(model, args.max_batch_size, args.max_wait_ms)
+    server = create_server(args.host, args.port, batcher, logger)
+    logger.info(f"Serving predictions on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.stop()
+        logger.info(f"Stopped. {batcher.get_stats()}")
@@ -1,8 +1,10 @@
 import os
 import argparse
+import struct
 import sys
 import traceback
 import configparser
+from collections import Counter
 from typing import Dict, Tuple, Optional, Any
 import logging  # To set logging level
 
@@ -10,11 +12,16 @@ import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split
 
+from labels import LABEL2I
 from logger import Logger
 
 
 CONFIG_NAME = "config.ini"
 SCRIPT_PARAMS_NAME = "PREPARE_DATA_PARAMETERS"
+# npy: features as float32, labels as int64 indices (see labels.py).
+#   SonarDataset memory-maps these files.
+# csv: text export, e.g. for inspection or other tools.
+SPLIT_FORMATS = ["npy", "csv"]
 
 
 class ArgsParser:
@@ -40,6 +47,9 @@ class ArgsParser:
 
         default_args_dict["random_state"] = int(default_args_dict["random_state"])
         default_args_dict["test_size"] = float(default_args_dict["test_size"])
+        if "streaming_chunk_size" in default_args_dict:
+            default_args_dict["streaming_chunk_size"] = int(
+                default_args_dict["streaming_chunk_size"])
 
         return default_args_dict
 
@@ -57,8 +67,7 @@ class ArgsParser:
         for arg in vars(args):
             config[SCRIPT_PARAMS_NAME][arg] = str(getattr(args, arg))
         
-        with open(CONFIG_NAME, 'w') as configfile:
-            config.write(configfile)
+        write_config(config)
 
     def _check_all_args_non_null(self, args):
         """
@@ -92,6 +101,19 @@ class ArgsParser:
             type=str,
             default="DEBUG",
             choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"])
+        parser.add_argument(
+            "--split_format",
+            "-f",
+            type=str,
+            default="npy",
+            choices=SPLIT_FORMATS)
+        parser.add_argument(
+            "--streaming_chunk_size",
+            "-c",
+            type=int,
+            default=0,
+            help="If > 0, the dataset is split in chunks of this many " \
+                "rows without loading it into memory.")
 
         if os.path.exists(CONFIG_NAME):
             defaults = self.get_default_args()
@@ -110,15 +132,135 @@ class ArgsParser:
         return args
 
 
+def write_config(config: configparser.ConfigParser,
+                 config_path: str = CONFIG_NAME) -> None:
+    """
+    Writes the config atomically, so that processes running in parallel
+    (see pipeline.py) never read a partially written file.
+    """
+    tmp_path = config_path + '.tmp'
+    with open(tmp_path, 'w') as configfile:
+        config.write(configfile)
+    os.replace(tmp_path, config_path)
+
+
+def splitmix64(x: np.ndarray) -> np.ndarray:
+    """Seedless 64-bit hash (SplitMix64 finalizer) of uint64 values."""
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+class SplitPartWriter:
+    """
+    Writes one part of the split (X_train, X_test, y_train or y_test)
+    chunk by chunk, so it never has to be in memory as a whole.
+
+    The file is written under a temporary name and replaces the previous
+    version on close: datasets that memory-mapped the previous version
+    keep reading it instead of crashing.
+
+    Arguments:
+    ----------
+    data_kind: str
+        One of X_train, X_test, y_train, y_test.
+    save_path: str
+        Directory to save the file to.
+    split_format: str
+        One of SPLIT_FORMATS.
+    """
+    # The .npy header has a fixed size, so that it can be written
+    # over the placeholder when the number of rows is known.
+    NPY_HEADER_SIZE = 128
+
+    def __init__(self, data_kind: str, save_path: str,
+                 split_format: str = "npy") -> None:
+        if split_format not in SPLIT_FORMATS:
+            raise ValueError(f"Unknown split format {split_format}. " \
+                             f"Expected one of {SPLIT_FORMATS}")
+        self.is_labels = data_kind.startswith('y')
+        self.split_format = split_format
+        self.file_path = os.path.join(save_path, f'{data_kind}.{split_format}')
+        self.tmp_path = self.file_path + '.tmp'
+        self.dtype = np.dtype(np.int64 if self.is_labels else np.float32)
+        self.n_rows = 0
+        self.row_shape: Tuple[int, ...] = ()
+        self.file = open(self.tmp_path, 'wb')
+        if split_format == "npy":
+            self.file.write(b'\0' * self.NPY_HEADER_SIZE)
+
+    def write(self, data: np.ndarray) -> None:
+        """Appends rows: features or string labels."""
+        if self.split_format == "npy":
+            if self.is_labels:
+                data = np.array([LABEL2I[label] for label in data.ravel()],
+                                dtype=self.dtype)
+            else:
+                data = np.ascontiguousarray(data, dtype=self.dtype)
+            self.row_shape = data.shape[1:]
+            self.file.write(data.tobytes())
+        else:
+            fmt = '%f'
+            if data.dtype == 'object':
+                fmt = '%s'
+            np.savetxt(self.file, data, delimiter=',', fmt=fmt)
+        self.n_rows += len(data)
+
+    def _write_npy_header(self) -> None:
+        header = repr({'descr': np.lib.format.dtype_to_descr(self.dtype),
+                       'fortran_order': False,
+                       'shape': (self.n_rows, *self.row_shape)})
+        # Magic string, version 1.0, header length and the header
+        # padded with spaces and terminated by a newline.
+        header = header.ljust(self.NPY_HEADER_SIZE - 11) + '\n'
+        self.file.seek(0)
+        self.file.write(b'\x93NUMPY\x01\x00'
+                        + struct.pack('<H', len(header))
+                        + header.encode('latin1'))
+
+    def close(self) -> str:
+        """Finishes the file and returns its path."""
+        if self.split_format == "npy":
+            self._write_npy_header()
+        self.file.close()
+        os.replace(self.tmp_path, self.file_path)
+        return self.file_path
+
+
+def save_split_part(data: np.ndarray, data_kind: str, save_path: str,
+                    split_format: str = "npy") -> str:
+    """
+    Saves one part of the split and returns the path of the file.
+
+    Arguments:
+    ----------
+    data: np.ndarray
+        Features (X_*) or string labels (y_*).
+    data_kind: str
+        One of X_train, X_test, y_train, y_test.
+    save_path: str
+        Directory to save the file to.
+    split_format: str
+        One of SPLIT_FORMATS.
+    """
+    writer = SplitPartWriter(data_kind, save_path, split_format)
+    writer.write(data)
+    return writer.close()
+
+
 # That's a class because there might be a more
 # sophisticated data obtain pipeline.
 class DataPreparer:
-    def __init__(self, orig_data_filename, save_path, logger) -> None:
+    def __init__(self, orig_data_filename, save_path, logger,
+                 config_path: str = CONFIG_NAME) -> None:
         
         self.logger = logger
 
         self.orig_data_filename = orig_data_filename
         self.save_path = save_path
+        # Config file the paths of the split files are saved to.
+        self.config_path = config_path
         
         self.logger.info(f"Initialized DataPreparer with " \
                          f"orig_data_filename={orig_data_filename}, " \
@@ -128,7 +270,8 @@ class DataPreparer:
     def split_data(self,
                    df: Optional[pd.DataFrame] = None,
                    test_size: float = 0.25,
-                   random_state: int = 42) -> Tuple[np.ndarray, ...]:
+                   random_state: int = 42,
+                   split_format: str = "npy") -> Tuple[np.ndarray, ...]:
         """
         Splits dataset into train and test sets.
 
@@ -149,11 +292,13 @@ class DataPreparer:
             Random state for reproducibility
         save_path: str
             Path to save splitted data as files:
-                Path/X_train.csv,
-                Path/X_test.csv,
-                Path/y_train.csv,
-                Path/y_test.csv
+                Path/X_train.{split_format},
+                Path/X_test.{split_format},
+                Path/y_train.{split_format},
+                Path/y_test.{split_format}
             If None, data is not saved.
+        split_format: str
+            "npy" (binary, memory-mapped by SonarDataset) or "csv".
         
         Returns:
         --------
@@ -164,9 +309,9 @@ class DataPreparer:
         y_test: np.ndarray
         """
         config = configparser.ConfigParser()
-        config.read(CONFIG_NAME)
+        config.read(self.config_path)
         if "SPLIT_DATA" not in config:
-            self.logger.info(f"{'SPLIT_DATA'} not in {CONFIG_NAME}")
+            self.logger.info(f"{'SPLIT_DATA'} not in {self.config_path}")
             config["SPLIT_DATA"] = {}
 
         try:
@@ -192,12 +337,11 @@ class DataPreparer:
         
         for data, data_kind in zip([X_train, X_test, y_train, y_test], 
                             ['X_train', 'X_test', 'y_train', 'y_test']):
+            file_path = os.path.join(self.save_path,
+                                     f'{data_kind}.{split_format}')
             try:
-                file_path = os.path.join(self.save_path, f'{data_kind}.csv')
-                fmt = '%f'
-                if data.dtype == 'object':
-                    fmt = '%s'
-                np.savetxt(file_path, data, delimiter=',', fmt=fmt)
+                file_path = save_split_part(data, data_kind, self.save_path,
+                                            split_format)
                 self.logger.info(f"Saved {data_kind} to {file_path}")
                 # add data_kind: file_path to config 
                 config["SPLIT_DATA"][data_kind] = file_path
@@ -207,14 +351,108 @@ class DataPreparer:
                 self.logger.error(traceback.format_exc())
                 sys.exit(1)
         
-        with open(CONFIG_NAME, 'w') as configfile:
-            config.write(configfile)
+        write_config(config, self.config_path)
 
         self.logger.info("Train and test data are ready")                
 
         return X_train, X_test, y_train, y_test
 
 
+    def split_data_streaming(self,
+                             test_size: float = 0.25,
+                             random_state: int = 42,
+                             chunk_size: int = 100_000,
+                             split_format: str = "npy"
+                             ) -> Dict[str, Counter]:
+        """
+        Splits dataset into train and test sets without loading it into
+        memory: the source is read in chunks of `chunk_size` rows and
+        every chunk is appended to the split files. Memory doesn't depend
+        on the size of the dataset.
+
+        Classes are stratified separately. After every chunk the number
+        of test rows of a class is round(test_size * rows of the class
+        read so far), so it differs from the exact fraction by at most 1.
+        Within a chunk, the test rows of a class are the ones with the
+        smallest hash of (random_state, row number). The split is
+        reproducible for the same file, random_state and chunk_size.
+
+        Arguments:
+        ----------
+        test_size: float
+            Fraction of the dataset to be used as test set
+        random_state: int
+            Seed of the row hash
+        chunk_size: int
+            Number of rows read at once
+        split_format: str
+            "npy" (binary, memory-mapped by SonarDataset) or "csv".
+
+        Returns:
+        --------
+        dict: {'train': Counter, 'test': Counter}
+            Number of rows of every class in each set.
+        """
+        config = configparser.ConfigParser()
+        config.read(self.config_path)
+        if "SPLIT_DATA" not in config:
+            self.logger.info(f"{'SPLIT_DATA'} not in {self.config_path}")
+            config["SPLIT_DATA"] = {}
+
+        try:
+            reader = pd.read_csv(self.orig_data_filename, header=None,
+                                 chunksize=chunk_size)
+        except FileNotFoundError:
+            self.logger.error(f"File {self.orig_data_filename} not found")
+            self.logger.error(traceback.format_exc())
+            sys.exit(1)
+
+        data_kinds = ['X_train', 'X_test', 'y_train', 'y_test']
+        writers = {data_kind: SplitPartWriter(data_kind, self.save_path,
+                                              split_format)
+                   for data_kind in data_kinds}
+        seed = splitmix64(np.array([random_state], dtype=np.uint64))
+        counts = {'train': Counter(), 'test': Counter()}
+        n_read = Counter()
+        n_rows = 0
+        for chunk in reader:
+            X = chunk.iloc[:, :-1].values
+            y = chunk.iloc[:, -1].values.reshape(-1, 1)
+            keys = splitmix64(
+                np.arange(n_rows, n_rows + len(chunk), dtype=np.uint64) ^ seed)
+            is_test = np.zeros(len(chunk), dtype=bool)
+            for label in pd.unique(y.ravel()):
+                index = np.flatnonzero(y.ravel() == label)
+                n_read[label] += len(index)
+                n_test = (int(np.floor(n_read[label] * test_size + 0.5))
+                          - counts['test'][label])
+                if n_test > 0:
+                    smallest = np.argpartition(keys[index], n_test - 1)[:n_test]
+                    is_test[index[smallest]] = True
+                counts['test'][label] += n_test
+                counts['train'][label] += len(index) - n_test
+
+            writers['X_train'].write(X[~is_test])
+            writers['X_test'].write(X[is_test])
+            writers['y_train'].write(y[~is_test])
+            writers['y_test'].write(y[is_test])
+            n_rows += len(chunk)
+            self.logger.debug(f"Split {n_rows} rows")
+
+        for data_kind, writer in writers.items():
+            file_path = writer.close()
+            self.logger.info(f"Saved {data_kind} to {file_path}")
+            config["SPLIT_DATA"][data_kind] = file_path
+
+        write_config(config, self.config_path)
+
+        self.logger.info(f"Train and test data are ready: " \
+                         f"train {dict(counts['train'])}, " \
+                         f"test {dict(counts['test'])}")
+
+        return counts
+
+
 if __name__ == "__main__":
     logger_getter = Logger(show=True)
     logger = logger_getter.get_logger(__name__)
@@ -226,4 +464,13 @@ if __name__ == "__main__":
     logger.setLevel(numeric_level)
 
     data_preparer = DataPreparer(args.orig_data_filename, args.save_path, logger)
-    data_preparer.split_data(test_size=args.test_size, random_state=args.random_state)
\ No newline at end of file
+    if args.streaming_chunk_size > 0:
+        data_preparer.split_data_streaming(
+            test_size=args.test_size,
+            random_state=args.random_state,
+            chunk_size=args.streaming_chunk_size,
+            split_format=args.split_format)
+    else:
+        data_preparer.split_data(test_size=args.test_size,
+                                 random_state=args.random_state,
+                                 split_format=args.split_format)
\ No newline at end of file
@@ -0,0 +1,285 @@
+"""
+Hyperparameter sweep of MlpSonarModel and its optimizer with
+asynchronous successive halving (ASHA).
+
+Trials are sampled from a search space and trained in a process pool
+in segments between rungs: min_epochs, min_epochs * eta,
+min_epochs * eta^2, ..., max_epochs. When a trial reaches a rung, it
+continues only if its validation metric is among the best 1/eta of
+all trials that reached this rung so far; otherwise it's stopped.
+Decisions don't wait for other trials, so workers are never idle.
+
+Every finished or stopped trial is written to
+`experiments/exp_sweep_{date}_trial_{i}/exp_config.yaml`. Parameters of
+the best trial that reached max_epochs are promoted to the [mlp]
+section of config.ini, where train.py reads them.
+
+Search space (yaml, --search-space), e.g.:
+    hidden_size: {values: [16, 32, 64, 128]}
+    lr: {low: 0.0001, high: 0.1, log: true}
+    epochs is not searched: it's max_epochs.
+
+Usage:
+    python src/sweep.py --n-trials 27 --workers 4 --min-epochs 10 --max-epochs 90 --reduction-factor 3
+"""
+
+import argparse
+import configparser
+import math
+import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import numpy as np
+import yaml
+
+from autotune import init_worker
+from logger import Logger
+from prepare_data import write_config
+
+
+SHOW_LOG = True
+CONFIG_NAME = 'config.ini'
+MODEL_NAME = 'mlp'
+DEFAULT_SEARCH_SPACE = {
+    'hidden_size': {'values': [8, 16, 32, 40, 64, 128]},
+    'lr': {'low': 1e-4, 'high': 1e-1, 'log': True},
+    'optimizer': {'values': ['adam', 'adamw', 'sgd']},
+    'weight_decay': {'values': [0.0, 1e-4, 1e-3, 1e-2]},
+}
+# Metrics of Trainer.history and whether they are minimized.
+METRICS = {'loss': True, 'f1_score': False, 'accuracy': False}
+
+
+def sample_params(search_space: Dict, rng: np.random.Generator) -> Dict:
+    """
+    Samples a value for every parameter. A parameter is either
+    {values: [...]} (uniform choice) or {low, high, log, int}
+    (uniform or log-uniform in [low, high]).
+    """
+    params = {}
+    for name, space in search_space.items():
+        if 'values' in space:
+            value = space['values'][rng.integers(len(space['values']))]
+            # numpy scalars would be dumped to yaml as objects.
+            params[name] = value.item() if hasattr(value, 'item') else value
+            continue
+        low, high = float(space['low']), float(space['high'])
+        if space.get('log', False):
+            value = math.exp(rng.uniform(math.log(low), math.log(high)))
+        else:
+            value = rng.uniform(low, high)
+        params[name] = int(round(value)) if space.get('int', False) else value
+    return params
+
+
+def get_rungs(min_epochs: int, max_epochs: int,
+              reduction_factor: int) -> List[int]:
+    """Epochs at which trials are compared, the last one is max_epochs."""
+    rungs = []
+    epochs = min_epochs
+    while epochs < max_epochs:
+        rungs.append(epochs)
+        epochs *= reduction_factor
+    return rungs + [max_epochs]
+
+
+def is_promoted(value: float, rung_values: List[float],
+                reduction_factor: int, minimize: bool) -> bool:
+    """
+    True if `value` is among the best 1/reduction_factor of
+    `rung_values` (which include it).
+    """
+    ranked = sorted(rung_values, reverse=not minimize)
+    n_promoted = max(1, len(ranked) // reduction_factor)
+    cutoff = ranked[n_promoted - 1]
+    return value <= cutoff if minimize else value >= cutoff
+
+
+def train_segment(trial_id: int, params: Dict, start_epoch: int,
+                  end_epoch: int, checkpoint_path: str,
+                  seed: int) -> Dict[str, float]:
+    """
+    Trains a trial from `start_epoch` (resuming from `checkpoint_path`
+    if > 0) to `end_epoch`, saves the checkpoint and returns the
+    validation metrics of the last epoch. Runs in a worker process.
+    """
+    import torch
+    from model import MlpSonarModel
+    from train import Trainer, get_dataloaders, get_optimizer
+
+    torch.manual_seed(seed + trial_id * 1000)
+    model = MlpSonarModel(input_size=60, hidden_size=params['hidden_size'],
+                          output_size=2)
+    optimizer = get_optimizer(params.get('optimizer', 'adam'),
+                              model.parameters(), params['lr'],
+                              params.get('weight_decay', 0.0))
+    trainer = Trainer(model, optimizer, torch.nn.CrossEntropyLoss(),
+                      get_dataloaders(), device=torch.device('cpu'))
+    if start_epoch > 0:
+        # Including RNG states: the trial continues as if not paused.
+        trainer.load(checkpoint_path)
+    trainer.train(end_epoch - start_epoch)
+    trainer.save(checkpoint_path, blocking=True)
+    return {metric: float(values[-1])
+            for metric, values in trainer.history['val'].items()}
+
+
+def save_trial(exp_dir: str, params: Dict, epochs: int,
+               metrics: Dict[str, float], status: str) -> None:
+    """Writes the trial in the style of functional_test.py experiments."""
+    os.makedirs(exp_dir, exist_ok=True)
+    exp_data = {
+        "model": MODEL_NAME,
+        "model params": {key: str(value) for key, value in
+                         {**params, 'epochs': epochs}.items()},
+        "status": status,
+        "accuracy": str(metrics['accuracy']),
+        "f1_score": str(metrics['f1_score']),
+        "loss": str(metrics['loss']),
+    }
+    with open(os.path.join(exp_dir, "exp_config.yaml"), 'w') as exp_f:
+        yaml.safe_dump(exp_data, exp_f, sort_keys=False)
+
+
+def run_sweep(search_space: Dict, n_trials: int, workers: int,
+              min_epochs: int, max_epochs: int, reduction_factor: int,
+              metric: str, seed: int, exp_path: str,
+              logger) -> List[Dict]:
+    """
+    Runs the sweep and returns a result per trial:
+    {trial, params, epochs, metrics, status}.
+    """
+    import torch.multiprocessing
+
+    minimize = METRICS[metric]
+    rng = np.random.default_rng(seed)
+    trials = [sample_params(search_space, rng) for _ in range(n_trials)]
+    rungs = get_rungs(min_epochs, max_epochs, reduction_factor)
+    rung_values: Dict[int, List[float]] = {rung: [] for rung in rungs}
+    str_date = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+    results = []
+    next_trial = 0
+    running: Dict[Future, Tuple[int, int]] = {}
+    checkpoint_dir = tempfile.mkdtemp(prefix='sweep_')
+
+    def submit(executor, trial_id: int, rung_index: int) -> None:
+        start_epoch = rungs[rung_index - 1] if rung_index > 0 else 0
+        future = executor.submit(
+            train_segment, trial_id, trials[trial_id], start_epoch,
+            rungs[rung_index],
+            os.path.join(checkpoint_dir, f'trial_{trial_id}.pt'), seed)
+        running[future] = (trial_id, rung_index)
+
+    try:
+        with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=torch.multiprocessing.get_context('spawn'),
+                initializer=init_worker, initargs=(1, 1)) as executor:
+            while running or next_trial < n_trials:
+                while len(running) < workers and next_trial < n_trials:
+                    submit(executor, next_trial, 0)
+                    next_trial += 1
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    trial_id, rung_index = running.pop(future)
+                    metrics = future.result()
+                    epochs = rungs[rung_index]
+                    value = metrics[metric]
+                    rung_values[epochs].append(value)
+                    if rung_index == len(rungs) - 1:
+                        status = 'completed'
+                    elif is_promoted(value, rung_values[epochs],
+                                     reduction_factor, minimize):
+                        logger.info(f"Trial {trial_id}: {metric} " \
+                                    f"{value:.4f} at epoch {epochs}, promoted")
+                        submit(executor, trial_id, rung_index + 1)
+                        continue
+                    else:
+                        status = f'stopped at epoch {epochs}'
+                    logger.info(f"Trial {trial_id}: {metric} {value:.4f} " \
+                                f"at epoch {epochs}, {status}")
+                    save_trial(os.path.join(
+                        exp_path, f'exp_sweep_{str_date}_trial_{trial_id}'),
+                        trials[trial_id], epochs, metrics, status)
+                    results.append({'trial': trial_id,
+                                    'params': trials[trial_id],
+                                    'epochs': epochs, 'metrics': metrics,
+                                    'status': status})
+    finally:
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    return sorted(results, key=lambda result: result['trial'])
+
+
+def get_best(results: List[Dict], metric: str) -> Dict:
+    completed = [result for result in results
+                 if result['status'] == 'completed']
+    sign = 1 if METRICS[metric] else -1
+    return min(completed, key=lambda result: sign * result['metrics'][metric])
+
+
+def promote(params: Dict, epochs: int, logger) -> None:
+    """Writes the parameters to config[MODEL_NAME], where train.py reads them."""
+    config = configparser.ConfigParser()
+    config.read(CONFIG_NAME)
+    if MODEL_NAME not in config:
+        config[MODEL_NAME] = {}
+    for key, value in {**params, 'epochs': epochs}.items():
+        config[MODEL_NAME][key] = str(value)
+    write_config(config, CONFIG_NAME)
+    logger.info(f"Promoted {params}, epochs {epochs} to [{MODEL_NAME}] " \
+                f"of {CONFIG_NAME}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--search-space", type=str, default=None,
+                        help="Path to a yaml search space. " \
+                            "DEFAULT_SEARCH_SPACE if not given.")
+    parser.add_argument("--n-trials", type=int, default=27)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--min-epochs", type=int, default=10)
+    parser.add_argument("--max-epochs", type=int, default=90)
+    parser.add_argument("--reduction-factor", type=int, default=3)
+    parser.add_argument("--metric", type=str, default='loss',
+                        choices=list(METRICS),
+                        help="Validation metric trials are compared by.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-promote", action='store_true',
+                        help="Don't write the best parameters to config.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logger_getter = Logger(SHOW_LOG)
+    logger = logger_getter.get_logger(__name__)
+
+    args = parse_args()
+
+    search_space = DEFAULT_SEARCH_SPACE
+    if args.search_space is not None:
+        with open(args.search_space) as f:
+            search_space = yaml.safe_load(f)
+    if 'hidden_size' not in search_space or 'lr' not in search_space:
+        logger.error("Search space should include hidden_size and lr")
+        sys.exit(1)
+
+    exp_path = os.path.join('.', "experiments")
+    results = run_sweep(search_space, args.n_trials, args.workers,
+                        args.min_epochs, args.max_epochs,
+                        args.reduction_factor, args.metric, args.seed,
+                        exp_path, logger)
+
+    total_epochs = sum(result['epochs'] for result in results)
+    logger.info(f"Trained {total_epochs} epochs in total, " \
+                f"{args.n_trials * args.max_epochs} without early stopping")
+    best = get_best(results, args.metric)
+    logger.info(f"Best trial {best['trial']}: {best['params']}, " \
+                f"{best['metrics']}")
+
+    if not args.no_promote:
+        promote(best['params'], best['epochs'], logger)
@@ -1,22 +1,54 @@
 import configparser
 import os
+import random
 import sys
-from typing import Optional, Dict, List
+import time
+from copy import deepcopy
+from typing import Optional, Dict
 
 import numpy as np
-from sklearn.metrics import accuracy_score, f1_score
 import torch
 import torch.nn as nn
 from torch.utils.data import DataLoader
 # import matplotlib.pyplot as plt
 from tqdm import tqdm
 
-from dataset import SonarDataset
+from autotune import get_tuned_value, set_torch_threads
+from checkpointer import AsyncCheckpointer
+from dataset import SonarDataset, TensorBatchLoader
 from logger import Logger
+from metric_accumulators import ConfusionMatrixAccumulator, LossAccumulator
 from model import MlpSonarModel
+from model_registry import save_artifact
+from numpy_model import export_npz
+from prepare_data import write_config
 
 
 CONFIG_NAME = "config.ini"
+MODEL_NAME = 'mlp'
+# Training parameters read from the model's config section
+# (set by sweep.py) and their defaults.
+TRAIN_PARAMS_DEFAULTS = {
+    'hidden_size': 40,
+    'lr': 0.01,
+    'epochs': 80,
+    'optimizer': 'adam',
+    'weight_decay': 0.0,
+    # Early stopping, see Trainer.train. 0 or '' - not used.
+    'patience': 0,
+    'min_delta': 0.0,
+    'target': '',  # e.g. f1_score:0.9,loss:0.4
+    'time_budget': 0.0,
+}
+# Why Trainer.train stopped: all epochs trained or a stopping criterion.
+STOP_REASONS = ['epochs', 'patience', 'target', 'time_budget']
+# Validation metrics recorded by Trainer every epoch, usable as targets.
+TARGET_METRICS = ['accuracy', 'f1_score', 'loss']
+OPTIMIZERS = {
+    'adam': torch.optim.Adam,
+    'adamw': torch.optim.AdamW,
+    'sgd': torch.optim.SGD,
+}
 
 
 class Trainer:
@@ -33,10 +65,11 @@ class Trainer:
         - epoch number 
     - load Trainer states
     - resume training from saved state
+    - stop early (patience, target metrics, time budget) and restore
+      the best weights
 
     
     -other possible features:
-        - early stopping
         - learning rate scheduler
         - logging
         - tensorboard support
@@ -48,22 +81,33 @@ class Trainer:
     optimizer: torch.optim.Optimizer
     criterion: nn.Module
     best_state_save_path: str
-        Path to save Trainer state with the lowest validation loss.
+        Path to save Trainer state with the lowest validation loss
+        (improved by more than `min_delta` of `train`).
     scheduled_state_save_path: str
-        Path to save Trainer state once 'save_period' epoches.
+        Path to save Trainer state once 'save_period' epoches. May
+        contain '{epoch}', e.g. 'checkpoints/epoch_{epoch}.pt', then
+        only the last `keep_checkpoints` of them are kept, including
+        the ones saved before training was resumed.
     save_period: int
         Number of epochs between saving Trainer state
+    keep_checkpoints: int
+        0 - keep all scheduled states.
     log_period: int
         number of epochs between logging
     device: torch.device
         device to train on
+    batch_progress: bool
+        Show a progress bar of batches in every epoch in addition to
+        the bar of epochs.
     """
     def __init__(self, model: nn.Module, optimizer: torch.optim.Optimizer,
                  criterion: nn.Module, dataloaders: Dict[str, DataLoader],
                  best_state_save_path: Optional[str] = None,
                  scheduled_state_save_path: Optional[str] = None,
                  save_period: int = 0, log_period: int = 5,
-                 device: Optional[torch.device] = None
+                 device: Optional[torch.device] = None,
+                 keep_checkpoints: int = 3,
+                 batch_progress: bool = False
                  ) -> None:
         self.model = model
         self.optimizer = optimizer
@@ -71,11 +115,15 @@ class Trainer:
         self.device = device or torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         self.scheduled_state_save_path = scheduled_state_save_path
         self.save_period = save_period
-        if self.save_period != 0 and self.scheduled_state_save_path is not None:
+        if self.save_period != 0 and self.scheduled_state_save_path is None:
             raise ValueError("`scheduled_state_save_path` should be a `str` " \
                              "if `save_period` is other than `0`")
         self.best_state_save_path = best_state_save_path
+        # States are written in a background thread, see `save`.
+        self.checkpointer = AsyncCheckpointer(keep_checkpoints,
+                                              scheduled_state_save_path)
         self.log_period = log_period
+        self.batch_progress = batch_progress
         self.epoch = 0
         self.dataloaders = dataloaders
         self.model = self.model.to(self.device)
@@ -90,19 +138,62 @@ class Trainer:
         }
 
         self.best_val_loss = float('inf')
+        self.best_epoch = -1
+        self.best_model_state = None
 
         # logger_getter = Logger(show=False, filename='trainer.log')
         # self.logger = logger_getter.get_logger(__name__ + '.model_training')
         
 
-    def train(self, n_epochs: int, plot_history: bool = False):
+    def train(self, n_epochs: int, plot_history: bool = False,
+              patience: Optional[int] = None, min_delta: float = 0.0,
+              target: Optional[Dict[str, float]] = None,
+              time_budget: Optional[float] = None,
+              restore_best: bool = False) -> str:
+        """
+        Trains for `n_epochs` or until one of the stopping criteria is
+        met. The criteria are checked after validation of every epoch and
+        can be combined.
+
+        Arguments:
+        ----------
+        n_epochs: int
+        plot_history: bool
+        patience: Optional[int]
+            Stop after `patience` epochs without the validation loss
+            decreasing by more than `min_delta`.
+        min_delta: float
+        target: Optional[Dict[str, float]]
+            Stop when validation metrics reach all the values:
+            {'f1_score': 0.9} means f1_score >= 0.9, loss is reached when
+            it's lower or equal.
+        time_budget: Optional[float]
+            Seconds. Stop if the next epoch, as long as the average epoch
+            so far, would not finish within the budget.
+        restore_best: bool
+            Load the weights of the epoch with the lowest validation
+            loss at the end.
+
+        Returns:
+        --------
+        str: why training stopped, one of STOP_REASONS. It's also saved
+            to `history['stop']` with the number of trained epochs and
+            the best epoch.
+        """
+        unknown_metrics = set(target or {}) - set(TARGET_METRICS)
+        if unknown_metrics:
+            raise ValueError("Unknown target metrics " \
+                             f"{sorted(unknown_metrics)}. " \
+                             f"Expected some of {TARGET_METRICS}")
+        start_time = time.perf_counter()
+        stop_reason = 'epochs'
         epoch_pbar = tqdm(range(n_epochs), position=0, leave = True, desc='Epochs')
-        for _ in epoch_pbar:
+        for i in epoch_pbar:
             epoch_pbar_str = f'epoch {self.epoch} '
+            is_best = False
             for phase in self.phases:
-                running_loss = 0
-                all_lables = []
-                all_pred_logits = []
+                loss_accumulator = LossAccumulator()
+                confusion_accumulator = ConfusionMatrixAccumulator(self.device)
 
                 if phase == 'train':
                     self.model.train()
@@ -110,11 +201,17 @@ class Trainer:
                     self.model.eval()
 
                 with torch.set_grad_enabled(phase == 'train'):
-                    batch_pbar = tqdm(self.dataloaders[phase], position=1, 
-                                      leave = False,
-                                      desc=f"E{self.epoch} {phase.upper()} " \
-                                      "Batches")
-                    for X, y in batch_pbar:
+                    batches = self.dataloaders[phase]
+                    if self.batch_progress:
+                        # Redrawn at most once a second and checked
+                        # every 1% of batches: tqdm costs microseconds
+                        # per update, comparable to a small batch.
+                        batches = tqdm(batches, position=1, leave = False,
+                                       desc=f"E{self.epoch} {phase.upper()} " \
+                                       "Batches",
+                                       mininterval=1.0,
+                                       miniters=max(1, len(batches) // 100))
+                    for X, y in batches:
                         X = X.to(self.device)
                         y = y.to(self.device)
                         out = self.model(X)
@@ -126,15 +223,13 @@ class Trainer:
                             loss.backward()
                             self.optimizer.step()
 
-                        running_loss += loss.item()
-                        all_lables.extend(list(y.flatten().cpu().numpy()))
-                        all_pred_logits.extend(list(out.detach().cpu().numpy()))
-                        
-                        batch_pbar.set_postfix_str(f'loss {loss.item():.3f}')
+                        # No host sync until the end of the phase.
+                        loss_accumulator.update(loss)
+                        confusion_accumulator.update(out, y)
                 
-                avg_loss = running_loss / len(self.dataloaders[phase])
+                avg_loss = loss_accumulator.compute()
 
-                metrics = self.get_metrics(all_lables, all_pred_logits)
+                metrics = confusion_accumulator.compute()
                 metrics['loss'] = avg_loss
 
                 metric_str_list = [f'{m_name}: {m_value:.3f}'
@@ -143,7 +238,8 @@ class Trainer:
 
                 epoch_pbar_str += f' {phase}: {metrics_str}'
 
-                epoch_pbar.set_postfix_str(epoch_pbar_str)
+                # Shown when the bar is redrawn, not on every epoch.
+                epoch_pbar.set_postfix_str(epoch_pbar_str, refresh=False)
 
                 for metric_name, metric_value in metrics.items():
                     self.history[phase][metric_name].append(metric_value)
@@ -153,43 +249,121 @@ class Trainer:
                 #
                 # if self.epoch % self.log_period == 0:
                 #     self.log(epoch_pbar_str)
-                
-                running_loss = 0
 
-                if (self.best_state_save_path 
-                        and phase == 'val' and avg_loss < self.best_val_loss):
+                if (phase == 'val'
+                        and avg_loss < self.best_val_loss - min_delta):
+                    is_best = True
                     self.best_val_loss = avg_loss
-                    self.save(self.best_state_save_path)
-            
-            if self.save_period and self.epoch % self.save_period == 0:
-                self.save(self.save_path)
+                    self.best_epoch = self.epoch
+                    if restore_best:
+                        self.best_model_state = {
+                            name: tensor.detach().clone() for name, tensor
+                            in self.model.state_dict().items()}
             
             if plot_history:
                 self.plot_history()
 
+            # States are saved after the epoch is complete, so that
+            # training resumed from them starts the next one.
             self.epoch += 1
 
-    def save(self, path: str) -> None:
-        # We save whole model and optimizer instead of
-        # state_dicts because this is a robust way
-        # to save trainer state even if we update model
-        # and optimizer.
-        torch.save({
+            if self.best_state_save_path and is_best:
+                self.save(self.best_state_save_path)
+            if self.save_period and self.epoch % self.save_period == 0:
+                self.save(self.scheduled_state_save_path.format(
+                    epoch=self.epoch), rotate=True)
+
+            elapsed = time.perf_counter() - start_time
+            val_metrics = {metric: values[-1] for metric, values
+                           in self.history['val'].items()}
+            if target and all(
+                    val_metrics[metric] <= value if metric == 'loss'
+                    else val_metrics[metric] >= value
+                    for metric, value in target.items()):
+                stop_reason = 'target'
+            elif (patience is not None
+                    and self.epoch - 1 - self.best_epoch >= patience):
+                stop_reason = 'patience'
+            elif (time_budget is not None and i + 1 < n_epochs
+                    and elapsed * (i + 2) / (i + 1) > time_budget):
+                stop_reason = 'time_budget'
+            if stop_reason != 'epochs':
+                break
+
+        if restore_best and self.best_model_state is not None:
+            self.model.load_state_dict(self.best_model_state)
+        self.checkpointer.wait()
+        self.history['stop'] = {
+            'reason': stop_reason,
+            'epochs': self.epoch,
+            'best_epoch': self.best_epoch,
+            'seconds': time.perf_counter() - start_time,
+        }
+        return stop_reason
+
+    def get_state(self) -> Dict:
+        """
+        State to resume training exactly: state_dicts, epoch, history,
+        early stopping state and RNG states (the train DataLoader
+        shuffles with the global torch generator).
+        """
+        state = {
             'epoch': self.epoch,
-            'model': self.model,
-            'optimizer': self.optimizer,
-            'history': self.history
-        }, path)
+            'model': self.model.state_dict(),
+            'optimizer': self.optimizer.state_dict(),
+            'history': self.history,
+            'best_val_loss': self.best_val_loss,
+            'best_epoch': self.best_epoch,
+            'best_model_state': self.best_model_state,
+            'rng': {
+                'torch': torch.get_rng_state(),
+                'numpy': np.random.get_state(),
+                'random': random.getstate(),
+            },
+        }
+        if torch.cuda.is_available():
+            state['rng']['cuda'] = torch.cuda.get_rng_state_all()
+        return state
+
+    def save(self, path: str, rotate: bool = False,
+             blocking: bool = False) -> None:
+        """
+        Saves Trainer state to `path` in a background thread. Only
+        copying tensors to the CPU happens in the calling thread.
+
+        Arguments:
+        ----------
+        path: str
+        rotate: bool
+            Delete the oldest of such states if there are more than
+            `keep_checkpoints`.
+        blocking: bool
+            Wait until the state (and the previously queued ones) is
+            written.
+        """
+        # History lists keep growing, so they're copied too.
+        state = self.get_state()
+        state['history'] = deepcopy(self.history)
+        self.checkpointer.save(state, path, rotate)
+        if blocking:
+            self.checkpointer.wait()
 
     def load(self, path: str) -> None:
-        checkpoint = torch.load(path)
+        checkpoint = torch.load(path, map_location=self.device,
+                                weights_only=False)
         self.epoch = checkpoint['epoch']
-        # self.model.load_state_dict(checkpoint['model_state_dict'])
-        # self.optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
-        self.model = checkpoint['model']
-        self.optimizer = checkpoint['optimizer']
+        self.model.load_state_dict(checkpoint['model'])
+        self.optimizer.load_state_dict(checkpoint['optimizer'])
         self.history = checkpoint['history']
-        self.model.to(self.device)
+        self.best_val_loss = checkpoint['best_val_loss']
+        self.best_epoch = checkpoint['best_epoch']
+        self.best_model_state = checkpoint['best_model_state']
+        rng = checkpoint['rng']
+        torch.set_rng_state(rng['torch'].cpu())
+        np.random.set_state(rng['numpy'])
+        random.setstate(rng['random'])
+        if 'cuda' in rng and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all([state.cpu() for state in rng['cuda']])
     
     # def log(self, metrics_str: str):
     #     # writer.add_scalar('{phase} loss',
@@ -199,16 +373,6 @@ class Trainer:
     #         f"Epoch {self.epoch}. {metrics_str}
     #     )
 
-    def get_metrics(self,
-                    all_lables: List[float],
-                    all_preds_logits: List[np.ndarray[float]]
-                    ) -> Dict[str, float]:
-        preds = np.argmax(all_preds_logits, axis=1)
-        return {
-            'accuracy': accuracy_score(all_lables, preds),
-            'f1_score': f1_score(all_lables, preds, average='macro')
-        }
-    
     def validate(self) -> float:
         """Returns loss on validation dataset"""
         running_loss = 0.0
@@ -234,9 +398,72 @@ class Trainer:
     #     plt.show()
 
 
+def get_train_params(config: configparser.ConfigParser,
+                     model_name: str = MODEL_NAME) -> Dict:
+    """
+    Returns TRAIN_PARAMS_DEFAULTS overridden by values from
+    `config[model_name]`, converted to the types of the defaults.
+    """
+    params = dict(TRAIN_PARAMS_DEFAULTS)
+    if model_name in config:
+        for key, default in TRAIN_PARAMS_DEFAULTS.items():
+            if key in config[model_name]:
+                params[key] = type(default)(config[model_name][key])
+    return params
+
+
+def get_stopping_kwargs(train_params: Dict) -> Dict:
+    """
+    Returns stopping criteria of `Trainer.train` from train parameters.
+    The best weights are restored if any criterion is set.
+    Raises ValueError if `target` is not a comma separated list of
+    metric:value with metrics from TARGET_METRICS.
+    """
+    target = {}
+    for item in filter(None, train_params['target'].split(',')):
+        parts = item.split(':')
+        if len(parts) != 2:
+            raise ValueError(f"Invalid target item '{item.strip()}'. " \
+                             "Expected metric:value, e.g. f1_score:0.9")
+        metric, value = parts[0].strip(), parts[1].strip()
+        if metric not in TARGET_METRICS:
+            raise ValueError(f"Unknown target metric '{metric}'. " \
+                             f"Expected one of {TARGET_METRICS}")
+        try:
+            target[metric] = float(value)
+        except ValueError:
+            raise ValueError(f"Invalid value of target metric '{metric}': " \
+                             f"'{value}'") from None
+    kwargs = {
+        'patience': train_params['patience'] or None,
+        'min_delta': train_params['min_delta'],
+        'target': target or None,
+        'time_budget': train_params['time_budget'] or None,
+    }
+    kwargs['restore_best'] = any(kwargs[key] is not None for key in
+                                 ['patience', 'target', 'time_budget'])
+    return kwargs
+
+
+def get_optimizer(name: str, parameters, lr: float,
+                  weight_decay: float = 0.0) -> torch.optim.Optimizer:
+    if name not in OPTIMIZERS:
+        raise ValueError(f"Unknown optimizer {name}. " \
+                         f"Expected one of {list(OPTIMIZERS)}")
+    kwargs = {'momentum': 0.9} if name == 'sgd' else {}
+    return OPTIMIZERS[name](parameters, lr=lr, weight_decay=weight_decay,
+                            **kwargs)
+
+
 def get_dataloaders(train_batch_size: Optional[int] = None,
-                    test_batch_size: Optional[int] = None
+                    test_batch_size: Optional[int] = None,
+                    tensor_loaders: bool = True
                     ) -> Dict[str, DataLoader]:
+    """
+    Returns loaders of the train and test splits from config. With
+    `tensor_loaders`, TensorBatchLoaders that slice the split tensors
+    instead of DataLoaders that collate rows one by one.
+    """
     config = configparser.ConfigParser()
     config.read(CONFIG_NAME)
        
@@ -248,15 +475,18 @@ def get_dataloaders(train_batch_size: Optional[int] = None,
         config["SPLIT_DATA"]['X_test'],
         config["SPLIT_DATA"]['y_test'])
     
-    # Datasets are tiny currently. 166 lines at most.
-    # Thus using full dataset as a batch.
-    train_batch_size = train_batch_size or len(train_dataset)
+    # Batch sizes found by autotune.py. Otherwise, as datasets are
+    # tiny currently (166 lines at most), full dataset is a batch.
+    train_batch_size = (train_batch_size
+                        or get_tuned_value(config, 'train', 'batch_size')
+                        or len(train_dataset))
     test_batch_size = test_batch_size or len(test_dataset)
 
+    loader_class = TensorBatchLoader if tensor_loaders else DataLoader
     loaders = {
-        'train': DataLoader(
+        'train': loader_class(
             train_dataset, batch_size=train_batch_size, shuffle=True),
-        'val': DataLoader(test_dataset, batch_size=test_batch_size)
+        'val': loader_class(test_dataset, batch_size=test_batch_size)
     }
 
     return loaders
@@ -274,23 +504,37 @@ if __name__ == "__main__":
     logger_getter = Logger(show=True)
     logger = logger_getter.get_logger(__name__)
 
-    model_name = 'mlp'
+    model_name = MODEL_NAME
     
     dataloaders = get_dataloaders()
 
     config = configparser.ConfigParser()
     config.read(CONFIG_NAME)
 
+    set_torch_threads(config, 'train', logger)
+
+
+    # hidden_size, lr, epochs, ... are promoted to config by sweep.py.
+    train_params = get_train_params(config, model_name)
+    logger.info(f"Training parameters: {train_params}")
+    try:
+        # Checked before training: a typo in `target` fails fast.
+        stopping_kwargs = get_stopping_kwargs(train_params)
+    except ValueError:
+        logger.exception(f"Invalid stopping criteria in [{model_name}] " \
+                         f"of {CONFIG_NAME}")
+        sys.exit(1)
 
     model_params = {
         'input_size': 60,
-        'hidden_size': 40,
+        'hidden_size': train_params['hidden_size'],
         'output_size': 2,
     }
     model = MlpSonarModel(**model_params)
 
-    lr = 0.01
-    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    lr = train_params['lr']
+    optimizer = get_optimizer(train_params['optimizer'], model.parameters(),
+                              lr, train_params['weight_decay'])
 
     criterion = torch.nn.CrossEntropyLoss()
 
@@ -302,16 +546,19 @@ if __name__ == "__main__":
         logger.exception("Exception during trainer cretion")
         sys.exit(1)
     
-    n_epoches = 80
+    n_epoches = train_params['epochs']
     
     try:
-        trainer.train(n_epoches)
-        logger.info(f"Training {model_name} complete")
+        trainer.train(n_epoches, **stopping_kwargs)
+        logger.info(f"Training {model_name} complete: " \
+                    f"{trainer.history['stop']}")
     except:
         logger.exception("Exception during training {model_name}")
 
-    config_model_data = model_params.copy()
-    config_model_data['lr'] = lr
+    config_model_data = {**model_params, **train_params}
+    if 'stop' in trainer.history:
+        config_model_data['stop_reason'] = trainer.history['stop']['reason']
+        config_model_data['trained_epochs'] = trainer.history['stop']['epochs']
 
 
     model_optimizer_criterion_dict_name = 'mlp_adam_ce'
@@ -320,17 +567,27 @@ if __name__ == "__main__":
     model_optimizer_criterion_dict = {
         'model': model,
         'criterion': criterion,
-        'optimier': optimizer
+        'optimizer': optimizer
     }
     torch.save(model_optimizer_criterion_dict, save_path)
 
     config_model_data['model_optimizer_loss_dict_path'] = save_path
 
+    # state_dict + config artifact used by model.load_model.
+    model_path = os.path.join(expirements_dir, model_name + '.pt')
+    save_artifact(model, model_params, model_path)
+    config_model_data['model_path'] = model_path
+
+    # Weights for the torch-free numpy inference engine.
+    numpy_model_path = os.path.join(expirements_dir, model_name + '.npz')
+    export_npz(model, numpy_model_path)
+    config_model_data['numpy_model_path'] = numpy_model_path
+
     config[model_name] = config_model_data
 
-    with open(CONFIG_NAME, 'w') as configfile:
-            config.write(configfile)
+    write_config(config, CONFIG_NAME)
     
-    logger.info(f"Saved trained model and other artifacts to {save_path}")
+    logger.info(f"Saved trained model and other artifacts to {save_path}, " \
+                f"{model_path} and {numpy_model_path}")
 
     # trainer.plot_history()
@@ -0,0 +1,60 @@
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import configparser
+import logging
+import unittest
+
+import torch
+
+from autotune import (AUTOTUNE_SECTION, filter_converging, get_tuned_value,
+                      select_best, set_torch_threads)
+
+
+def make_result(samples_per_second, intra_op_threads, inter_op_threads=1):
+    return {'batch_size': 64,
+            'intra_op_threads': intra_op_threads,
+            'inter_op_threads': inter_op_threads,
+            'samples_per_second': samples_per_second}
+
+
+class TestAutotune(unittest.TestCase):
+
+    def test_select_best_prefers_fewer_threads(self):
+        """
+        Checks that fewer threads win if they are within tolerance
+        of the fastest setting, and the fastest one wins otherwise.
+        """
+        results = [make_result(1000, 4), make_result(980, 2),
+                   make_result(900, 1)]
+        self.assertEqual(select_best(results, 0.05)['intra_op_threads'], 2)
+        self.assertEqual(select_best(results, 0.0)['intra_op_threads'], 4)
+        self.assertEqual(select_best(results, 0.5)['intra_op_threads'], 1)
+
+    def test_filter_converging(self):
+        results = [{**make_result(1000, 1), 'batch_size': 16, 'val_loss': 0.3},
+                   {**make_result(3000, 1), 'batch_size': 256, 'val_loss': 0.5}]
+        self.assertEqual([result['batch_size'] for result in
+                          filter_converging(results, 0.4, 0.05)], [16])
+        self.assertEqual(len(filter_converging(results, 0.5, 0.0)), 2)
+        self.assertEqual(filter_converging(results, 0.2, 0.05), [])
+
+    def test_get_tuned_value(self):
+        config = configparser.ConfigParser()
+        self.assertIsNone(get_tuned_value(config, 'train', 'batch_size'))
+        config[AUTOTUNE_SECTION] = {'train_batch_size': '32'}
+        self.assertEqual(get_tuned_value(config, 'train', 'batch_size'), 32)
+        self.assertIsNone(get_tuned_value(config, 'inference', 'batch_size'))
+
+    def test_set_torch_threads(self):
+        n_threads = torch.get_num_threads()
+        config = configparser.ConfigParser()
+        config[AUTOTUNE_SECTION] = {'inference_intra_op_threads': '1'}
+        try:
+            set_torch_threads(config, 'inference', logging.getLogger())
+            self.assertEqual(torch.get_num_threads(), 1)
+        finally:
+            torch.set_num_threads(n_threads)
+
+
+if __name__ == "__main__":
+    unittest.main()
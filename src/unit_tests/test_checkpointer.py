@@ -0,0 +1,82 @@
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import torch
+
+import checkpointer as checkpointer_module
+from checkpointer import AsyncCheckpointer
+
+
+class TestAsyncCheckpointer(unittest.TestCase):
+
+    def test_snapshot_and_rotation(self):
+        checkpointer = AsyncCheckpointer(keep_last=2)
+        weights = torch.zeros(3)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for i in range(4):
+                weights += 1
+                checkpointer.save({'weights': weights, 'i': i},
+                                  os.path.join(tmp_dir, f'{i}.pt'), rotate=True)
+            checkpointer.save({'i': 'best'}, os.path.join(tmp_dir, 'best.pt'))
+            checkpointer.wait()
+            self.assertEqual(sorted(os.listdir(tmp_dir)),
+                             ['2.pt', '3.pt', 'best.pt'])
+            # Saved values are those at the time of `save`.
+            state = torch.load(os.path.join(tmp_dir, '2.pt'))
+            torch.testing.assert_close(state['weights'], torch.full((3,), 3.))
+
+    def test_rotation_after_restart(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pattern = os.path.join(tmp_dir, 'epoch_{epoch}.pt')
+            for epoch in [2, 10, 4]:
+                torch.save({}, pattern.format(epoch=epoch))
+            # Not a checkpoint of the pattern.
+            torch.save({}, os.path.join(tmp_dir, 'epoch_best.pt'))
+            checkpointer = AsyncCheckpointer(keep_last=2, path_pattern=pattern)
+            checkpointer.save({}, pattern.format(epoch=12), rotate=True)
+            checkpointer.wait()
+            self.assertEqual(sorted(os.listdir(tmp_dir)),
+                             ['epoch_10.pt', 'epoch_12.pt', 'epoch_best.pt'])
+
+    def test_save_blocks_when_queue_is_full(self):
+        release = threading.Event()
+        save_atomic = checkpointer_module.save_atomic
+
+        def slow_save_atomic(obj, path):
+            release.wait()
+            save_atomic(obj, path)
+
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch.object(checkpointer_module, 'save_atomic',
+                                  slow_save_atomic):
+            checkpointer = AsyncCheckpointer(max_queued=1)
+            # The first state is taken by the writer, the second is queued.
+            checkpointer.save({}, os.path.join(tmp_dir, '0.pt'))
+            checkpointer.save({}, os.path.join(tmp_dir, '1.pt'))
+            third = threading.Thread(target=checkpointer.save, args=(
+                {}, os.path.join(tmp_dir, '2.pt')))
+            third.start()
+            third.join(0.2)
+            self.assertTrue(third.is_alive())
+            release.set()
+            third.join(5)
+            self.assertFalse(third.is_alive())
+            checkpointer.wait()
+            self.assertEqual(sorted(os.listdir(tmp_dir)),
+                             ['0.pt', '1.pt', '2.pt'])
+
+    def test_error_is_raised(self):
+        checkpointer = AsyncCheckpointer()
+        checkpointer.save({}, os.path.join('no_such_dir', 'state.pt'))
+        with self.assertRaises(RuntimeError):
+            checkpointer.wait()
+        # The error is raised once.
+        checkpointer.wait()
+
+
+if __name__ == "__main__":
+    unittest.main()
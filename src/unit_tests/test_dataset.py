@@ -2,10 +2,13 @@ import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
 
 import unittest
 import configparser
+import tempfile
 
+import numpy as np
 import torch
 
-from dataset import SonarDataset
+from dataset import SonarDataset, TensorBatchLoader, load_split
+from prepare_data import save_split_part
 
 
 CONFIG_PATH = "config.ini"
@@ -44,8 +47,58 @@ class TestDataset(unittest.TestCase):
                 shapes.add((X.shape, y.shape))
         
         self.assertEqual(len(shapes), 1)
-        
-        
+
+    def test_tensor_batch_loader_same_as_dataloader(self):
+        loaders = [
+            TensorBatchLoader(self.train_dataset, batch_size=50),
+            torch.utils.data.DataLoader(self.train_dataset, batch_size=50),
+        ]
+        self.assertEqual(len(loaders[0]), len(loaders[1]))
+        for (X, y), (X_expected, y_expected) in zip(*loaders):
+            torch.testing.assert_close(X, X_expected)
+            torch.testing.assert_close(y, y_expected)
+
+    def test_tensor_batch_loader_shuffle(self):
+        loader = TensorBatchLoader(self.train_dataset, batch_size=50,
+                                   shuffle=True, drop_last=True)
+        n_rows = len(self.train_dataset)
+        self.assertEqual(len(loader), n_rows // 50)
+        batches = list(loader)
+        self.assertEqual(len(batches), n_rows // 50)
+        # Rows are permuted, not repeated.
+        X = torch.cat([X for X, _ in batches])
+        self.assertEqual(len(torch.unique(X, dim=0)), len(X))
+        self.assertEqual(len(X), n_rows // 50 * 50)
+
+
+class TestSplitFormats(unittest.TestCase):
+    """Builds its own splits, doesn't depend on config.ini."""
+
+    def test_npy_and_csv_splits_are_same(self):
+        rng = np.random.default_rng(0)
+        X = rng.random((20, 60)).round(6)
+        y = np.array(['R', 'M'], dtype=object)[rng.integers(0, 2, (20, 1))]
+        with tempfile.TemporaryDirectory() as save_path:
+            datasets = {}
+            for split_format in ['npy', 'csv']:
+                save_path_format = os.path.join(save_path, split_format)
+                os.mkdir(save_path_format)
+                datasets[split_format] = SonarDataset(
+                    save_split_part(X, 'X_train', save_path_format, split_format),
+                    save_split_part(y, 'y_train', save_path_format, split_format))
+            torch.testing.assert_close(datasets['npy'].X, datasets['csv'].X)
+            self.assertTrue(torch.equal(datasets['npy'].y, datasets['csv'].y))
+            self.assertEqual(datasets['npy'].get_classes_distribution(),
+                             datasets['csv'].get_classes_distribution())
+
+            # npy splits are memory-mapped and wrapped without a copy.
+            X_mmap, _ = load_split(os.path.join(save_path, 'npy', 'X_train.npy'),
+                                   os.path.join(save_path, 'npy', 'y_train.npy'))
+            self.assertIsInstance(X_mmap, np.memmap)
+            self.assertEqual(torch.as_tensor(X_mmap, dtype=torch.float32).data_ptr(),
+                             X_mmap.ctypes.data)
+            del X_mmap, datasets
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,65 @@
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import struct
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from db_utils import (rows_to_copy_binary, rows_to_copy_csv,
+                      PGCOPY_HEADER, PGCOPY_TRAILER)
+
+
+COLUMN_TYPES = ['integer', 'text', 'double precision']
+
+
+class TestCopySerialization(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.data_df = pd.DataFrame({
+            'frequencies_id': np.arange(1, 4),
+            'prediction': ['M', 'R', 'M'],
+            'm_probability': np.array([0.9, 0.1, 0.75], dtype=np.float32),
+        })
+
+    def test_binary_layout(self):
+        """
+        Checks the first tuple of a binary COPY payload field by field.
+        """
+        payload = rows_to_copy_binary(self.data_df, COLUMN_TYPES)
+        self.assertTrue(payload.startswith(PGCOPY_HEADER))
+        self.assertTrue(payload.endswith(PGCOPY_TRAILER))
+
+        first_tuple = payload[len(PGCOPY_HEADER):][:2 + 8 + 5 + 12]
+        n_fields, id_len, id_value = struct.unpack('!hii', first_tuple[:10])
+        pred_len, pred_value = struct.unpack('!ic', first_tuple[10:15])
+        prob_len, prob_value = struct.unpack('!id', first_tuple[15:])
+
+        self.assertEqual((n_fields, id_len, id_value), (3, 4, 1))
+        self.assertEqual((pred_len, pred_value), (1, b'M'))
+        self.assertEqual(prob_len, 8)
+        self.assertAlmostEqual(prob_value, 0.9, places=6)
+
+    def test_binary_fast_path_matches_row_by_row(self):
+        """
+        Checks that variable-width text (row-by-row path) and fixed-width
+        text (numpy path) give the same encoding for the shared rows.
+        """
+        fixed = rows_to_copy_binary(self.data_df, COLUMN_TYPES)
+
+        variable_df = pd.concat([self.data_df, pd.DataFrame({
+            'frequencies_id': [4], 'prediction': ['MR'],
+            'm_probability': np.array([0.5], dtype=np.float32)})])
+        variable = rows_to_copy_binary(variable_df, COLUMN_TYPES)
+
+        self.assertEqual(fixed[:-len(PGCOPY_TRAILER)],
+                         variable[:len(fixed) - len(PGCOPY_TRAILER)])
+
+    def test_csv(self):
+        lines = rows_to_copy_csv(self.data_df).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[1].split(',')[:2], ['2', 'R'])
+
+
+if __name__ == "__main__":
+    unittest.main()
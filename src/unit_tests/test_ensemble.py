@@ -0,0 +1,85 @@
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import tempfile
+import unittest
+from copy import deepcopy
+
+import numpy as np
+from sklearn.metrics import accuracy_score, f1_score
+import torch
+
+from ensemble import (EnsembleTrainer, get_kfold_masks, stack_models,
+                      train_sequentially)
+from model import MlpSonarModel
+from model_registry import load_artifact, save_artifact
+from train import get_optimizer
+
+
+class TestEnsemble(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.X = rng.random((90, 60), dtype=np.float32)
+        self.y = rng.integers(0, 2, 90)
+        torch.manual_seed(0)
+        self.models = [MlpSonarModel(hidden_size=8) for _ in range(3)]
+
+    def test_kfold_masks(self):
+        train_masks, val_masks = get_kfold_masks(self.y, 3)
+        self.assertEqual(train_masks.shape, (3, 90))
+        np.testing.assert_array_equal(val_masks.sum(axis=0), np.ones(90))
+        np.testing.assert_array_equal(train_masks, ~val_masks)
+
+    def test_same_as_separate_trainers(self):
+        train_masks, val_masks = get_kfold_masks(self.y, 3)
+        data = {'train': (self.X, self.y, train_masks),
+                'val': (self.X, self.y, val_masks)}
+        train_params = {'lr': 0.01, 'epochs': 5, 'optimizer': 'adam',
+                        'weight_decay': 0.01}
+
+        separate_models = [deepcopy(model) for model in self.models]
+        histories = train_sequentially(separate_models, data, train_params,
+                                       batch_size=None)
+
+        ensemble = stack_models(self.models)
+        optimizer = get_optimizer('adam', ensemble.parameters(), 0.01, 0.01)
+        trainer = EnsembleTrainer(ensemble, optimizer, data,
+                                  device=torch.device('cpu'))
+        trainer.train(5)
+
+        for i, history in enumerate(histories):
+            for phase in ['train', 'val']:
+                for metric, values in history[phase].items():
+                    np.testing.assert_allclose(
+                        trainer.history[i][phase][metric], values, atol=1e-5)
+            x = torch.as_tensor(self.X)
+            torch.testing.assert_close(ensemble.get_member(i)(x),
+                                       separate_models[i](x))
+
+    def test_metrics_match_sklearn(self):
+        y_true = np.array([0, 0, 0, 0])
+        y_pred = np.array([0, 1, 0, 0])
+        confusion = np.zeros((1, 2, 2))
+        np.add.at(confusion[0], (y_true, y_pred), 1)
+        metrics = EnsembleTrainer.get_metrics(confusion)[0]
+        self.assertAlmostEqual(metrics['accuracy'],
+                               accuracy_score(y_true, y_pred))
+        self.assertAlmostEqual(metrics['f1_score'],
+                               f1_score(y_true, y_pred, average='macro'))
+
+    def test_artifact_averages_members(self):
+        ensemble = stack_models(self.models)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'ensemble.pt')
+            save_artifact(ensemble, {'n_members': 3, 'input_size': 60,
+                                     'hidden_size': 8, 'output_size': 2}, path)
+            loaded = load_artifact(path)
+            outs = loaded.predict_proba(self.X)
+        with torch.no_grad():
+            expected = torch.stack([model(torch.as_tensor(self.X))
+                                    for model in self.models]).mean(dim=0)
+        np.testing.assert_allclose(outs, expected.numpy(), atol=1e-6)
+
+
+if __name__ == "__main__":
+    unittest.main()
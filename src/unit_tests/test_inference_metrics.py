@@ -0,0 +1,84 @@
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import http.client
+import tempfile
+import unittest
+
+from inference_metrics import InferenceMetrics, start_metrics_server
+
+
+def parse_samples(text: str) -> dict:
+    """Returns {name_with_labels: value} of non-comment lines."""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+class TestInferenceMetrics(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.metrics = InferenceMetrics()
+        self.metrics.observe_model_load(0.5)
+        self.metrics.observe_stage('fetch', 0.2, 100, round_trips=2)
+        self.metrics.observe_stage('fetch', 0.1, 50, round_trips=1)
+        self.metrics.observe_stage('forward', 0.05, 150)
+        self.metrics.observe_stage('write', 0.25, 150, round_trips=1)
+        self.metrics.observe_run(1.5, 150, backlog_rows=150)
+
+    def test_render(self):
+        text = self.metrics.render()
+        samples = parse_samples(text)
+        self.assertEqual(samples['sonar_inference_rows_fetched_total'], 150)
+        self.assertEqual(samples['sonar_inference_rows_predicted_total'], 150)
+        self.assertEqual(samples['sonar_inference_db_round_trips_total'], 4)
+        self.assertAlmostEqual(
+            samples['sonar_inference_stage_seconds_sum{stage="fetch"}'], 0.3)
+        self.assertEqual(
+            samples['sonar_inference_stage_seconds_count{stage="fetch"}'], 2)
+        self.assertEqual(
+            samples['sonar_inference_stage_rows_total{stage="forward"}'], 150)
+        self.assertEqual(samples['sonar_inference_backlog_rows'], 150)
+        self.assertEqual(samples['sonar_inference_model_load_seconds'], 0.5)
+        self.assertEqual(samples['sonar_inference_last_run_rows_per_second'], 100)
+        self.assertIn("# TYPE sonar_inference_stage_seconds summary", text)
+        # Every metric has HELP and TYPE.
+        self.assertEqual(text.count("# HELP"), text.count("# TYPE"))
+
+    def test_unknown_stage(self):
+        with self.assertRaises(ValueError):
+            self.metrics.observe_stage('read', 0.1)
+
+    def test_textfile(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'inference.prom')
+            self.metrics.write_textfile(path)
+            self.assertEqual(os.listdir(tmp_dir), ['inference.prom'])
+            with open(path) as f:
+                self.assertEqual(f.read(), self.metrics.render())
+
+    def test_http_endpoint(self):
+        server = start_metrics_server(self.metrics, 0, host='127.0.0.1')
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1',
+                                              server.server_address[1])
+            conn.request('GET', '/metrics')
+            response = conn.getresponse()
+            self.assertEqual(response.status, 200)
+            self.assertTrue(response.getheader('Content-Type').startswith(
+                'text/plain; version=0.0.4'))
+            self.assertEqual(response.read().decode(), self.metrics.render())
+            conn.request('GET', '/health')
+            response = conn.getresponse()
+            response.read()
+            self.assertEqual(response.status, 404)
+            conn.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    unittest.main()
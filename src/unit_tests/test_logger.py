@@ -0,0 +1,72 @@
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import logging
+import tempfile
+import unittest
+from unittest import mock
+
+from logger import Lazy, Logger, flush_logs, get_env_log_level
+
+
+class TestLogger(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_path = os.path.join(self.tmp_dir.name, 'test.log')
+
+    def tearDown(self) -> None:
+        flush_logs()
+        self.tmp_dir.cleanup()
+
+    def read_log(self) -> str:
+        flush_logs()
+        with open(self.log_path) as f:
+            return f.read()
+
+    def test_get_logger_is_idempotent(self):
+        logger = Logger(show=False, filename=self.log_path).get_logger('idempotent')
+        Logger(show=False, filename=self.log_path).get_logger('idempotent')
+        self.assertEqual(len(logger.handlers), 1)
+        logger.info("once")
+        # The second Logger doesn't truncate the file.
+        Logger(show=False, filename=self.log_path).get_logger('other').info("twice")
+        log = self.read_log()
+        self.assertEqual(log.count("once"), 1)
+        self.assertIn("twice", log)
+
+    def test_lazy_payload(self):
+        calls = []
+
+        def payload():
+            calls.append(1)
+            return "expensive"
+
+        logger = Logger(show=False, filename=self.log_path,
+                        level=logging.INFO).get_logger('lazy')
+        logger.debug("payload: %s", Lazy(payload))
+        self.assertEqual(calls, [])
+        logger.setLevel(logging.DEBUG)
+        logger.debug("payload: %s", Lazy(payload))
+        self.assertEqual(calls, [1])
+        self.assertIn("payload: expensive", self.read_log())
+
+    def test_exception_traceback(self):
+        logger = Logger(show=False, filename=self.log_path).get_logger('exception')
+        try:
+            raise ValueError("bad value")
+        except ValueError:
+            logger.exception("failed")
+        log = self.read_log()
+        self.assertIn("failed", log)
+        self.assertIn("ValueError: bad value", log)
+
+    def test_env_log_level(self):
+        for value, level in [('info', logging.INFO), (' Warning', logging.WARNING),
+                             ('verbose', logging.DEBUG)]:
+            with mock.patch.dict(os.environ, {'LOG_LEVEL': value}), \
+                    mock.patch('sys.stderr'):
+                self.assertEqual(get_env_log_level(), level)
+
+
+if __name__ == "__main__":
+    unittest.main()
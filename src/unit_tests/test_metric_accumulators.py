@@ -0,0 +1,57 @@
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import unittest
+
+import numpy as np
+from sklearn.metrics import accuracy_score, f1_score
+import torch
+
+from metric_accumulators import (ConfusionMatrixAccumulator, LossAccumulator,
+                                 get_confusion_metrics)
+
+
+class TestMetricAccumulators(unittest.TestCase):
+
+    def check_same_as_sklearn(self, batches):
+        accumulator = ConfusionMatrixAccumulator(torch.device('cpu'))
+        for outputs, labels in batches:
+            accumulator.update(outputs, labels)
+        labels = torch.cat([labels for _, labels in batches]).numpy()
+        preds = torch.cat([outputs.argmax(dim=1)
+                           for outputs, _ in batches]).numpy()
+        metrics = accumulator.compute()
+        self.assertEqual(metrics['accuracy'], accuracy_score(labels, preds))
+        self.assertAlmostEqual(metrics['f1_score'],
+                               f1_score(labels, preds, average='macro'),
+                               places=12)
+
+    def test_confusion_matrix(self):
+        torch.manual_seed(0)
+        batches = [(torch.rand(n, 2), torch.randint(0, 2, (n,)))
+                   for n in [8, 8, 3]]
+        self.check_same_as_sklearn(batches)
+
+    def test_missing_class(self):
+        # sklearn averages F1 only over classes in labels or predictions.
+        outputs = torch.tensor([[0.9, 0.1], [0.8, 0.2], [0.3, 0.7]])
+        self.check_same_as_sklearn([(outputs, torch.tensor([0, 0, 0]))])
+        outputs = torch.tensor([[0.1, 0.9, 0.0], [0.8, 0.1, 0.1]])
+        self.check_same_as_sklearn([(outputs, torch.tensor([1, 0]))])
+
+    def test_leading_dimensions(self):
+        confusion = np.array([[[3, 1], [0, 4]], [[2, 0], [0, 0]]])
+        metrics = get_confusion_metrics(confusion)
+        np.testing.assert_allclose(metrics['accuracy'], [7 / 8, 1.0])
+        np.testing.assert_allclose(metrics['f1_score'][1], 1.0)
+
+    def test_loss(self):
+        losses = [torch.tensor(x) for x in [0.7, 0.65, 0.6123]]
+        accumulator = LossAccumulator()
+        for loss in losses:
+            accumulator.update(loss)
+        expected = sum(loss.item() for loss in losses) / len(losses)
+        self.assertEqual(accumulator.compute(), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -38,6 +38,17 @@ class TestModel(unittest.TestCase):
         model_output_second = self.model(X)
         
         self.assertTrue(torch.equal(model_output_first, model_output_second))
+
+    def test_predict_proba_batched(self):
+        """
+        Checks that predicting in batches gives the same outputs
+        as predicting all rows at once.
+        """
+        self.model.eval()
+        X = torch.randn(10, 60).numpy()
+        torch.testing.assert_close(
+            torch.from_numpy(self.model.predict_proba(X, batch_size=3)),
+            torch.from_numpy(self.model.predict_proba(X)))
         
 
 if __name__ == "__main__":
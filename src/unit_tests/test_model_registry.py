@@ -0,0 +1,54 @@
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import tempfile
+import unittest
+
+import torch
+
+from model import MlpSonarModel
+from model_registry import ModelRegistry, save_artifact, load_artifact
+
+
+MODEL_CONFIG = {'input_size': 60, 'hidden_size': 40, 'output_size': 2}
+
+
+class TestModelRegistry(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'mlp.pt')
+        self.model = MlpSonarModel(**MODEL_CONFIG)
+        self.model.eval()
+        save_artifact(self.model, MODEL_CONFIG, self.path)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_roundtrip(self):
+        """
+        Checks that a loaded artifact gives the same outputs as the model.
+        """
+        X = torch.randn(5, 60)
+        loaded = load_artifact(self.path)
+        with torch.no_grad():
+            self.assertTrue(torch.equal(self.model(X), loaded(X)))
+
+    def test_cache_and_hot_swap(self):
+        """
+        Checks that an unchanged artifact is served from cache
+        and a changed one is reloaded.
+        """
+        registry = ModelRegistry()
+        first = registry.get(self.path)
+        self.assertIs(registry.get(self.path), first)
+
+        new_model = MlpSonarModel(**MODEL_CONFIG)
+        save_artifact(new_model, MODEL_CONFIG, self.path)
+        second = registry.get(self.path)
+        self.assertIsNot(second, first)
+        self.assertTrue(torch.equal(second.model[0].weight,
+                                    new_model.model[0].weight))
+
+
+if __name__ == "__main__":
+    unittest.main()
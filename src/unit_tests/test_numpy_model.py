@@ -0,0 +1,52 @@
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+
+from model import MlpSonarModel
+from numpy_model import NumpyMlpSonarModel, export_npz
+
+
+class TestNumpyModel(unittest.TestCase):
+
+    def setUp(self) -> None:
+        torch.manual_seed(0)
+        self.model = MlpSonarModel(input_size=60,
+                                   hidden_size=40,
+                                   output_size=2)
+        self.model.eval()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'mlp.npz')
+        export_npz(self.model, self.path)
+        self.numpy_model = NumpyMlpSonarModel.from_npz(self.path)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_matches_torch_forward(self):
+        """
+        Checks that numpy outputs match MlpSonarModel.forward
+        within float32 tolerance, including for extreme inputs.
+        """
+        X = np.random.default_rng(0).random((100, 60), dtype=np.float32)
+        X[0] *= 1e4
+        X[1] *= -1e4
+        with torch.no_grad():
+            expected = self.model(torch.from_numpy(X)).numpy()
+        actual = self.numpy_model.predict_proba(X)
+        self.assertEqual(actual.dtype, np.float32)
+        np.testing.assert_allclose(actual, expected, rtol=1e-5, atol=1e-6)
+
+    def test_batched_equals_full(self):
+        X = np.random.default_rng(1).random((10, 60))
+        # BLAS may block the products differently for different batch sizes.
+        np.testing.assert_allclose(
+            self.numpy_model.predict_proba(X, batch_size=3),
+            self.numpy_model.predict_proba(X), rtol=1e-6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,28 @@
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import unittest
+
+from parallel_inference import split_id_range
+
+
+class TestSplitIdRange(unittest.TestCase):
+
+    def test_shards_cover_range_once(self):
+        """
+        Checks that shards are contiguous and cover [min_id, max_id]
+        without overlaps.
+        """
+        for min_id, max_id, n_shards in [(1, 208, 4), (5, 5, 3), (10, 1000, 7)]:
+            shards = split_id_range(min_id, max_id, n_shards)
+            ids = [i for low, high in shards for i in range(low + 1, high + 1)]
+            self.assertEqual(ids, list(range(min_id, max_id + 1)))
+
+    def test_no_empty_shards(self):
+        shards = split_id_range(1, 3, 10)
+        self.assertEqual(len(shards), 3)
+        for low, high in shards:
+            self.assertLess(low, high)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import configparser
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from logger import Logger
+from pipeline import PipelineRunner, Stage
+
+
+# Appends its name and start/end times to a log and copies input to output.
+STAGE_SCRIPT = """
+import sys, time
+name, input_path, output_path, log_path, sleep = sys.argv[1:]
+start = time.time()
+time.sleep(float(sleep))
+with open(input_path) as f_in, open(output_path, 'w') as f_out:
+    f_out.write(f_in.read())
+with open(log_path, 'a') as f:
+    f.write(f"{name} {start} {time.time()}\\n")
+"""
+
+
+class TestPipelineRunner(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.logger = Logger(show=False).get_logger(__name__)
+        self.dir = tempfile.mkdtemp()
+        self.script = self.path('stage.py')
+        with open(self.script, 'w') as f:
+            f.write(STAGE_SCRIPT)
+        with open(self.path('data.txt'), 'w') as f:
+            f.write('data')
+        self.config_path = self.path('config.ini')
+        config = configparser.ConfigParser()
+        config['DATA'] = {'path': self.path('data.txt')}
+        with open(self.config_path, 'w') as f:
+            config.write(f)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.dir)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.dir, name)
+
+    def make_stage(self, name, input_name, output_name, deps=(), sleep=0):
+        return Stage(name,
+                     [[sys.executable, self.script, name,
+                       self.path(input_name), self.path(output_name),
+                       self.path('runs.log'), str(sleep)]],
+                     deps=deps,
+                     inputs=[self.path(input_name)],
+                     outputs=[self.path(output_name)])
+
+    def make_runner(self, sleep=0):
+        stages = [
+            self.make_stage('a', 'data.txt', 'a.txt'),
+            self.make_stage('b', 'a.txt', 'b.txt', deps=['a'], sleep=sleep),
+            self.make_stage('c', 'a.txt', 'c.txt', deps=['a'], sleep=sleep),
+        ]
+        return PipelineRunner(stages, self.logger, self.path('cache'),
+                              config_path=self.config_path,
+                              src_dir=self.dir)
+
+    def get_runs(self):
+        if not os.path.exists(self.path('runs.log')):
+            return []
+        with open(self.path('runs.log')) as f:
+            return [line.split() for line in f]
+
+    def test_unchanged_stages_are_skipped(self):
+        statuses = self.make_runner().run()
+        self.assertEqual(statuses, {'a': 'ran', 'b': 'ran', 'c': 'ran'})
+        statuses = self.make_runner().run()
+        self.assertEqual(statuses, {'a': 'cached', 'b': 'cached', 'c': 'cached'})
+        self.assertEqual(len(self.get_runs()), 3)
+
+    def test_changed_input_reruns_downstream(self):
+        self.make_runner().run()
+        with open(self.path('data.txt'), 'w') as f:
+            f.write('new data')
+        statuses = self.make_runner().run(['b'])
+        self.assertEqual(statuses, {'a': 'ran', 'b': 'ran'})
+        with open(self.path('b.txt')) as f:
+            self.assertEqual(f.read(), 'new data')
+
+    def test_missing_output_is_restored(self):
+        self.make_runner().run()
+        os.remove(self.path('a.txt'))
+        statuses = self.make_runner().run()
+        self.assertEqual(set(statuses.values()), {'cached'})
+        with open(self.path('a.txt')) as f:
+            self.assertEqual(f.read(), 'data')
+
+    def test_independent_stages_run_in_parallel(self):
+        self.make_runner(sleep=0.5).run()
+        intervals = {name: (float(start), float(end))
+                     for name, start, end in self.get_runs()}
+        self.assertLess(intervals['b'][0], intervals['c'][1])
+        self.assertLess(intervals['c'][0], intervals['b'][1])
+
+    def test_failed_stage_stops_downstream(self):
+        os.remove(self.path('data.txt'))
+        statuses = self.make_runner().run()
+        self.assertEqual(statuses, {'a': 'failed', 'b': 'upstream failed',
+                                    'c': 'upstream failed'})
+
+    def test_exception_in_stage_marks_it_failed(self):
+        runner = self.make_runner()
+        run_cmds = runner._run_cmds
+
+        def run_cmds_failing_b(stage):
+            if stage.name == 'b':
+                raise PermissionError("Can't write the log")
+            return run_cmds(stage)
+
+        with mock.patch.object(runner, '_run_cmds', run_cmds_failing_b):
+            statuses = runner.run()
+        self.assertEqual(statuses, {'a': 'ran', 'b': 'failed', 'c': 'ran'})
+        # The state of the stages that ran is saved.
+        statuses = self.make_runner().run(['c'])
+        self.assertEqual(statuses, {'a': 'cached', 'c': 'cached'})
+
+
+if __name__ == "__main__":
+    unittest.main()
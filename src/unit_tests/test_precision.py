@@ -0,0 +1,70 @@
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import gc
+import unittest
+import weakref
+
+import numpy as np
+import torch
+
+from engines import PRECISIONS
+from model import MlpSonarEnsemble, MlpSonarModel
+from precision import check_parity, convert_precision
+
+
+class TestPrecision(unittest.TestCase):
+
+    def setUp(self) -> None:
+        torch.manual_seed(0)
+        self.model = MlpSonarModel(input_size=60,
+                                   hidden_size=40,
+                                   output_size=2)
+        self.model.eval()
+        self.X = np.random.default_rng(0).random((50, 60), dtype=np.float32)
+
+    def test_outputs_close_to_fp32(self):
+        expected = self.model.predict_proba(self.X)
+        for precision in PRECISIONS:
+            with self.subTest(precision=precision):
+                actual = convert_precision(self.model, precision).predict_proba(self.X)
+                self.assertEqual(actual.dtype, np.float32)
+                np.testing.assert_allclose(actual, expected, atol=0.05)
+
+    def test_original_model_unchanged(self):
+        weight = self.model.model[0].weight.detach().clone()
+        for precision in PRECISIONS:
+            convert_precision(self.model, precision)
+        self.assertEqual(self.model.model[0].weight.dtype, torch.float32)
+        self.assertTrue(torch.equal(self.model.model[0].weight, weight))
+
+    def test_converted_models_are_cached_and_freed(self):
+        model = MlpSonarModel()
+        converted = convert_precision(model, 'bf16')
+        self.assertIs(convert_precision(model, 'bf16'), converted)
+        model_ref = weakref.ref(model)
+        converted_ref = weakref.ref(converted)
+        del model, converted
+        gc.collect()
+        self.assertIsNone(model_ref())
+        self.assertIsNone(converted_ref())
+
+    def test_int8_ensemble_is_rejected(self):
+        ensemble = MlpSonarEnsemble(n_members=2)
+        with self.assertRaises(ValueError):
+            convert_precision(ensemble, 'int8')
+        self.assertIsNotNone(convert_precision(ensemble, 'bf16'))
+
+    def test_check_parity_reports(self):
+        y = self.model.predict_proba(self.X).argmax(axis=1)
+        reports = check_parity(self.model, ['fp32', 'bf16'],
+                               {'random': (self.X, y)}, throughput_rows=100)
+        self.assertEqual([(r['precision'], r['dataset']) for r in reports],
+                         [('fp32', 'random'), ('fp32', 'throughput'),
+                          ('bf16', 'random'), ('bf16', 'throughput')])
+        self.assertEqual(reports[0]['accuracy'], 1.0)
+        self.assertEqual(reports[0]['m_probability_max_drift'], 0.0)
+        self.assertGreater(reports[1]['rows_per_second'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
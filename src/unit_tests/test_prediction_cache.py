@@ -0,0 +1,86 @@
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import unittest
+
+import numpy as np
+import torch
+
+from labels import get_preds_and_m_probs
+from model import MlpSonarModel
+from prediction_cache import PredictionCache
+
+
+class CountingModel:
+    """Wraps a model and records sizes of predicted batches."""
+    def __init__(self, model):
+        self.model = model
+        self.batch_sizes = []
+
+    def predict_proba(self, X, batch_size=None):
+        self.batch_sizes.append(len(X))
+        return self.model.predict_proba(X, batch_size)
+
+
+class TestPredictionCache(unittest.TestCase):
+
+    def setUp(self) -> None:
+        torch.manual_seed(0)
+        model = MlpSonarModel(input_size=60,
+                              hidden_size=40,
+                              output_size=2)
+        model.eval()
+        self.model = CountingModel(model)
+        rng = np.random.default_rng(0)
+        unique = rng.random((50, 60), dtype=np.float32)
+        self.X = unique[rng.integers(0, len(unique), 400)]
+
+    def test_predictions_match_model(self):
+        cache = PredictionCache('v1')
+        preds, m_probs = cache.predict(self.model, self.X)
+        expected_preds, expected_m_probs = get_preds_and_m_probs(
+            self.model.model.predict_proba(self.X))
+        np.testing.assert_array_equal(preds, expected_preds)
+        np.testing.assert_allclose(m_probs, expected_m_probs, rtol=1e-6)
+
+    def test_only_unique_misses_are_predicted(self):
+        cache = PredictionCache('v1')
+        n_unique = len(np.unique(self.X, axis=0))
+        cache.predict(self.model, self.X)
+        self.assertEqual(self.model.batch_sizes, [n_unique])
+        cache.predict(self.model, self.X)
+        self.assertEqual(self.model.batch_sizes, [n_unique])
+        stats = cache.get_stats()
+        self.assertEqual(stats['misses'], n_unique)
+        self.assertEqual(stats['hits'], n_unique)
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_near_duplicates_share_key(self):
+        cache = PredictionCache('v1', decimals=4)
+        X = np.round(self.X[:1].astype(np.float64), 4)
+        keys = cache.get_keys(cache.quantise(np.concatenate([X, X + 1e-6])))
+        self.assertEqual(keys[0], keys[1])
+        keys = cache.get_keys(cache.quantise(np.concatenate([X, X + 1e-3])))
+        self.assertNotEqual(keys[0], keys[1])
+
+    def test_lru_eviction(self):
+        cache = PredictionCache('v1', max_size=10)
+        cache.predict(self.model, self.X)
+        self.assertEqual(cache.get_stats()['size'], 10)
+
+    def test_model_version_change_clears_cache(self):
+        cache = PredictionCache('v1')
+        cache.predict(self.model, self.X[:10])
+        cache.set_model_version('v2')
+        self.assertEqual(cache.get_stats()['size'], 0)
+        cache.predict(self.model, self.X[:10])
+        self.assertEqual(len(self.model.batch_sizes), 2)
+
+    def test_empty_input(self):
+        preds, m_probs = PredictionCache('v1').predict(
+            self.model, np.empty((0, 60), dtype=np.float32))
+        self.assertEqual(len(preds), 0)
+        self.assertEqual(len(m_probs), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import http.client
+import json
+import logging
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from labels import get_preds_and_m_probs
+from model import MlpSonarModel
+from prediction_server import (MAX_BODY_SIZE, MicroBatcher, create_server,
+                               parse_request)
+
+
+class CountingModel:
+    """Wraps a model and records sizes of predicted batches."""
+    def __init__(self, model):
+        self.model = model
+        self.batch_sizes = []
+
+    def predict_proba(self, X, batch_size=None):
+        self.batch_sizes.append(len(X))
+        return self.model.predict_proba(X, batch_size)
+
+
+class TestPredictionServer(unittest.TestCase):
+
+    def setUp(self) -> None:
+        torch.manual_seed(0)
+        model = MlpSonarModel(input_size=60,
+                              hidden_size=40,
+                              output_size=2)
+        model.eval()
+        self.model = CountingModel(model)
+        self.X = np.random.default_rng(0).random((200, 60), dtype=np.float32)
+
+    def test_batched_predictions_match_model(self):
+        """
+        Checks that concurrent requests are batched, batches don't exceed
+        max_batch_size and every request gets its own prediction.
+        """
+        batcher = MicroBatcher(self.model, max_batch_size=16, max_wait_ms=20)
+        try:
+            futures = [batcher.submit(row) for row in self.X]
+            results = [future.result(timeout=10) for future in futures]
+        finally:
+            batcher.stop()
+        preds, m_probs = get_preds_and_m_probs(self.model.model.predict_proba(self.X))
+        self.assertEqual([pred for pred, _ in results], list(preds))
+        np.testing.assert_allclose([m_prob for _, m_prob in results],
+                                   m_probs, rtol=1e-6)
+        self.assertLessEqual(max(self.model.batch_sizes), 16)
+        self.assertLess(len(self.model.batch_sizes), len(self.X))
+
+    def test_http_predict(self):
+        batcher = MicroBatcher(self.model)
+        server = create_server('127.0.0.1', 0, batcher, logging.getLogger())
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        port = server.server_address[1]
+
+        def post(body):
+            conn = http.client.HTTPConnection('127.0.0.1', port)
+            try:
+                conn.request('POST', '/predict', json.dumps(body))
+                response = conn.getresponse()
+                return response.status, json.loads(response.read())
+            finally:
+                conn.close()
+
+        try:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                responses = list(executor.map(
+                    post, [{'frequencies': row.tolist(), 'id': i}
+                           for i, row in enumerate(self.X[:20])]))
+            status, error = post({'frequencies': [0.0, 1.0]})
+        finally:
+            server.shutdown()
+            server.server_close()
+            batcher.stop()
+
+        preds, m_probs = get_preds_and_m_probs(
+            self.model.model.predict_proba(self.X[:20]))
+        for i, (status_i, response) in enumerate(responses):
+            self.assertEqual(status_i, 200)
+            self.assertEqual(list(response), ['frequencies_id', 'prediction',
+                                              'm_probability'])
+            self.assertEqual(response['frequencies_id'], i)
+            self.assertEqual(response['prediction'], preds[i])
+            self.assertAlmostEqual(response['m_probability'], m_probs[i], places=6)
+        self.assertEqual(status, 400)
+        self.assertIn('error', error)
+
+    def test_parse_request_id(self):
+        frequencies = [0.0] * 60
+        _, frequencies_id = parse_request(
+            json.dumps({'frequencies': frequencies, 'id': 3}).encode())
+        self.assertEqual(frequencies_id, 3)
+        for bad_id in [True, False, 1.5, '3']:
+            with self.assertRaises(ValueError):
+                parse_request(json.dumps(
+                    {'frequencies': frequencies, 'id': bad_id}).encode())
+
+    def test_http_content_length(self):
+        batcher = MicroBatcher(self.model)
+        server = create_server('127.0.0.1', 0, batcher, logging.getLogger())
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        def post(content_length):
+            conn = http.client.HTTPConnection('127.0.0.1',
+                                              server.server_address[1])
+            try:
+                conn.putrequest('POST', '/predict')
+                if content_length is not None:
+                    conn.putheader('Content-Length', content_length)
+                conn.endheaders()
+                response = conn.getresponse()
+                return response.status, json.loads(response.read())
+            finally:
+                conn.close()
+
+        try:
+            for content_length, expected_status in [
+                    (None, 411), ('abc', 400), ('-1', 400),
+                    (str(MAX_BODY_SIZE + 1), 413), ('0', 400)]:
+                status, response = post(content_length)
+                self.assertEqual(status, expected_status, content_length)
+                self.assertIn('error', response)
+        finally:
+            server.shutdown()
+            server.server_close()
+            batcher.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,9 +2,12 @@ import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
 
 import unittest
 import configparser
+import shutil
+import tempfile
 
 import numpy as np
 
+from dataset import load_split
 from logger import Logger
 from prepare_data import DataPreparer, ArgsParser
 
@@ -19,12 +22,22 @@ class TestDataPreparer(unittest.TestCase):
         self.dummy_logger = logger_getter.get_logger(__name__)
         args_parser = ArgsParser(self.dummy_logger)
         self.args = args_parser.get_default_args()
+        # The splits and their paths are written to a temporary directory:
+        # pipeline.py runs unit tests in parallel with stages reading
+        # ./data and config.ini.
+        self.dir = tempfile.mkdtemp()
+        self.config_path = os.path.join(self.dir, 'config.ini')
+        shutil.copy(CONFIG_PATH, self.config_path)
         self.config = configparser.ConfigParser()
-        self.config.read(CONFIG_PATH)
+        self.config.read(self.config_path)
         self.data_preparer = DataPreparer(
             self.args["orig_data_filename"],
-            self.args["save_path"],
-            self.dummy_logger)
+            self.dir,
+            self.dummy_logger,
+            self.config_path)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.dir)
 
     def test_split_data__type(self):
         """
@@ -72,5 +85,60 @@ class TestDataPreparer(unittest.TestCase):
         )
         
 
+class TestStreamingSplit(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.dummy_logger = Logger(show=False).get_logger(__name__)
+        self.dir = tempfile.mkdtemp()
+        # split_data_streaming points SPLIT_DATA at the temporary files,
+        # so it writes a copy of config.ini, not the checked-in one.
+        self.config_path = os.path.join(self.dir, 'config.ini')
+        shutil.copy(CONFIG_PATH, self.config_path)
+        rng = np.random.default_rng(0)
+        self.n_rows = 1000
+        X = rng.random((self.n_rows, 60)).round(4)
+        # Imbalanced classes, 'M' rows are rare.
+        self.y = np.where(rng.random(self.n_rows) < 0.2, 'M', 'R')
+        self.data_path = os.path.join(self.dir, 'data.csv')
+        with open(self.data_path, 'w') as f:
+            for row, label in zip(X, self.y):
+                f.write(','.join(map(str, row)) + f',{label}\n')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.dir)
+
+    def split(self, save_dir: str, test_size: float = 0.25):
+        save_path = os.path.join(self.dir, save_dir)
+        os.makedirs(save_path, exist_ok=True)
+        data_preparer = DataPreparer(self.data_path, save_path,
+                                     self.dummy_logger, self.config_path)
+        counts = data_preparer.split_data_streaming(
+            test_size=test_size, random_state=42, chunk_size=64)
+        return counts, [os.path.join(save_path, f'{kind}.npy') for kind in
+                        ['X_train', 'y_train', 'X_test', 'y_test']]
+
+    def test_stratification(self):
+        for test_size in [0.1, 0.25, 0.5]:
+            counts, paths = self.split(f'split_{test_size}', test_size)
+            X_train, y_train = load_split(*paths[:2])
+            X_test, y_test = load_split(*paths[2:])
+            self.assertEqual(len(X_train) + len(X_test), self.n_rows)
+            self.assertEqual(len(y_train), len(X_train))
+            self.assertEqual(len(y_test), len(X_test))
+            for label in ['M', 'R']:
+                n_label = (self.y == label).sum()
+                self.assertLessEqual(
+                    abs(counts['test'][label] - test_size * n_label), 1)
+                self.assertEqual(counts['train'][label]
+                                 + counts['test'][label], n_label)
+
+    def test_determinism(self):
+        _, first_paths = self.split('first')
+        _, second_paths = self.split('second')
+        for first_path, second_path in zip(first_paths, second_paths):
+            np.testing.assert_array_equal(np.load(first_path),
+                                          np.load(second_path))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,65 @@
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import logging
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import yaml
+
+from sweep import (DEFAULT_SEARCH_SPACE, get_best, get_rungs, is_promoted,
+                   run_sweep, sample_params)
+
+
+class TestSweep(unittest.TestCase):
+
+    def test_rungs(self):
+        self.assertEqual(get_rungs(10, 90, 3), [10, 30, 90])
+        self.assertEqual(get_rungs(10, 80, 3), [10, 30, 80])
+        self.assertEqual(get_rungs(80, 80, 3), [80])
+
+    def test_is_promoted(self):
+        values = [0.5, 0.4, 0.3, 0.6, 0.7, 0.2]
+        # Best 1/3 of 6 losses are 0.2 and 0.3.
+        self.assertTrue(is_promoted(0.3, values, 3, minimize=True))
+        self.assertFalse(is_promoted(0.4, values, 3, minimize=True))
+        self.assertTrue(is_promoted(0.6, values, 3, minimize=False))
+        self.assertFalse(is_promoted(0.5, values, 3, minimize=False))
+        # The first trial at a rung always continues.
+        self.assertTrue(is_promoted(0.9, [0.9], 3, minimize=True))
+
+    def test_sample_params(self):
+        rng = np.random.default_rng(0)
+        for _ in range(20):
+            params = sample_params(DEFAULT_SEARCH_SPACE, rng)
+            self.assertIn(params['hidden_size'],
+                          DEFAULT_SEARCH_SPACE['hidden_size']['values'])
+            self.assertIsInstance(params['hidden_size'], int)
+            self.assertTrue(1e-4 <= params['lr'] <= 1e-1)
+
+    def test_run_sweep(self):
+        exp_path = tempfile.mkdtemp()
+        try:
+            results = run_sweep(DEFAULT_SEARCH_SPACE, n_trials=4, workers=1,
+                                min_epochs=1, max_epochs=4,
+                                reduction_factor=2, metric='loss', seed=0,
+                                exp_path=exp_path,
+                                logger=logging.getLogger(__name__))
+            self.assertEqual(len(results), 4)
+            self.assertEqual(len(os.listdir(exp_path)), 4)
+            for result in results:
+                self.assertIn(result['epochs'], [1, 2, 4])
+            best = get_best(results, 'loss')
+            self.assertEqual(best['status'], 'completed')
+            with open(os.path.join(exp_path, os.listdir(exp_path)[0],
+                                   'exp_config.yaml')) as f:
+                exp_data = yaml.safe_load(f)
+            self.assertEqual(exp_data['model'], 'mlp')
+            self.assertIn('hidden_size', exp_data['model params'])
+        finally:
+            shutil.rmtree(exp_path)
+
+
+if __name__ == "__main__":
+    unittest.main()
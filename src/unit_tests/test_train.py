@@ -0,0 +1,146 @@
+import sys; import os; sys.path.insert(1, os.path.join(os.getcwd(), "src"))
+
+import tempfile
+import unittest
+
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+from model import MlpSonarModel
+from train import (TRAIN_PARAMS_DEFAULTS, Trainer, get_optimizer,
+                   get_stopping_kwargs)
+
+
+class TestEarlyStopping(unittest.TestCase):
+
+    def get_trainer(self, lr=0.01):
+        torch.manual_seed(0)
+        # Random labels: the model overfits and validation loss grows.
+        X = torch.rand(60, 60)
+        y = torch.randint(0, 2, (60,))
+        dataloaders = {
+            'train': DataLoader(TensorDataset(X[:40], y[:40]), batch_size=40),
+            'val': DataLoader(TensorDataset(X[40:], y[40:]), batch_size=20),
+        }
+        model = MlpSonarModel()
+        return Trainer(model, get_optimizer('adam', model.parameters(), lr),
+                       torch.nn.CrossEntropyLoss(), dataloaders,
+                       device=torch.device('cpu'))
+
+    def get_val_loss(self, trainer):
+        X, y = trainer.dataloaders['val'].dataset.tensors
+        trainer.model.eval()
+        with torch.no_grad():
+            return trainer.criterion(trainer.model(X), y).item()
+
+    def test_no_criteria(self):
+        trainer = self.get_trainer()
+        self.assertEqual(trainer.train(5), 'epochs')
+        self.assertEqual(trainer.history['stop']['epochs'], 5)
+        self.assertEqual(len(trainer.history['val']['loss']), 5)
+
+    def test_patience_restores_best(self):
+        trainer = self.get_trainer(lr=0.05)
+        reason = trainer.train(200, patience=5, restore_best=True)
+        self.assertEqual(reason, 'patience')
+        stop = trainer.history['stop']
+        self.assertEqual(stop['epochs'], stop['best_epoch'] + 6)
+        val_losses = trainer.history['val']['loss']
+        self.assertEqual(min(val_losses), val_losses[stop['best_epoch']])
+        # The weights validated at the best epoch are restored.
+        self.assertAlmostEqual(self.get_val_loss(trainer),
+                               val_losses[stop['best_epoch']], places=5)
+
+    def test_target(self):
+        trainer = self.get_trainer()
+        reason = trainer.train(50, target={'accuracy': 0.0})
+        self.assertEqual(reason, 'target')
+        self.assertEqual(trainer.history['stop']['epochs'], 1)
+        trainer = self.get_trainer()
+        reason = trainer.train(3, target={'loss': 0.0})
+        self.assertEqual(reason, 'epochs')
+
+    def test_time_budget(self):
+        trainer = self.get_trainer()
+        self.assertEqual(trainer.train(10 ** 6, time_budget=0.2), 'time_budget')
+        # The budget is kept by estimate: an epoch may be slower than
+        # the average one.
+        self.assertLess(trainer.history['stop']['seconds'], 0.4)
+
+    def test_stopping_kwargs(self):
+        kwargs = get_stopping_kwargs(TRAIN_PARAMS_DEFAULTS)
+        self.assertIsNone(kwargs['patience'])
+        self.assertFalse(kwargs['restore_best'])
+        kwargs = get_stopping_kwargs({**TRAIN_PARAMS_DEFAULTS, 'patience': 10,
+                                      'target': 'f1_score:0.9, loss:0.4'})
+        self.assertEqual(kwargs['patience'], 10)
+        self.assertEqual(kwargs['target'], {'f1_score': 0.9, 'loss': 0.4})
+        self.assertTrue(kwargs['restore_best'])
+        for target in ['f1:0.9', 'f1_score=0.9', 'f1_score:high',
+                       'f1_score:0.9:1']:
+            with self.assertRaises(ValueError):
+                get_stopping_kwargs({**TRAIN_PARAMS_DEFAULTS, 'target': target})
+
+    def test_unknown_target_metric(self):
+        trainer = self.get_trainer()
+        with self.assertRaises(ValueError):
+            trainer.train(3, target={'f1': 0.9})
+        self.assertEqual(trainer.epoch, 0)
+
+
+class TestCheckpoints(unittest.TestCase):
+
+    def get_trainer(self, **kwargs):
+        generator = torch.Generator().manual_seed(0)
+        X = torch.rand(64, 60, generator=generator)
+        y = torch.randint(0, 2, (64,), generator=generator)
+        dataloaders = {
+            # Shuffled small batches: resuming depends on the RNG state.
+            'train': DataLoader(TensorDataset(X[:48], y[:48]), batch_size=8,
+                                shuffle=True),
+            'val': DataLoader(TensorDataset(X[48:], y[48:]), batch_size=16),
+        }
+        model = MlpSonarModel()
+        return Trainer(model, get_optimizer('adam', model.parameters(), 0.01),
+                       torch.nn.CrossEntropyLoss(), dataloaders,
+                       device=torch.device('cpu'), **kwargs)
+
+    def test_save_period_requires_path(self):
+        with self.assertRaises(ValueError):
+            self.get_trainer(save_period=2)
+
+    def test_resume_exactly(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'epoch_{epoch}.pt')
+            torch.manual_seed(0)
+            trainer = self.get_trainer(scheduled_state_save_path=path,
+                                       save_period=2, keep_checkpoints=2)
+            trainer.train(8)
+            self.assertEqual(sorted(os.listdir(tmp_dir)),
+                             ['epoch_6.pt', 'epoch_8.pt'])
+
+            torch.manual_seed(1)
+            resumed = self.get_trainer()
+            resumed.load(path.format(epoch=6))
+            self.assertEqual(resumed.epoch, 6)
+            resumed.train(2)
+
+        self.assertEqual(resumed.history['val'], trainer.history['val'])
+        for name, tensor in trainer.model.state_dict().items():
+            torch.testing.assert_close(resumed.model.state_dict()[name], tensor,
+                                       rtol=0, atol=0)
+
+    def test_best_state(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'best.pt')
+            torch.manual_seed(0)
+            trainer = self.get_trainer(best_state_save_path=path)
+            trainer.train(5)
+            best = torch.load(path, weights_only=False)
+            self.assertEqual(best['epoch'], trainer.best_epoch + 1)
+            self.assertEqual(best['best_val_loss'], trainer.best_val_loss)
+            self.assertEqual(os.listdir(tmp_dir), ['best.pt'])
+
+
+if __name__ == "__main__":
+    unittest.main()